@@ -1,164 +1,649 @@
 import logging
 import os
 import sqlite3
-from flask import Flask, send_file, redirect
+from flask import Blueprint, Flask, Response, send_file, redirect, jsonify, abort, request, g
 from werkzeug.utils import secure_filename
 import dash
 from dash import html, dcc
 from dash.dependencies import Input, Output, State
-import dash_bootstrap_components as dbc
 import base64
-import pyvista as pv
 import sys
-import zipfile
+import re
+import json
 from io import BytesIO
 import threading
 import webbrowser
 import time
-import shutil
-import os
-
-def find_directory(start_dir, target_directory_name):
-    for root, dirs, files in os.walk(start_dir):
-        if target_directory_name in dirs:
-            return os.path.join(root, target_directory_name)
-    return None
-
-# Specify the name of the DLL file to find
-dll_filename = 'assimp-vc140-mt.dll'
-
-# Specify the current directory
-current_directory = os.getcwd()
 
-# Specify the starting directory to search for the destination directory
-start_directory = r'C:\\'  # Adjust this path to narrow down the search if needed
-
-# Specify the name of the destination directory to find
-destination_directory_name = 'impasse'
-
-# Construct the full path to the DLL file in the current directory
-source_path = os.path.join(current_directory, dll_filename)
-
-if os.path.exists(source_path):
-    # Find the destination directory
-    destination_directory = find_directory(start_directory, destination_directory_name)
-    
-    if destination_directory:
-        # Create the full destination path
-        destination_path = os.path.join(destination_directory, dll_filename)
-
-        # Copy the DLL file to the destination directory
-        shutil.copy(source_path, destination_path)
-
-        print(f'{source_path} has been copied to {destination_path}')
-    else:
-        print(f'Destination directory {destination_directory_name} not found.')
-else:
-    print(f'File {dll_filename} not found in the current directory {current_directory}')
-
-
-
-import impasse as assimp
+from conversion import convert_model, convert_to_obj, CONVERTIBLE_FORMATS, EXPORT_FORMATS, STORAGE_FORMAT, DEFAULT_POST_PROCESSING
+from jobs import ConversionJobQueue, ConversionQueueFull, describe_job, fail_interrupted_jobs, init_jobs_table
+from conversion_cache import ConversionCache, cache_key, discard_blob, init_cache_table
+from blob_store import BlobStore
+from uploads import ChunkedUploads, UploadError, init_uploads_table
+from mesh_payload import MeshPayloadCache, PAYLOAD_MIMETYPE, init_payload_table
+from mesh_arrays import MeshArrayCache, load_mesh
+from model_artifacts import ModelArtifacts
+from lod import build_lod_pyramid
+from scenes import SceneGraph, build_scene_graph, describe_node, init_scene_table
+from archives import ArchiveCache, archive_key
+from database import QueryCache, close_pool, connect
+from metrics import PROMETHEUS_CONTENT_TYPE, REGISTRY, configure_logging, counter, histogram
+from mesh_metadata import MeshMetadata, build_mesh_metadata, describe_source, init_metadata_table, like_pattern, source_list_query
+from serving import SHUTDOWN_TIMEOUT, TransferLimiter, busy_response
+from textures import (TextureAssets, TextureVariants, THUMBNAIL_SIZE, TEXTURE_PREVIEW_SIZE, build_texture_variants, init_texture_asset_tables,
+                      init_texture_variants_table, migrate_texture_links, recount_texture_references, validate_texture)
+from workspaces import WorkspaceManager
 
 
 # Directories
 DOWNLOAD_DIRECTORY = os.path.join(os.getcwd(), "downloads")
-TEMP_UPLOAD_FOLDER = os.path.join(os.getcwd(), "temp_uploads")
+# Scratch space, every conversion and export gets a workspace of its own in here
+TEMP_UPLOAD_FOLDER = os.environ.get('WORKSPACE_ROOT', os.path.join(os.getcwd(), "temp_uploads"))
+# Earlier versions copied textures here; they are served from the blob store now, so the folder is no longer created
 TEXTURE_UPLOAD_FOLDER = os.path.join(os.getcwd(), "texture_uploads")
 
 if not os.path.exists(DOWNLOAD_DIRECTORY):
     os.makedirs(DOWNLOAD_DIRECTORY)
-if not os.path.exists(TEMP_UPLOAD_FOLDER):
-    os.makedirs(TEMP_UPLOAD_FOLDER)
-if not os.path.exists(TEXTURE_UPLOAD_FOLDER):
-    os.makedirs(TEXTURE_UPLOAD_FOLDER)
-
-# Configure logging
-logging.basicConfig(level=logging.DEBUG,
-                    format='%(asctime)s - %(levelname)s - %(message)s',
-                    handlers=[logging.FileHandler('app.log'), logging.StreamHandler()])
-
-# Initialize Flask server
-server = Flask(__name__)
+
+# Configure logging, LOG_LEVEL=DEBUG with LOG_SAMPLE_RATE below 1 keeps a share of the per-request debug records
+configure_logging()
+
+HTTP_REQUEST_SECONDS = histogram('http_request_seconds', 'Time spent handling HTTP requests', ['endpoint', 'method', 'status'])
+UPLOAD_DECODE_SECONDS = histogram('upload_decode_seconds', 'Time spent decoding base64 uploads from the page', ['kind'])
+UPLOAD_DECODED_BYTES = counter('upload_decoded_bytes_total', 'Bytes decoded from base64 uploads from the page', ['kind'])
+TRANSFERS_REJECTED = counter('transfers_rejected_total', 'Uploads and downloads turned away with 503 because every transfer slot was busy', ['endpoint'])
+ARCHIVE_REQUESTS = counter('download_archive_requests_total', 'Download archive requests by how they were answered', ['result'])
+
+# Routes are registered on each Flask server create_app() builds
+routes = Blueprint('routes', __name__)
 DATABASE = 'files.db'
 MAX_CONTENT_LENGTH = 50 * 1024 * 1024  # 50 MB
-server.config['MAX_CONTENT_LENGTH'] = MAX_CONTENT_LENGTH
+# Models are shown in the page; set DESKTOP_VIEWER=1 to open PyVista windows on the server instead
+DESKTOP_VIEWER = os.environ.get('DESKTOP_VIEWER') == '1'
+# Height of the texture shown under the viewer, the smallest texture level covering it is served
+TEXTURE_PANEL_SIZE = 256
+# Messages kept in the message box, older ones are dropped in the browser
+MESSAGE_HISTORY_SIZE = int(os.environ.get('MESSAGE_HISTORY_SIZE', 50))
+
+# Columns that held file content before it moved to the blob store, with the hash column replacing each
+LEGACY_BLOB_COLUMNS = (
+    ('files', 'original_content', 'original_hash'),
+    ('files', 'obj_content', 'obj_hash'),
+    ('textures', 'texture_content', 'texture_hash'),
+)
+
+# Model and texture content lives in the blob store, the database only keeps hashes
+blob_store = BlobStore()
 
 def init_db():
-    with sqlite3.connect(DATABASE) as conn:
+    with get_db_connection() as conn:
         conn.execute('''
             CREATE TABLE IF NOT EXISTS files (
                 id INTEGER PRIMARY KEY,
                 filename TEXT UNIQUE,
                 original_format TEXT,
-                original_content BLOB,
-                obj_content BLOB
+                original_hash TEXT,
+                obj_hash TEXT,
+                obj_cache_key TEXT,
+                model_format TEXT
             )''')
+        # Databases created by earlier versions lack the newer columns
+        add_missing_columns(conn, 'files', [('original_hash', 'TEXT'), ('obj_hash', 'TEXT'), ('obj_cache_key', 'TEXT'), ('model_format', 'TEXT')])
+        if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'textures'").fetchone():
+            # The per-model textures table is migrated to shared assets below, once its content is in the blob store
+            add_missing_columns(conn, 'textures', [('texture_hash', 'TEXT')])
+        # The source list joins files to mesh_metadata on the model hash
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_files_obj_hash ON files (obj_hash)')
+        init_jobs_table(conn)
+        init_cache_table(conn)
+        init_uploads_table(conn)
+        init_payload_table(conn)
+        init_texture_variants_table(conn)
+        init_texture_asset_tables(conn)
+        init_metadata_table(conn)
+        init_scene_table(conn)
+        conversion_cache.migrate_legacy_entries(conn)
+        moved = migrate_blobs_to_store(conn)
+        migrate_texture_links(conn, blob_store)
+        recount_texture_references(conn)
         conn.execute('''
-            CREATE TABLE IF NOT EXISTS textures (
-                id INTEGER PRIMARY KEY,
-                obj_filename TEXT,
-                texture_filename TEXT,
-                texture_content BLOB,
-                FOREIGN KEY (obj_filename) REFERENCES files (filename)
-            )''')
-        conn.commit()
-
+            UPDATE files SET obj_hash = (SELECT blob_hash FROM conversion_cache WHERE key = files.obj_cache_key)
+            WHERE obj_hash IS NULL AND obj_cache_key IS NOT NULL''')
+        # Models converted before GLB storage are OBJ
+        conn.execute(f'''
+            UPDATE files SET model_format = CASE WHEN original_format IN ({', '.join('?' * len(CONVERTIBLE_FORMATS))}) THEN '.obj' ELSE original_format END
+            WHERE model_format IS NULL AND obj_hash IS NOT NULL''', CONVERTIBLE_FORMATS)
+        fail_interrupted_jobs(conn, blob_store)
+        unindexed = conn.execute('''
+            SELECT filename, obj_hash, model_format FROM files
+            WHERE obj_hash IS NOT NULL AND obj_hash NOT IN (SELECT obj_hash FROM mesh_metadata)''').fetchall()
+    if moved:
+        # Give the space used by the moved blobs back to the filesystem
+        with get_db_connection() as conn:
+            conn.execute('VACUUM')
+    texture_assets.collect_garbage()
+    model_artifacts.collect()
+    # Models stored before the metadata index are indexed in the background
+    for model in unindexed:
+        index_model(model['filename'], model['obj_hash'], model['model_format'])
+
+def add_missing_columns(conn, table, columns):
+    existing = [row[1] for row in conn.execute(f'PRAGMA table_info({table})')]
+    for name, column_type in columns:
+        if name not in existing:
+            conn.execute(f'ALTER TABLE {table} ADD COLUMN {name} {column_type}')
+
+def migrate_blobs_to_store(conn):
+    moved = 0
+    for table, content_column, hash_column in LEGACY_BLOB_COLUMNS:
+        if content_column not in [row[1] for row in conn.execute(f'PRAGMA table_info({table})')]:
+            continue
+        row_ids = conn.execute(f'SELECT id FROM {table} WHERE {content_column} IS NOT NULL AND {hash_column} IS NULL').fetchall()
+        for (row_id,) in row_ids:
+            content = conn.execute(f'SELECT {content_column} FROM {table} WHERE id = ?', (row_id,)).fetchone()[0]
+            conn.execute(f'UPDATE {table} SET {hash_column} = ?, {content_column} = NULL WHERE id = ?', (blob_store.put_bytes(content), row_id))
+            moved += 1
+    if moved:
+        logging.info(f"Moved {moved} blobs from the database to the blob store")
+    return moved
+
+def build_levels_of_detail(filename, obj_hash, ext):
+    logging.debug(f"Queued level-of-detail build for {filename}")
+    conversion_queue.run_in_pool(build_lod_pyramid, DATABASE, blob_store, obj_hash, ext)
+
+def index_model(filename, obj_hash, ext):
+    logging.debug(f"Queued metadata for {filename}")
+    conversion_queue.run_in_pool(build_mesh_metadata, DATABASE, blob_store, obj_hash, ext)
+
+def split_scene(filename, obj_hash, ext):
+    logging.debug(f"Queued scene split for {filename}")
+    conversion_queue.run_in_pool(build_scene_graph, DATABASE, blob_store, obj_hash, ext)
+
+def process_model(filename, obj_hash, ext):
+    # Runs once a model is stored, whether it was uploaded as is or converted
+    index_model(filename, obj_hash, ext)
+    build_levels_of_detail(filename, obj_hash, ext)
+    split_scene(filename, obj_hash, ext)
+
+# Conversions run in background worker processes instead of the callback
+conversion_cache = ConversionCache(DATABASE, blob_store)
+conversion_queue = ConversionJobQueue(DATABASE, convert_model, blob_store, cache=conversion_cache,
+                                      on_converted=process_model)
+
+# Large files are streamed to disk through the chunked upload routes instead of dcc.Upload
+chunked_uploads = ChunkedUploads(DATABASE, blob_store)
+
+# Browser viewer payloads are prepared once per model
+mesh_payloads = MeshPayloadCache(DATABASE, blob_store)
+
+# Counts, bounds, materials and a thumbnail are computed once per model for the source list
+mesh_metadata = MeshMetadata(DATABASE, blob_store)
+
+# The node tree of every model, with each of its meshes cached on its own
+scene_graph = SceneGraph(DATABASE, blob_store)
+
+# Arrays, payloads, levels of detail, metadata and scene splits go once no source uses their model
+model_artifacts = ModelArtifacts(DATABASE, blob_store)
+
+# Uploads and downloads are bounded per server process, see serving.MAX_CONCURRENT_TRANSFERS
+transfer_limiter = TransferLimiter()
+TRANSFER_ENDPOINTS = {'routes.upload_chunk', 'routes.complete_upload', 'routes.download_model'}
+
+# Textures are shared assets stored once per content and linked to models by name
+texture_assets = TextureAssets(DATABASE, blob_store)
+
+# Downscaled texture levels are generated once per texture content
+texture_variants = TextureVariants(DATABASE, blob_store)
+
+def build_texture_levels(filename, texture_hash):
+    logging.debug(f"Queued texture levels for {filename}")
+    conversion_queue.run_in_pool(build_texture_variants, DATABASE, blob_store, texture_hash, os.path.splitext(filename)[1])
+
+# Finished download archives are kept in the downloads folder up to ARCHIVE_CACHE_MAX_BYTES
+download_archives = ArchiveCache(DOWNLOAD_DIRECTORY)
+
+# Scratch directories are evicted least recently used first under WORKSPACE_QUOTA_BYTES by a background thread,
+# which also reports the disk usage of the data directories and expires abandoned chunked uploads
+workspaces = WorkspaceManager(TEMP_UPLOAD_FOLDER, report={'downloads': DOWNLOAD_DIRECTORY, 'blob_store': blob_store.root},
+                              housekeeping=[chunked_uploads.expire])
+
+# Connections come from a per-process pool of WAL-mode connections and are returned on close or exit
 def get_db_connection():
-    conn = sqlite3.connect(DATABASE)
-    conn.row_factory = sqlite3.Row
-    return conn
+    return connect(DATABASE)
+
+# Dropdown lists are kept in memory until the database is written to, up to QUERY_CACHE_MAX_ENTRIES of them
+list_cache = QueryCache(DATABASE)
+FILE_LIST_QUERY = 'SELECT filename FROM files'
+TEXTURE_LIST_QUERY = 'SELECT texture_filename, texture_hash FROM model_textures WHERE obj_filename = ? ORDER BY texture_filename'
+
+def list_files():
+    return [row['filename'] for row in list_cache.fetchall(FILE_LIST_QUERY)]
+
+def list_sources(name_filter='', sort='name', with_uvs=False):
+    pattern = like_pattern(name_filter)
+    return list_cache.fetchall(source_list_query(sort, with_uvs), (pattern, pattern))
+
+def list_textures(obj_filename):
+    return list_cache.fetchall(TEXTURE_LIST_QUERY, (obj_filename,))
+
+def register_source(filename, original_hash):
+    original_format = os.path.splitext(filename)[1].lower()
+    obj_hash = None
+    obj_cache_key = None
+    source_key = None
+    model_format = original_format
+
+    if original_format in CONVERTIBLE_FORMATS:
+        # Converted models are stored as GLB, OBJ and the other export formats are produced on download
+        source_key = cache_key(original_hash, STORAGE_FORMAT, DEFAULT_POST_PROCESSING)
+        model_format = EXPORT_FORMATS[STORAGE_FORMAT][1]
+        obj_hash = conversion_cache.get(source_key)
+        if obj_hash is not None:
+            logging.debug(f"Reusing cached conversion for {filename}")
+            obj_cache_key = source_key
+    else:
+        obj_hash = original_hash
+
+    try:
+        with get_db_connection() as conn:
+            conn.execute('INSERT INTO files (filename, original_format, original_hash, obj_hash, obj_cache_key, model_format) VALUES (?, ?, ?, ?, ?, ?)',
+                         (filename, original_format, original_hash, obj_hash, obj_cache_key, model_format if obj_hash else None))
+    except sqlite3.IntegrityError:
+        # The name is taken; the uploaded bytes are dropped unless another source has the same content
+        with get_db_connection() as conn:
+            discard_blob(conn, blob_store, original_hash)
+        raise
 
-@server.route('/')
+    if obj_hash is None:
+        # The converter reads the source straight from the blob store, the job fills in obj_hash
+        input_path = blob_store.path(original_hash, original_format)
+        workspace = workspaces.create('convert-')
+        output_path = workspace.file(f"{os.path.splitext(filename)[0]}{model_format}")
+        try:
+            return conversion_queue.submit(filename, input_path, output_path, source_key, workspace)
+        except BaseException:
+            workspace.release()
+            raise
+    process_model(filename, obj_hash, model_format)
+    return None
+
+def export_model(obj_hash, model_format, target_format, name='model'):
+    # Export formats other than the stored one are converted once and kept in the conversion cache
+    if EXPORT_FORMATS[target_format][1] == model_format:
+        return obj_hash
+    export_key = cache_key(obj_hash, target_format)
+    export_hash = conversion_cache.get(export_key)
+    if export_hash is not None:
+        return export_hash
+    # The OBJ exporter writes <name>.mtl next to the model and refers to it by that name
+    with workspaces.workspace('export-') as workspace:
+        output_path = workspace.file(f"{name}{EXPORT_FORMATS[target_format][1]}")
+        material_path = workspace.file(f"{name}.mtl")
+        started = time.time()
+        conversion_queue.run_in_pool(convert_model, blob_store.path(obj_hash, model_format), output_path, target_format, ()).result()
+        export_hash = conversion_cache.put(export_key, output_path, time.time() - started, target_format)
+        if os.path.exists(material_path):
+            conversion_cache.put(cache_key(export_hash, 'mtl'), material_path, target_format='mtl')
+        return export_hash
+
+def model_material(obj_hash):
+    # The material library stored with an exported OBJ, named as the OBJ's mtllib line refers to it
+    material_hash = conversion_cache.get(cache_key(obj_hash, 'mtl'), count=False)
+    if material_hash is None:
+        return None
+    with blob_store.open(obj_hash) as f:
+        match = re.search(rb'^mtllib\s+(.+?)\s*$', f.read(64 * 1024), re.MULTILINE)
+    if match is None:
+        return None
+    return os.path.basename(match.group(1).decode(errors='replace')), material_hash
+
+def register_texture(obj_filename, filename, texture_hash):
+    # Raises ValueError when the file is not an image
+    try:
+        validate_texture(blob_store.path(texture_hash))
+    except ValueError:
+        with get_db_connection() as conn:
+            discard_blob(conn, blob_store, texture_hash)
+        raise
+    if not texture_assets.link(obj_filename, filename, texture_hash):
+        return False
+    build_texture_levels(filename, texture_hash)
+    return True
+
+def unregister_texture(obj_filename, filename):
+    # The asset and its levels go once no model links to it and the grace period has passed
+    if not texture_assets.unlink(obj_filename, filename):
+        return False
+    texture_assets.collect_garbage()
+    return True
+
+@routes.route('/')
 def index():
     return redirect('/dash/')
 
-@server.route('/texture_uploads/<filename>')
+def send_texture(texture_hash, ext):
+    size = request.args.get('size', type=int)
+    if size:
+        # ?size=N serves the smallest level at least N pixels on the long side
+        variant = texture_variants.pick(texture_hash, size)
+        if variant is not None:
+            return send_file(blob_store.path(variant['variant_hash'], variant['format'] or ext),
+                             etag=variant['variant_hash'], conditional=True, max_age=3600)
+        # Textures uploaded before levels were generated get them on first use
+        conversion_queue.run_in_pool(build_texture_variants, DATABASE, blob_store, texture_hash, ext)
+    return send_file(blob_store.path(texture_hash, ext), etag=texture_hash, conditional=True, max_age=3600)
+
+@routes.route('/textures/<texture_hash>')
+def serve_texture(texture_hash):
+    # Content-addressed, so every model using the image shares one URL and one browser cache entry
+    asset = texture_assets.get(texture_hash)
+    if asset is None or not blob_store.exists(texture_hash):
+        abort(404)
+    return send_texture(texture_hash, asset['ext'])
+
+@routes.route('/texture_uploads/<filename>')
 def serve_texture_file(filename):
-    return send_file(os.path.join(TEXTURE_UPLOAD_FOLDER, filename))
-
-@server.route('/download-model/<obj_filename>/<texture_filename>')
-def download_model(obj_filename, texture_filename):
-    obj_path = os.path.join(TEMP_UPLOAD_FOLDER, obj_filename)
-    zip_filename = f"{os.path.splitext(obj_filename)[0]}_model.zip"
-    zip_path = os.path.join(DOWNLOAD_DIRECTORY, zip_filename)
-    
-    with zipfile.ZipFile(zip_path, 'w') as zip_file:
-        zip_file.write(obj_path, arcname=obj_filename)
-        if texture_filename != 'view_only_mesh':
-            texture_path = os.path.join(TEXTURE_UPLOAD_FOLDER, texture_filename)
-            zip_file.write(texture_path, arcname=texture_filename)
-    
-    return send_file(zip_path, as_attachment=True)
-
-def convert_to_obj(input_path, output_path):
-    try:
-        logging.debug(f"Loading file for conversion: {input_path}")
-        scene = assimp.load(input_path)
-        if scene.meshes:
-            logging.debug(f"Scene loaded successfully with {len(scene.meshes)} meshes")
-            logging.debug(f"Exporting scene to OBJ: {output_path}")
-            assimp.export(scene, output_path, file_type='obj')
-            logging.debug(f"Exported scene to OBJ successfully")
+    # Older links name the texture only; ?source= picks the model when several use the name
+    with get_db_connection() as conn:
+        source = request.args.get('source')
+        if source:
+            texture = conn.execute('SELECT texture_hash FROM model_textures WHERE obj_filename = ? AND texture_filename = ?',
+                                   (source, filename)).fetchone()
         else:
-            logging.warning("Scene loaded but contains no meshes.")
-            raise ValueError("Loaded scene contains no meshes.")
-    except Exception as e:
-        logging.error(f"Error during conversion: {e}")
-        raise
+            texture = conn.execute('SELECT texture_hash FROM model_textures WHERE texture_filename = ? LIMIT 1', (filename,)).fetchone()
+    if texture is None:
+        abort(404)
+    return send_texture(texture['texture_hash'], os.path.splitext(filename)[1])
+
+@routes.route('/sources/<source_filename>/textures/<texture_filename>', methods=['DELETE'])
+def unlink_texture(source_filename, texture_filename):
+    if not unregister_texture(source_filename, texture_filename):
+        abort(404)
+    return '', 204
+
+@routes.route('/textures')
+def texture_usage():
+    # Stored texture assets, the bytes they take once each, and how many model links share them
+    return jsonify(dict(texture_assets.usage()))
+
+@routes.app_errorhandler(UploadError)
+def handle_upload_error(error):
+    logging.error(f"Upload error: {error}")
+    return jsonify({'error': str(error)}), error.status_code
+
+@routes.app_errorhandler(ConversionQueueFull)
+def handle_conversion_queue_full(error):
+    logging.warning(f"Refused conversion: {error}")
+    return busy_response(str(error))
+
+@routes.route('/uploads', methods=['POST'])
+def start_upload():
+    params = request.get_json(silent=True) or request.form
+    filename = secure_filename(params.get('filename', ''))
+    if not filename:
+        raise UploadError("A filename is required")
+    if params.get('kind', 'source') == 'source' and os.path.splitext(filename)[1].lower() in CONVERTIBLE_FORMATS:
+        # Refused before any bytes are sent when the conversion queue is full
+        conversion_queue.check_capacity()
+    total_size = params.get('size')
+    if total_size is not None:
+        try:
+            total_size = int(total_size)
+        except (TypeError, ValueError):
+            raise UploadError(f"Size must be a number of bytes: {total_size}")
+        if total_size < 0:
+            raise UploadError(f"Size must be a number of bytes: {total_size}")
+    obj_filename = params.get('obj_filename')
+    if params.get('kind', 'source') == 'texture' and obj_filename:
+        # Textures are linked to an existing source, an unknown one is refused before any bytes are sent
+        with get_db_connection() as conn:
+            if conn.execute('SELECT 1 FROM files WHERE filename = ?', (obj_filename,)).fetchone() is None:
+                raise UploadError(f"Unknown source file: {obj_filename}", 404)
+    upload = chunked_uploads.create(filename, params.get('kind', 'source'), obj_filename, total_size)
+    return jsonify(dict(upload)), 201
+
+@routes.route('/uploads/<upload_id>', methods=['GET'])
+def upload_status(upload_id):
+    return jsonify(dict(chunked_uploads.get(upload_id)))
+
+@routes.route('/uploads/<upload_id>', methods=['PUT'])
+def upload_chunk(upload_id):
+    # Chunks carry a "Content-Range: bytes <start>-<end>/<total>" header, a missing header appends
+    content_range = request.headers.get('Content-Range')
+    if content_range:
+        try:
+            offset = int(content_range.split()[1].split('-')[0])
+        except (IndexError, ValueError):
+            raise UploadError(f"Malformed Content-Range header: {content_range}")
+    else:
+        offset = chunked_uploads.get(upload_id)['received']
+    received = chunked_uploads.append(upload_id, offset, request.stream)
+    return jsonify({'id': upload_id, 'received': received})
+
+@routes.route('/uploads/<upload_id>', methods=['DELETE'])
+def abort_upload(upload_id):
+    chunked_uploads.abort(upload_id)
+    return '', 204
+
+@routes.route('/uploads/<upload_id>/complete', methods=['POST'])
+def complete_upload(upload_id):
+    upload, digest = chunked_uploads.complete(upload_id)
+    result = {'filename': upload['filename'], 'hash': digest, 'size': blob_store.size(digest)}
+    if upload['kind'] == 'source':
+        try:
+            result['job_id'] = register_source(upload['filename'], digest)
+        except sqlite3.IntegrityError:
+            raise UploadError(f"Source file already exists: {upload['filename']}", 409)
+    else:
+        try:
+            registered = register_texture(upload['obj_filename'], upload['filename'], digest)
+        except ValueError as e:
+            raise UploadError(f"{upload['filename']}: {e}", 415)
+        if not registered:
+            raise UploadError(f"Texture file already linked to this source: {upload['filename']}", 409)
+    logging.debug(f"Registered {upload['kind']} file from chunked upload: {upload['filename']}")
+    return jsonify(result), 201
+
+def get_model(source_filename):
+    with get_db_connection() as conn:
+        model = conn.execute('SELECT model_format, obj_hash FROM files WHERE filename = ?', (source_filename,)).fetchone()
+    if model is None or model['obj_hash'] is None:
+        abort(404)
+    return model
+
+def scene_nodes(model):
+    # Models stored before scene support, or whose split is still queued, are split on the worker pool now
+    nodes = scene_graph.nodes(model['obj_hash'])
+    if not nodes:
+        conversion_queue.run_in_pool(build_scene_graph, DATABASE, blob_store, model['obj_hash'], model['model_format']).result()
+        nodes = scene_graph.nodes(model['obj_hash'])
+    return nodes
+
+def requested_nodes():
+    # ?nodes=1,4 picks meshes of the scene by node id
+    try:
+        return sorted({int(node_id) for node_id in request.args.get('nodes', '').split(',') if node_id.strip()})
+    except ValueError:
+        abort(400)
 
-def show_mesh_with_texture(mesh_path, texture_content=None):
+def scene_subset(model, node_ids):
+    scene_nodes(model)
+    try:
+        return scene_graph.subset(model['obj_hash'], model['model_format'], node_ids)
+    except KeyError:
+        abort(404)
+
+@routes.route('/mesh/<source_filename>')
+def serve_mesh(source_filename):
+    model = get_model(source_filename)
+    level = request.args.get('level', 0, type=int)
+    node_ids = requested_nodes()
+    if node_ids:
+        # Only the chosen meshes, at full resolution
+        payload = mesh_payloads.get(scene_subset(model, node_ids))
+    else:
+        payload = mesh_payloads.get(model['obj_hash'], model['model_format'], level)
+    return send_file(blob_store.path(payload['payload_hash']), mimetype=PAYLOAD_MIMETYPE,
+                     etag=payload['payload_hash'], conditional=True, max_age=3600)
+
+@routes.route('/mesh/<source_filename>/levels')
+def mesh_levels(source_filename):
+    model = get_model(source_filename)
+    return jsonify([{'level': payload['level'], 'n_points': payload['n_points'], 'n_faces': payload['n_faces']}
+                    for payload in mesh_payloads.levels(model['obj_hash'])])
+
+@routes.route('/mesh/<source_filename>/scene')
+def mesh_scene(source_filename):
+    model = get_model(source_filename)
+    return jsonify([describe_node(node) for node in scene_nodes(model)])
+
+@routes.route('/mesh/<source_filename>/metadata')
+def mesh_metadata_record(source_filename):
+    model = get_model(source_filename)
+    record = mesh_metadata.get(model['obj_hash'])
+    if record is None:
+        abort(404)
+    record = dict(record)
+    record['bounds'] = json.loads(record['bounds'])
+    record['materials'] = json.loads(record['materials'])
+    record['has_uvs'] = bool(record['has_uvs'])
+    return jsonify(record)
+
+@routes.route('/mesh/<source_filename>/optimization')
+def mesh_optimization_report(source_filename):
+    model = get_model(source_filename)
+    report = MeshArrayCache(blob_store).report(model['obj_hash'])
+    if report is None:
+        abort(404)
+    return jsonify(report)
+
+@routes.route('/mesh/<source_filename>/thumbnail')
+def mesh_thumbnail(source_filename):
+    model = get_model(source_filename)
+    record = mesh_metadata.get(model['obj_hash'])
+    if record is None or record['thumbnail_hash'] is None:
+        abort(404)
+    return send_file(blob_store.path(record['thumbnail_hash']), mimetype='image/png',
+                     etag=record['thumbnail_hash'], conditional=True, max_age=3600)
+
+@routes.before_app_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@routes.before_app_request
+def limit_transfers():
+    if request.endpoint not in TRANSFER_ENDPOINTS:
+        return None
+    if not transfer_limiter.acquire():
+        TRANSFERS_REJECTED.inc(endpoint=request.endpoint)
+        return busy_response("Too many uploads and downloads in progress, try again shortly")
+    g.transfer_slot = True
+    return None
+
+@routes.after_app_request
+def observe_request(response):
+    started = g.get('request_started')
+    if started is not None:
+        # Streamed archives are timed up to their first byte, their build time is in archive_build_seconds
+        HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started, endpoint=request.url_rule.rule if request.url_rule else 'unmatched',
+                                     method=request.method, status=response.status_code)
+    if g.pop('transfer_slot', False):
+        # Streamed responses keep their slot until the server has sent the last byte
+        transfer_limiter.release_on_close(response)
+    return response
+
+@routes.teardown_app_request
+def release_transfer_slot(error):
+    # Requests that failed before a response was made
+    if g.pop('transfer_slot', False):
+        transfer_limiter.release()
+
+@routes.route('/metrics')
+def serve_metrics():
+    return Response(REGISTRY.render(), mimetype=PROMETHEUS_CONTENT_TYPE)
+
+@routes.route('/sources')
+def source_list():
+    # The source list as JSON, with the same filter and sort options as the page
+    sources = list_sources(request.args.get('filter', ''), request.args.get('sort', 'name'), request.args.get('uvs') == '1')
+    return jsonify([dict(source) for source in sources])
+
+@routes.route('/disk-usage')
+def disk_usage():
+    # Bytes per data directory as of the last workspace sweep, free space and workspace counts
+    return jsonify(workspaces.usage())
+
+@routes.route('/conversion-cache/stats')
+def conversion_cache_stats():
+    return jsonify(conversion_cache.stats())
+
+@routes.route('/download-model/<source_filename>/<texture_filename>')
+def download_model(source_filename, texture_filename):
+    # Every texture linked to the source is included, texture_filename keeps existing links working
+    model = get_model(source_filename)
+    target_format = request.args.get('format', 'obj')
+    if target_format not in EXPORT_FORMATS:
+        abort(400)
+
+    base_name = os.path.splitext(source_filename)[0]
+    obj_hash, model_format = model['obj_hash'], model['model_format']
+    level = request.args.get('level', 0, type=int)
+    node_ids = requested_nodes()
+    if node_ids:
+        # The chosen meshes of the scene, written out from their cached arrays
+        payload = mesh_payloads.with_obj(scene_subset(model, node_ids))
+        obj_hash, model_format = payload['lod_obj_hash'], '.obj'
+        base_name = f"{base_name}_nodes{'-'.join(map(str, node_ids))}"
+    elif level > 0:
+        # A coarse level of detail, when one has been built, downloads much faster
+        payload = mesh_payloads.get(obj_hash, model_format, level)
+        if payload['lod_obj_hash'] is not None:
+            obj_hash, model_format = payload['lod_obj_hash'], '.obj'
+            base_name = f"{base_name}_lod{payload['level']}"
+    obj_hash = export_model(obj_hash, model_format, target_format, base_name)
+
+    entries = [(f"{base_name}{EXPORT_FORMATS[target_format][1]}", obj_hash)]
+    material = model_material(obj_hash)
+    if material is not None:
+        entries.append(material)
+    with get_db_connection() as conn:
+        textures = conn.execute('SELECT texture_filename, texture_hash FROM model_textures WHERE obj_filename = ? ORDER BY texture_filename', (source_filename,)).fetchall()
+    arcnames = {arcname for arcname, _ in entries}
+    entries += [(texture['texture_filename'], texture['texture_hash']) for texture in textures
+                if texture['texture_filename'] not in arcnames]
+
+    # Archives are built deterministically, so the key is a valid ETag even after eviction
+    key = archive_key(entries)
+    zip_filename = f"{base_name}_model.zip"
+    if request.if_none_match.contains(key):
+        ARCHIVE_REQUESTS.inc(result='not_modified')
+        response = Response(status=304)
+        response.set_etag(key)
+        return response
+    archive_path = download_archives.get(key)
+    if archive_path is not None:
+        ARCHIVE_REQUESTS.inc(result='hit')
+        return send_file(archive_path, mimetype='application/zip', as_attachment=True, download_name=zip_filename,
+                         etag=key, conditional=True)
+    ARCHIVE_REQUESTS.inc(result='miss')
+    response = Response(download_archives.stream(key, [(arcname, blob_store.path(digest)) for arcname, digest in entries]),
+                        mimetype='application/zip')
+    response.set_etag(key)
+    response.headers.set('Content-Disposition', 'attachment', filename=zip_filename)
+    return response
+
+def show_mesh_with_texture(obj_hash, model_format, texture_path=None):
     def display_mesh():
+        # Only the desktop viewer needs PyVista in the server process
+        import pyvista as pv
+
         plotter = pv.Plotter()
-        mesh = pv.read(mesh_path)
+        mesh = load_mesh(blob_store, obj_hash, model_format)
         if mesh.n_points == 0:
             logging.error("Empty meshes cannot be plotted. Input mesh has zero points.")
             return
 
-        if texture_content:
-            texture_path = os.path.join(TEXTURE_UPLOAD_FOLDER, 'temp_texture.jpg')
-            with open(texture_path, 'wb') as texture_file:
-                texture_file.write(texture_content)
+        if texture_path:
             texture = pv.read_texture(texture_path)
             if 'Texture Coordinates' in mesh.point_data:
                 texture_coords = mesh.point_data['Texture Coordinates']
@@ -177,241 +662,39 @@ def show_mesh_with_texture(mesh_path, texture_content=None):
 
     threading.Thread(target=display_mesh).start()
 
-# Initialize Dash app with Bootstrap theme
-app = dash.Dash(__name__, server=server, url_base_pathname='/dash/', external_stylesheets=[dbc.themes.BOOTSTRAP])
-
-app.layout = dbc.Container([
-    dbc.Row([
-        dbc.Col([
-            html.H1('3D Model Hub: Upload, View, and Download', className='text-center my-4')
-        ], width=12)
-    ]),
-
-    dbc.Row([
-        dbc.Col([
-            html.H3('Source Files', className='text-center'),
-            dcc.Dropdown(id='source-dropdown', placeholder='Select or Upload a Source File', className='mb-2'),
-            dcc.Upload(
-                id='upload-source',
-                children=dbc.Button('Drag and Drop or Select a Source File', color='primary', className='btn-block mb-2'),
-                style={'width': '100%', 'padding': '20px', 'borderWidth': '1px', 'borderStyle': 'dashed', 'borderRadius': '5px', 'textAlign': 'center', 'margin': '10px'},
-                multiple=False
-            ),
-            dbc.Button('Refresh Source List', id='refresh-source-button', color='secondary', className='btn-block')
-        ], width=4, className='p-2'),
-
-        dbc.Col([
-            html.H3('Texture Files', className='text-center'),
-            dcc.Dropdown(id='texture-dropdown', placeholder='Select or Upload a Texture File', className='mb-2'),
-            dcc.Upload(
-                id='upload-texture',
-                children=dbc.Button('Drag and Drop or Select a Texture File', color='primary', className='btn-block mb-2'),
-                style={'width': '100%', 'padding': '20px', 'borderWidth': '1px', 'borderStyle': 'dashed', 'borderRadius': '5px', 'textAlign': 'center', 'margin': '10px'},
-                multiple=False
-            ),
-            dbc.Button('Refresh Texture List', id='refresh-texture-button', color='secondary', className='btn-block')
-        ], width=4, className='p-2'),
-
-        dbc.Col([
-            html.H3('Actions', className='text-center'),
-            html.A(
-                'Download Model', 
-                id='download-model-button', 
-                href='', 
-                className='btn btn-primary btn-block mb-2'
-            ),
-            html.Div(id='message-box', className='border p-3 mb-2', style={'height': '200px', 'overflowY': 'scroll'})
-        ], width=4, className='p-2')
-    ]),
-
-    dbc.Row([
-        dbc.Col([
-            html.H3('Viewer', className='text-center'),
-            html.Div(id='viewer-message', className='border p-3 mb-2', style={'height': '100px', 'overflowY': 'scroll'})
-        ], width=12, className='p-2'),
-
-        dbc.Col([
-            html.H3('Explanation', className='text-center'),
-            html.Div(id='explanation-container', className='border p-3 mb-4', style={'height': '400px', 'overflowY': 'scroll'})
-        ], width=12, className='p-2')
-    ])
-], fluid=True)
-
-@app.callback(
-    Output('download-model-button', 'href'),
-    [Input('source-dropdown', 'value'), Input('texture-dropdown', 'value')]
-)
-def update_download_link(selected_source, selected_texture):
-    if selected_source and selected_texture:
-        obj_filename = f"{selected_source.split('.')[0]}.obj"
-        texture_filename = selected_texture
-        return f'/download-model/{obj_filename}/{texture_filename}'
-    return ''
-
-@app.callback(
-    [Output('source-dropdown', 'options'),
-     Output('texture-dropdown', 'options'),
-     Output('viewer-message', 'children'),
-     Output('message-box', 'children'),
-     Output('explanation-container', 'children')],
-    [Input('refresh-source-button', 'n_clicks'),
-     Input('refresh-texture-button', 'n_clicks'),
-     Input('upload-source', 'contents'),
-     Input('upload-texture', 'contents'),
-     Input('source-dropdown', 'value'),
-     Input('texture-dropdown', 'value')],
-    [State('upload-source', 'filename'),
-     State('upload-texture', 'filename'),
-     State('message-box', 'children')]
-)
-def update_content(refresh_source_clicks, refresh_texture_clicks, source_content, texture_content, selected_source, selected_texture, source_filename, texture_filename, current_messages):
-    ctx = dash.callback_context
-    messages = current_messages if current_messages else []
-    viewer_message = []
-
-    def log_message(message):
-        logging.debug(message)
-        messages.append(html.Div(message))
-
-    def refresh_file_list():
-        log_message("Refreshing file list")
-        conn = get_db_connection()
-        files = conn.execute('SELECT filename FROM files').fetchall()
-        conn.close()
-        log_message(f"Fetched {len(files)} source files")
-        return [{'label': file['filename'], 'value': file['filename']} for file in files]
-
-    def refresh_texture_list(selected_source):
-        log_message("Refreshing texture list")
-        conn = get_db_connection()
-        textures = conn.execute('SELECT texture_filename FROM textures WHERE obj_filename = ?', (selected_source,)).fetchall()
-        conn.close()
-        log_message(f"Fetched {len(textures)} texture files for {selected_source}")
-        return [{'label': 'View Only Mesh', 'value': 'view_only_mesh'}] + [{'label': texture['texture_filename'], 'value': texture['texture_filename']} for texture in textures]
-
-    if not ctx.triggered:
-        return refresh_file_list(), [], viewer_message, messages, get_explanations()
-
-    trigger = ctx.triggered[0]['prop_id']
-
-    try:
-        if trigger == 'refresh-source-button.n_clicks':
-            return refresh_file_list(), [], viewer_message, messages, get_explanations()
-
-        elif trigger == 'refresh-texture-button.n_clicks':
-            return refresh_file_list(), refresh_texture_list(selected_source), viewer_message, messages, get_explanations()
-
-        elif trigger == 'upload-source.contents' and source_content is not None:
-            content_type, content_string = source_content.split(',')
-            decoded = base64.b64decode(content_string)
-            filename = secure_filename(source_filename)
-
-            if len(decoded) > MAX_CONTENT_LENGTH:
-                log_message(f"File size exceeds the limit: {filename}")
-                return refresh_file_list(), [], viewer_message, messages, get_explanations()
-
-            original_format = os.path.splitext(filename)[1].lower()
-            obj_content = None
-
-            if original_format in ('.fbx', '.3ds', '.gltf', '.glb', '.dae', '.blend'):
-                try:
-                    input_path = os.path.join(TEMP_UPLOAD_FOLDER, filename)
-                    with open(input_path, 'wb') as f:
-                        f.write(decoded)
-                    output_path = os.path.join(TEMP_UPLOAD_FOLDER, f"{os.path.splitext(filename)[0]}.obj")
-                    convert_to_obj(input_path, output_path)
-                    with open(output_path, 'rb') as f:
-                        obj_content = f.read()
-                except Exception as e:
-                    log_message(f"Conversion failed: {e}")
-                    return refresh_file_list(), [], viewer_message, messages, get_explanations()
-            else:
-                obj_content = decoded
-
-            with sqlite3.connect(DATABASE) as conn:
-                cursor = conn.cursor()
-                cursor.execute('INSERT INTO files (filename, original_format, original_content, obj_content) VALUES (?, ?, ?, ?)', (filename, original_format, decoded, obj_content))
-                conn.commit()
-
-            log_message(f"Uploaded source file: {filename}")
-            return refresh_file_list(), [], viewer_message, messages, get_explanations()
-
-        elif trigger == 'upload-texture.contents' and texture_content is not None and selected_source is not None:
-            content_type, content_string = texture_content.split(',')
-            decoded = base64.b64decode(content_string)
-            filename = secure_filename(texture_filename)
-
-            if len(decoded) > MAX_CONTENT_LENGTH:
-                log_message(f"File size exceeds the limit: {filename}")
-                return refresh_file_list(), refresh_texture_list(selected_source), viewer_message, messages, get_explanations()
-
-            with sqlite3.connect(DATABASE) as conn:
-                cursor = conn.cursor()
-                cursor.execute('SELECT COUNT(*) FROM textures WHERE texture_filename = ? AND obj_filename = ?', (filename, selected_source))
-                link_exists = cursor.fetchone()[0] > 0
-                if link_exists:
-                    log_message(f"Texture file already linked to this source: {filename}")
-                else:
-                    cursor.execute('INSERT INTO textures (obj_filename, texture_filename, texture_content) VALUES (?, ?, ?)', (selected_source, filename, decoded))
-                    conn.commit()
-                    log_message(f"Uploaded texture file: {filename}")
-
-            return refresh_file_list(), refresh_texture_list(selected_source), viewer_message, messages, get_explanations()
-
-        elif trigger == 'source-dropdown.value' and selected_source is not None:
-            return refresh_file_list(), refresh_texture_list(selected_source), viewer_message, messages, get_explanations()
-
-        elif trigger == 'texture-dropdown.value' and selected_texture is not None:
-            conn = get_db_connection()
-            model = conn.execute('SELECT obj_content FROM files WHERE filename = ?', (selected_source,)).fetchone()
-            texture = conn.execute('SELECT texture_content FROM textures WHERE texture_filename = ? AND obj_filename = ?', (selected_texture, selected_source)).fetchone()
-            conn.close()
-            if model is None:
-                log_message("Model not found!")
-                return refresh_file_list(), refresh_texture_list(selected_source), viewer_message, messages, get_explanations()
-
-            obj_path = os.path.join(TEMP_UPLOAD_FOLDER, f"{selected_source.split('.')[0]}.obj")
-            with open(obj_path, 'wb') as f:
-                f.write(model['obj_content'])
-
-            if texture and selected_texture != 'view_only_mesh':
-                texture_path = os.path.join(TEXTURE_UPLOAD_FOLDER, selected_texture)
-                with open(texture_path, 'wb') as f:
-                    f.write(texture['texture_content'])
-                show_mesh_with_texture(obj_path, texture['texture_content'])
-            else:
-                show_mesh_with_texture(obj_path)
-            viewer_message = [html.Div("PyVista viewer opened in a new window")]
-            return refresh_file_list(), refresh_texture_list(selected_source), viewer_message, messages, get_explanations()
-
-    except Exception as e:
-        error_message = f"An error occurred: {str(e)}"
-        log_message(error_message)
-        return refresh_file_list(), refresh_texture_list(selected_source), viewer_message, messages, get_explanations()
-
-    return refresh_file_list(), refresh_texture_list(selected_source), viewer_message, messages, get_explanations()
-
 def get_explanations():
     explanations = [
         html.H3("Function Explanations"),
+        html.H4("create_app"),
+        html.P("Build the Flask server with its routes and this Dash UI, and initialize the database. gunicorn 'app:create_app()' uses it directly; PyVista and the assimp library are loaded the first time a mesh is parsed or a model converted, ASSIMP_LIBRARY_PATH tells impasse where the library is."),
+
         html.H4("init_db"),
-        html.P("Initialize the SQLite database with tables for storing files and textures."),
+        html.P("Initialize the SQLite database with tables for storing files and textures, moving content left in BLOB columns by earlier versions into the blob store and the per-model texture rows of earlier versions into shared texture assets."),
+
+        html.H4("BlobStore"),
+        html.P("Content-addressed, deduplicated on-disk store for model and texture content. The database keeps only SHA-256 hashes, and the viewer, downloads and conversions read blobs straight from disk in chunks, through file handles or mmap."),
         
         html.H4("get_db_connection"),
-        html.P("Get a connection to the SQLite database."),
+        html.P("Get a connection to the SQLite database from a per-process pool of WAL-mode connections, so readers are not blocked by writers and prepared statements are reused across requests."),
         html.Ul([
-            html.Li("Returns: sqlite3.Connection - The database connection.")
+            html.Li("Returns: a pooled sqlite3.Connection, returned to the pool by close() or at the end of a with block, which commits it.")
         ]),
         
+        html.H4("list_files / list_sources / list_textures"),
+        html.P("Source and texture names for the dropdowns, kept in memory until any connection, including other server workers and conversion jobs, writes to the database, up to QUERY_CACHE_MAX_ENTRIES results (128 by default), the least recently used first out. /sources serves the source list as JSON, with the filter, sort and uvs options of the page."),
+
+        html.H4("MeshMetadata"),
+        html.P("Run on the conversion workers once a model is stored to record its point and face counts, bounds, surface area, material names, whether it has texture coordinates and an offscreen-rendered thumbnail, once per model hash. The source list filters by name or material, sorts by name, age, faces, points or area and shows the thumbnail and counts without reading the mesh; /mesh/<source>/metadata and /mesh/<source>/thumbnail serve the record."),
+
         html.H4("index"),
         html.P("Redirect the root URL to the Dash app."),
         
         html.H4("serve_texture_file"),
-        html.P("Serve the uploaded texture file."),
+        html.P("Serve the uploaded texture file. /textures/<hash> serves a texture by its content hash, which the dropdown thumbnails and the preview use."),
         html.Ul([
             html.Li("Args:"),
             html.Ul([
-                html.Li("filename (str): The name of the texture file.")
+                html.Li("filename (str): The name of the texture file, ?source= picks the model linking it.")
             ]),
             html.Li("Returns:"),
             html.Ul([
@@ -419,13 +702,15 @@ def get_explanations():
             ])
         ]),
         
-        html.H4("convert_to_obj"),
-        html.P("Convert a 3D file to OBJ format using Assimp."),
+        html.H4("convert_model"),
+        html.P("Convert a 3D file with Assimp, running the selected post-processing steps (triangulate, join identical vertices, optimize meshes, generate normals) on import. Converted sources are stored as binary glTF (GLB)."),
         html.Ul([
             html.Li("Args:"),
             html.Ul([
                 html.Li("input_path (str): The path to the input file."),
-                html.Li("output_path (str): The path to the output OBJ file.")
+                html.Li("output_path (str): The path to the output file."),
+                html.Li("target_format (str): One of glb, obj, ply or stl, defaults to glb."),
+                html.Li("post_processing (tuple): The post-processing steps to run.")
             ]),
             html.Li("Raises:"),
             html.Ul([
@@ -434,63 +719,489 @@ def get_explanations():
             ])
         ]),
         
-        html.H4("show_mesh_with_texture"),
-        html.P("Display a 3D mesh with an optional texture using PyVista."),
+        html.H4("ConversionJobQueue.submit"),
+        html.P("Queue a conversion to GLB on the background worker pool and record it in the conversion_jobs table."),
         html.Ul([
             html.Li("Args:"),
             html.Ul([
-                html.Li("mesh_path (str): The path to the mesh file."),
-                html.Li("texture_content (bytes, optional): The content of the texture file.")
+                html.Li("filename (str): The source filename whose files row is filled in when the job finishes."),
+                html.Li("input_path (str): The path to the input file."),
+                html.Li("output_path (str): The path to the output file, its extension is recorded as the model format.")
+            ]),
+            html.Li("Returns:"),
+            html.Ul([
+                html.Li("int: The id of the queued job.")
             ])
         ]),
-        
-        html.H4("update_content"),
-        html.P("Callback function to update the content of the source and texture dropdowns, and to display the 3D model."),
+
+        html.H4("ConversionCache"),
+        html.P("Content-addressed cache of converted models keyed by the source bytes, target format and post-processing flags. Uploads that match a cached conversion skip the conversion job, unreferenced entries are evicted least recently used first, and hit/miss counters are served at /conversion-cache/stats."),
+
+        html.H4("WorkspaceManager"),
+        html.P("Give every conversion and export a scratch directory of its own under temp_uploads/, so concurrent users never write to the same file. Failed conversions keep theirs for inspection; a background thread deletes kept workspaces and leftovers, least recently used first, once the folder exceeds WORKSPACE_QUOTA_BYTES, and reports the size of the data directories and free disk space at /disk-usage and /metrics."),
+
+        html.H4("serve_metrics"),
+        html.P("Serve counters and latency histograms for this server process in the Prometheus text format at /metrics: HTTP requests per route, conversions, SQL statements, blob writes, mesh loads, archive builds, base64 decoding, bytes processed and cache hits. METRICS_ENABLED=0 turns them off, LOG_LEVEL sets the log level and LOG_SAMPLE_RATE the share of debug records written."),
+
+        html.H4("update_job_status"),
+        html.P("Callback polled on an interval to show the status and timings of recent conversion jobs."),
+
+        html.H4("serve_mesh"),
+        html.P("Serve the selected model to the in-page viewer as a binary PLY of packed positions, normals, texture coordinates and triangle indices. The payload is prepared once per model, kept in the blob store and sent with an ETag so repeated selections are answered from cache."),
+
+        html.H4("ModelArtifacts"),
+        html.P("Delete the parsed arrays, viewer payloads, levels of detail, metadata with its thumbnail and scene split of a model once no source uses it, when batch_convert re-converts a changed source and on startup. Cached meshes no table knows about are deleted once older than MODEL_ARTIFACT_GRACE_SECONDS."),
+
+        html.H4("MeshArrayCache"),
+        html.P("Parse each model once, OBJ files with a vectorized NumPy reader and other formats with VTK, and keep its points, triangles, texture coordinates and normals as .npy files under blob_store/mesh_arrays, keyed by content hash. The viewer payloads, levels of detail, metadata and desktop viewer memory-map those arrays instead of parsing the model again."),
+
+        html.H4("optimize_arrays"),
+        html.P("Run on each model as it is parsed into the mesh array cache: weld vertices whose position, texture coordinate and normal agree within MESH_WELD_TOLERANCE, drop degenerate triangles and unused vertices, order triangles along a space-filling curve and number vertices by first use for cache locality, and with MESH_QUANTIZE=1 store the arrays as 16-bit integers. /mesh/<source>/optimization reports the vertex, face and byte counts before and after and the largest position change."),
+
+        html.H4("build_lod_pyramid"),
+        html.P("Run on the conversion workers after each upload or conversion to store 3 quadric-decimated levels of detail (75%, 90% and 97% fewer triangles) next to the model. The viewer shows the coarsest level first and refines to full resolution, /mesh/<source>/levels lists the levels and /download-model accepts ?level=N for a lighter OBJ."),
+
+        html.H4("SceneGraph"),
+        html.P("Run on the conversion workers once a model is stored to record its node tree: GLB and glTF models keep their nodes, OBJ models get a node per o or g group. Each mesh is placed in world space, optimized and cached on its own, so one part of a large scene is viewed or downloaded without loading the rest. /mesh/<source>/scene lists the nodes, and /mesh/<source>?nodes=1,4 and /download-model/<source>/<texture>?nodes=1,4 serve the chosen meshes; the mesh picker under the source list does the same in the page."),
+
+        html.H4("serving.serve / shutdown"),
+        html.P("python app.py or python serving.py runs the production server: gunicorn with SERVER_WORKERS processes of SERVER_THREADS threads each, or Werkzeug's threaded server where gunicorn is not available, such as on Windows. Each process handles at most MAX_CONCURRENT_TRANSFERS uploads and downloads at once and answers further ones with 503 and Retry-After, and conversions are refused the same way once MAX_PENDING_CONVERSIONS are queued. On SIGTERM transfers in progress get SHUTDOWN_TIMEOUT seconds to finish and running conversions are waited for."),
+
+        html.H4("download_model"),
+        html.P("Stream a ZIP with the model, its .mtl material library and every texture linked to the source while it is being built. Images are stored without recompression and other files are deflated at a level per file type. Finished archives are kept in the downloads folder up to ARCHIVE_CACHE_MAX_BYTES and served again with ETag and Range support."),
+
+        html.H4("TextureAssets"),
+        html.P("Store every texture once per content hash and link it to models by name, counting the links. Textures no model links any more are deleted, with their levels, after TEXTURE_GC_GRACE_SECONDS; DELETE /sources/<source>/textures/<name> removes a link and /textures reports the stored assets."),
+
+        html.H4("TextureVariants"),
+        html.P("Validate each uploaded texture and build a mip chain down to a 128 px thumbnail on the worker pool, stored once per texture hash. /textures/<hash>?size=N serves the smallest level covering N pixels, which the texture dropdown thumbnails, the preview under the viewer and the desktop viewer use instead of decoding the full-size image."),
+
+        html.H4("show_mesh_with_texture"),
+        html.P("Display a 3D mesh with an optional texture in a PyVista window on the server. Only used when DESKTOP_VIEWER=1."),
         html.Ul([
             html.Li("Args:"),
             html.Ul([
-                html.Li("refresh_source_clicks (int): Number of times the source list refresh button was clicked."),
-                html.Li("refresh_texture_clicks (int): Number of times the texture list refresh button was clicked."),
-                html.Li("source_content (str): Base64 encoded content of the uploaded source file."),
-                html.Li("texture_content (str): Base64 encoded content of the uploaded texture file."),
-                html.Li("selected_source (str): The selected source file from the dropdown."),
-                html.Li("selected_texture (str): The selected texture file from the dropdown."),
-                html.Li("source_filename (str): The filename of the uploaded source file."),
-                html.Li("texture_filename (str): The filename of the uploaded texture file."),
-                html.Li("current_messages (list): The current list of messages to be displayed.")
-            ]),
-            html.Li("Returns:"),
-            html.Ul([
-                html.Li("list: Updated options for the source dropdown."),
-                html.Li("list: Updated options for the texture dropdown."),
-                html.Li("list: Viewer message."),
-                html.Li("list: Updated messages."),
-                html.Li("list: Explanations for functions and usage.")
+                html.Li("obj_hash (str): The content hash of the model, loaded from the parsed mesh cache."),
+                html.Li("model_format (str): The model's file extension, used to parse it the first time."),
+                html.Li("texture_path (str, optional): The path to the texture file.")
             ])
-        ])
+        ]),
+        
+        html.H4("update_source_list / update_texture_list"),
+        html.P("Callbacks that refresh only their own dropdown: the source list when a refresh, filter, sort or upload changes it, and the texture list when the selected source changes, a texture is uploaded or its refresh button is clicked."),
+
+        html.H4("upload_source / upload_texture"),
+        html.P("Callbacks that decode an upload from the page, store it in the blob store and register it. A source upload queues its conversion job when the format needs one, a texture upload is linked to the selected source."),
+
+        html.H4("show_selected_model"),
+        html.P("Callback run when a texture is selected, reporting in the viewer panel which model is shown, or opening the PyVista window when DESKTOP_VIEWER=1."),
+
+        html.H4("Messages"),
+        html.P("Callbacks send only their new messages to the page, which appends them to the message box and keeps the last MESSAGE_HISTORY_SIZE (50 by default), so callbacks do not send the history back and forth."),
     ]
     return explanations
 
+# Dash callbacks are recorded here and registered on each Dash app create_app() builds
+UI_CALLBACKS = []
+
+def ui_callback(*args, **kwargs):
+    def record(function):
+        UI_CALLBACKS.append((function, args, kwargs))
+        return function
+    return record
 
+def ui_clientside_callback(script, *args, **kwargs):
+    UI_CALLBACKS.append((script, args, kwargs))
 
+def build_layout():
+    # Imported here, the components are only needed when a Dash app is built
+    import dash_bootstrap_components as dbc
+    import dash_vtk
+
+    return dbc.Container([
+        dbc.Row([
+            dbc.Col([
+                html.H1('3D Model Hub: Upload, View, and Download', className='text-center my-4')
+            ], width=12)
+        ]),
+
+        dbc.Row([
+            dbc.Col([
+                html.H3('Source Files', className='text-center'),
+                dbc.InputGroup([
+                    dbc.Input(id='source-filter', placeholder='Filter by name or material', debounce=True),
+                    dbc.Select(id='source-sort', value='name', options=[
+                        {'label': 'Name', 'value': 'name'},
+                        {'label': 'Newest', 'value': 'newest'},
+                        {'label': 'Most faces', 'value': 'faces'},
+                        {'label': 'Most points', 'value': 'points'},
+                        {'label': 'Largest area', 'value': 'area'},
+                    ]),
+                ], className='mb-2'),
+                dbc.Checklist(id='source-uv-filter', options=[{'label': 'Only models with texture coordinates', 'value': 'uvs'}],
+                              value=[], switch=True, className='mb-2'),
+                dcc.Dropdown(id='source-dropdown', placeholder='Select or Upload a Source File', className='mb-2'),
+                # Meshes of a multi-part scene, none selected shows the whole model
+                dcc.Dropdown(id='scene-nodes', multi=True, placeholder='All meshes of the scene', className='mb-2'),
+                dcc.Upload(
+                    id='upload-source',
+                    children=dbc.Button('Drag and Drop or Select a Source File', color='primary', className='btn-block mb-2'),
+                    style={'width': '100%', 'padding': '20px', 'borderWidth': '1px', 'borderStyle': 'dashed', 'borderRadius': '5px', 'textAlign': 'center', 'margin': '10px'},
+                    multiple=False
+                ),
+                dbc.Button('Refresh Source List', id='refresh-source-button', color='secondary', className='btn-block')
+            ], width=4, className='p-2'),
+
+            dbc.Col([
+                html.H3('Texture Files', className='text-center'),
+                dcc.Dropdown(id='texture-dropdown', placeholder='Select or Upload a Texture File', className='mb-2'),
+                dcc.Upload(
+                    id='upload-texture',
+                    children=dbc.Button('Drag and Drop or Select a Texture File', color='primary', className='btn-block mb-2'),
+                    style={'width': '100%', 'padding': '20px', 'borderWidth': '1px', 'borderStyle': 'dashed', 'borderRadius': '5px', 'textAlign': 'center', 'margin': '10px'},
+                    multiple=False
+                ),
+                dbc.Button('Refresh Texture List', id='refresh-texture-button', color='secondary', className='btn-block')
+            ], width=4, className='p-2'),
+
+            dbc.Col([
+                html.H3('Actions', className='text-center'),
+                html.A(
+                    'Download Model', 
+                    id='download-model-button', 
+                    href='', 
+                    className='btn btn-primary btn-block mb-2'
+                ),
+                html.Div(id='message-box', className='border p-3 mb-2', style={'height': '200px', 'overflowY': 'scroll'}),
+                dcc.Store(id='new-messages'),
+                # Bumped after an upload so only the affected dropdown refreshes
+                dcc.Store(id='sources-changed'),
+                dcc.Store(id='textures-changed'),
+                html.H5('Conversion Jobs'),
+                html.Div(id='job-status', className='border p-3 mb-2', style={'height': '120px', 'overflowY': 'scroll'}),
+                dcc.Interval(id='job-status-interval', interval=2000)
+            ], width=4, className='p-2')
+        ]),
 
-# Function to run the Dash server
+        dbc.Row([
+            dbc.Col([
+                html.H3('Viewer', className='text-center'),
+                html.Div(id='viewer-message', className='border p-3 mb-2', style={'height': '100px', 'overflowY': 'scroll'}),
+                html.Div(
+                    dash_vtk.View([
+                        dash_vtk.GeometryRepresentation([
+                            dash_vtk.Reader(id='mesh-reader', vtkClass='vtkPLYReader')
+                        ])
+                    ], background=[1, 1, 1]),
+                    className='border mb-2', style={'height': '500px'}
+                ),
+                html.Img(id='texture-preview', className='mb-2', style={'maxHeight': f'{TEXTURE_PANEL_SIZE}px'}),
+                # The viewer starts at the coarsest level of detail and steps down to full resolution
+                dcc.Store(id='mesh-level'),
+                dcc.Interval(id='mesh-refine-interval', interval=1500, disabled=True)
+            ], width=12, className='p-2'),
+
+            dbc.Col([
+                html.H3('Explanation', className='text-center'),
+                # Static, so it is rendered once with the layout instead of being sent by a callback
+                html.Div(get_explanations(), id='explanation-container', className='border p-3 mb-4', style={'height': '400px', 'overflowY': 'scroll'})
+            ], width=12, className='p-2')
+        ])
+    ], fluid=True)
+
+def nodes_query(node_ids):
+    return f"nodes={','.join(str(node_id) for node_id in sorted(node_ids))}"
+
+@ui_callback(
+    Output('download-model-button', 'href'),
+    [Input('source-dropdown', 'value'), Input('texture-dropdown', 'value'), Input('scene-nodes', 'value')]
+)
+def update_download_link(selected_source, selected_texture, selected_nodes):
+    if selected_source and selected_texture:
+        if selected_nodes:
+            return f'/download-model/{selected_source}/{selected_texture}?{nodes_query(selected_nodes)}'
+        return f'/download-model/{selected_source}/{selected_texture}'
+    return ''
+
+@ui_callback(
+    [Output('scene-nodes', 'options'), Output('scene-nodes', 'value')],
+    [Input('source-dropdown', 'value')]
+)
+def update_scene_nodes(selected_source):
+    # Only scenes already split are listed, the split runs on the worker pool after upload
+    if not selected_source:
+        return [], []
+    with get_db_connection() as conn:
+        model = conn.execute('SELECT obj_hash FROM files WHERE filename = ?', (selected_source,)).fetchone()
+    if model is None or model['obj_hash'] is None:
+        return [], []
+    nodes = [node for node in scene_graph.nodes(model['obj_hash']) if node['mesh_hash'] is not None]
+    if len(nodes) < 2:
+        return [], []
+    return [{'label': f"{node['name']} ({node['n_faces']:,} faces)", 'value': node['node_id']} for node in nodes], []
+
+@ui_callback(
+    [Output('mesh-reader', 'url'),
+     Output('mesh-level', 'data'),
+     Output('mesh-refine-interval', 'disabled')],
+    [Input('texture-dropdown', 'value'),
+     Input('mesh-refine-interval', 'n_intervals'),
+     Input('scene-nodes', 'value')],
+    [State('source-dropdown', 'value'),
+     State('mesh-level', 'data')]
+)
+def update_mesh_viewer(selected_texture, n_intervals, selected_nodes, selected_source, current_level):
+    if DESKTOP_VIEWER or not selected_texture or not selected_source:
+        return dash.no_update, dash.no_update, True
+    trigger = dash.callback_context.triggered[0]['prop_id']
+
+    if selected_nodes:
+        # A chosen part of the scene is small enough to show at full resolution straight away
+        return f'/mesh/{selected_source}?{nodes_query(selected_nodes)}', 0, True
+    if trigger == 'mesh-refine-interval.n_intervals':
+        level = max((current_level or 0) - 1, 0)
+    else:
+        with get_db_connection() as conn:
+            model = conn.execute('SELECT obj_hash FROM files WHERE filename = ?', (selected_source,)).fetchone()
+        if model is None or model['obj_hash'] is None:
+            return dash.no_update, dash.no_update, True
+        levels = mesh_payloads.levels(model['obj_hash'])
+        level = levels[-1]['level'] if levels else 0
+    return f'/mesh/{selected_source}?level={level}', level, level == 0
+
+@ui_callback(
+    Output('texture-preview', 'src'),
+    [Input('texture-dropdown', 'value')],
+    [State('source-dropdown', 'value')]
+)
+def update_texture_preview(selected_texture, selected_source):
+    if not selected_texture or selected_texture == 'view_only_mesh':
+        return ''
+    texture = texture_assets.lookup(selected_source, selected_texture)
+    if texture is None:
+        return ''
+    return f'/textures/{texture["texture_hash"]}?size={TEXTURE_PANEL_SIZE}'
+
+@ui_callback(
+    Output('job-status', 'children'),
+    [Input('job-status-interval', 'n_intervals')]
+)
+def update_job_status(n_intervals):
+    jobs = conversion_queue.recent_jobs()
+    if not jobs:
+        return [html.Div("No conversion jobs yet")]
+    return [html.Div(describe_job(job)) for job in jobs]
+
+def source_options(source_filter, source_sort, source_uv_filter):
+    sources = list_sources(source_filter, source_sort, 'uvs' in (source_uv_filter or []))
+    logging.debug(f"Fetched {len(sources)} source files")
+    # Labels show the model thumbnail and statistics from the metadata index
+    return [
+        {'label': html.Span([html.Img(src=f'/mesh/{source["filename"]}/thumbnail', style={'height': '24px', 'marginRight': '8px'})
+                             if source['thumbnail_hash'] else None, describe_source(source)]),
+         'value': source['filename'], 'search': source['filename']}
+        for source in sources]
+
+def texture_options(selected_source):
+    textures = list_textures(selected_source)
+    logging.debug(f"Fetched {len(textures)} texture files for {selected_source}")
+    # Labels show the smallest texture level as a thumbnail
+    return [{'label': 'View Only Mesh', 'value': 'view_only_mesh'}] + [
+        {'label': html.Span([html.Img(src=f'/textures/{texture["texture_hash"]}?size={THUMBNAIL_SIZE}', style={'height': '24px', 'marginRight': '8px'}),
+                             texture['texture_filename']]),
+         'value': texture['texture_filename'], 'search': texture['texture_filename']}
+        for texture in textures]
+
+def decode_upload(contents, kind):
+    content_type, content_string = contents.split(',')
+    with UPLOAD_DECODE_SECONDS.time(kind=kind):
+        decoded = base64.b64decode(content_string)
+    UPLOAD_DECODED_BYTES.inc(len(decoded), kind=kind)
+    return decoded
+
+def log_messages(*messages):
+    for message in messages:
+        logging.debug(message)
+    return list(messages)
+
+@ui_callback(
+    Output('source-dropdown', 'options'),
+    [Input('refresh-source-button', 'n_clicks'),
+     Input('sources-changed', 'data'),
+     Input('source-filter', 'value'),
+     Input('source-sort', 'value'),
+     Input('source-uv-filter', 'value')]
+)
+def update_source_list(refresh_source_clicks, sources_changed, source_filter, source_sort, source_uv_filter):
+    return source_options(source_filter, source_sort, source_uv_filter)
+
+@ui_callback(
+    Output('texture-dropdown', 'options'),
+    [Input('refresh-texture-button', 'n_clicks'),
+     Input('textures-changed', 'data'),
+     Input('source-dropdown', 'value')]
+)
+def update_texture_list(refresh_texture_clicks, textures_changed, selected_source):
+    if selected_source is None:
+        return []
+    return texture_options(selected_source)
+
+@ui_callback(
+    [Output('new-messages', 'data', allow_duplicate=True),
+     Output('sources-changed', 'data')],
+    [Input('upload-source', 'contents')],
+    [State('upload-source', 'filename')],
+    prevent_initial_call=True
+)
+def upload_source(source_content, source_filename):
+    if source_content is None:
+        raise dash.exceptions.PreventUpdate
+    filename = secure_filename(source_filename)
+    try:
+        if os.path.splitext(filename)[1].lower() in CONVERTIBLE_FORMATS:
+            conversion_queue.check_capacity()
+        decoded = decode_upload(source_content, 'source')
+        if len(decoded) > MAX_CONTENT_LENGTH:
+            return log_messages(f"File size exceeds the limit: {filename}"), dash.no_update
+        job_id = register_source(filename, blob_store.put_bytes(decoded))
+    except Exception as e:
+        return log_messages(f"An error occurred: {str(e)}"), dash.no_update
+    messages = [f"Queued conversion job {job_id} for {filename}"] if job_id is not None else []
+    return log_messages(*messages, f"Uploaded source file: {filename}"), time.time()
+
+@ui_callback(
+    [Output('new-messages', 'data', allow_duplicate=True),
+     Output('textures-changed', 'data')],
+    [Input('upload-texture', 'contents')],
+    [State('upload-texture', 'filename'),
+     State('source-dropdown', 'value')],
+    prevent_initial_call=True
+)
+def upload_texture(texture_content, texture_filename, selected_source):
+    if texture_content is None or selected_source is None:
+        raise dash.exceptions.PreventUpdate
+    filename = secure_filename(texture_filename)
+    try:
+        decoded = decode_upload(texture_content, 'texture')
+        if len(decoded) > MAX_CONTENT_LENGTH:
+            return log_messages(f"File size exceeds the limit: {filename}"), dash.no_update
+        if not register_texture(selected_source, filename, blob_store.put_bytes(decoded)):
+            return log_messages(f"Texture file already linked to this source: {filename}"), dash.no_update
+    except Exception as e:
+        return log_messages(f"An error occurred: {str(e)}"), dash.no_update
+    return log_messages(f"Uploaded texture file: {filename}"), time.time()
+
+@ui_callback(
+    [Output('viewer-message', 'children'),
+     Output('new-messages', 'data', allow_duplicate=True)],
+    [Input('texture-dropdown', 'value')],
+    [State('source-dropdown', 'value')],
+    prevent_initial_call=True
+)
+def show_selected_model(selected_texture, selected_source):
+    if selected_texture is None:
+        raise dash.exceptions.PreventUpdate
+    try:
+        with get_db_connection() as conn:
+            model = conn.execute('SELECT model_format, obj_hash FROM files WHERE filename = ?', (selected_source,)).fetchone()
+            texture = conn.execute('SELECT texture_hash FROM model_textures WHERE texture_filename = ? AND obj_filename = ?', (selected_texture, selected_source)).fetchone()
+        if model is None:
+            return [], log_messages("Model not found!")
+        if model['obj_hash'] is None:
+            return [], log_messages(f"{selected_source} is still being converted")
+
+        if not DESKTOP_VIEWER:
+            return [html.Div(f"Showing {selected_source} in the viewer below")], dash.no_update
+
+        if texture and selected_texture != 'view_only_mesh':
+            # A level no larger than the preview needs decodes much faster than a camera-sized original
+            variant = texture_variants.pick(texture['texture_hash'], TEXTURE_PREVIEW_SIZE)
+            if variant is not None:
+                texture_path = blob_store.path(variant['variant_hash'], variant['format'] or os.path.splitext(selected_texture)[1])
+            else:
+                texture_path = blob_store.path(texture['texture_hash'], os.path.splitext(selected_texture)[1])
+            show_mesh_with_texture(model['obj_hash'], model['model_format'], texture_path)
+        else:
+            show_mesh_with_texture(model['obj_hash'], model['model_format'])
+        return [html.Div("PyVista viewer opened in a new window")], dash.no_update
+    except Exception as e:
+        return [], log_messages(f"An error occurred: {str(e)}")
+
+# Only new messages come from the server, the browser appends them and keeps the last MESSAGE_HISTORY_SIZE
+ui_clientside_callback(
+    """
+    function(newMessages, current) {
+        if (!newMessages || !newMessages.length) {
+            return window.dash_clientside.no_update;
+        }
+        const added = newMessages.map(message => ({type: 'Div', namespace: 'dash_html_components', props: {children: message}}));
+        return (current || []).concat(added).slice(-%d);
+    }
+    """ % MESSAGE_HISTORY_SIZE,
+    Output('message-box', 'children'),
+    [Input('new-messages', 'data')],
+    [State('message-box', 'children')]
+)
+
+def create_app():
+    """Build the Flask server with its routes and the Dash UI mounted at /dash/.
+
+    The database is initialized here rather than on import, so ``gunicorn
+    'app:create_app()'`` workers are ready to serve once this returns.
+    """
+    import dash_bootstrap_components as dbc
+
+    server = Flask(__name__)
+    server.config['MAX_CONTENT_LENGTH'] = MAX_CONTENT_LENGTH
+    server.register_blueprint(routes)
+    dash_app = dash.Dash(__name__, server=server, url_base_pathname='/dash/', external_stylesheets=[dbc.themes.BOOTSTRAP])
+    dash_app.layout = build_layout()
+    for function, args, kwargs in UI_CALLBACKS:
+        if isinstance(function, str):
+            dash_app.clientside_callback(function, *args, **kwargs)
+        else:
+            dash_app.callback(*args, **kwargs)(function)
+    server.extensions['dash'] = dash_app
+    init_db()
+    workspaces.start()
+    return server
+
+_default_server = None
+
+def __getattr__(name):
+    # `server` and `app` are built on first use, so importing this module for its helpers stays cheap
+    global _default_server
+    if name not in ('server', 'app'):
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    if _default_server is None:
+        _default_server = create_app()
+    return _default_server if name == 'server' else _default_server.extensions['dash']
+
+def shutdown(timeout=SHUTDOWN_TIMEOUT):
+    """Stop this server process gracefully.
+
+    New uploads and downloads are refused, those in progress get up to
+    ``timeout`` seconds to finish, conversions not yet started are dropped
+    and marked failed, and running ones are waited for.
+    """
+    if not transfer_limiter.drain(timeout):
+        logging.warning(f"Shutting down with {transfer_limiter.active()} transfers still in progress")
+    conversion_queue.shutdown(wait=True, cancel_pending=True)
+    workspaces.stop()
+    close_pool(DATABASE)
+    logging.info("Server process shut down")
+
+# Function to run the Dash development server, serving.py runs the production server
 def run_dash_server():
-    app.run_server(debug=False, dev_tools_hot_reload=False, host='0.0.0.0')
+    create_app().extensions['dash'].run(debug=False, dev_tools_hot_reload=False, host='0.0.0.0')
 
 # Function to open the Dash app in the default web browser
 def open_browser():
     webbrowser.open_new_tab('http://localhost:8050/dash/')
 
 if __name__ == "__main__":
-    init_db() 
-    # Start the Dash server in a separate thread
-    dash_thread = threading.Thread(target=run_dash_server)
-    dash_thread.start()
-    
-    # Wait for a moment to ensure that the server is up and running before opening the browser
-    time.sleep(1)
-    
-    # Open the Dash app in the default web browser in another thread
-    browser_thread = threading.Thread(target=open_browser)
-    browser_thread.start()
+    from serving import serve
+
+    # The browser is opened once the server has had a moment to start
+    threading.Timer(1, open_browser).start()
+    serve()
@@ -0,0 +1,152 @@
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import time
+import zipfile
+
+from blob_store import CHUNK_SIZE
+from metrics import counter, histogram
+
+# Size cap for the finished download archives kept in the downloads folder
+ARCHIVE_CACHE_MAX_BYTES = int(os.environ.get('ARCHIVE_CACHE_MAX_BYTES', 1024 * 1024 * 1024))  # 1 GB
+# Deflate level for file types without an entry in ZIP_COMPRESSION_LEVELS
+DEFAULT_COMPRESSION_LEVEL = int(os.environ.get('ZIP_COMPRESSION_LEVEL', 6))
+# Deflate level per file extension, None stores the file as is because it is already compressed
+ZIP_COMPRESSION_LEVELS = {
+    '.png': None,
+    '.jpg': None,
+    '.jpeg': None,
+    '.webp': None,
+    '.glb': 1,
+    '.ply': 1,
+    '.stl': 1,
+}
+# Permissions of the extracted files, entries opened by name would otherwise be owner-only
+ARCHIVE_FILE_MODE = 0o644
+# Entries larger than this get ZIP64 headers, their compressed size is not known in advance
+ZIP64_THRESHOLD = 1024 * 1024 * 1024
+
+# Build time includes waiting on the client, archives are written as fast as they are downloaded
+ARCHIVE_BUILD_SECONDS = histogram('archive_build_seconds', 'Time spent building and streaming download archives')
+ARCHIVE_BUILT_BYTES = counter('archive_built_bytes_total', 'Bytes of download archives built')
+
+
+def compression_level(arcname):
+    return ZIP_COMPRESSION_LEVELS.get(os.path.splitext(arcname)[1].lower(), DEFAULT_COMPRESSION_LEVEL)
+
+
+def archive_key(entries):
+    # entries are (arcname, content hash) pairs, the compression settings change the archive bytes too
+    key = json.dumps([[arcname, digest, compression_level(arcname)] for arcname, digest in entries])
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+def _compression(arcname):
+    # (compression, compresslevel) for the ZipFile attributes of the same names
+    level = compression_level(arcname)
+    if level is None:
+        return zipfile.ZIP_STORED, None
+    return zipfile.ZIP_DEFLATED, level
+
+
+class _ArchiveSink:
+    """Write-only file object that copies the zip writer's output to a file and keeps it to be yielded."""
+
+    def __init__(self, copy_to):
+        self.copy_to = copy_to
+        self.pending = []
+
+    def write(self, data):
+        self.copy_to.write(data)
+        self.pending.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self.pending)
+        self.pending.clear()
+        return data
+
+
+class ArchiveCache:
+    """Builds download archives while streaming them and keeps the finished ones on disk.
+
+    An archive is named by a hash of its entries' names, content hashes and
+    compression levels, so a repeated download is served from disk with
+    ETag and Range support. The least recently used archives are deleted
+    once the folder grows past ``max_bytes``.
+    """
+
+    def __init__(self, directory, max_bytes=ARCHIVE_CACHE_MAX_BYTES, chunk_size=CHUNK_SIZE):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.chunk_size = chunk_size
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+    def path(self, key):
+        return os.path.join(self.directory, f"{key}.zip")
+
+    def get(self, key):
+        path = self.path(key)
+        try:
+            # The modification time records the last use for eviction
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def stream(self, key, entries):
+        # entries are (arcname, path) pairs, chunks are yielded as soon as the zip writer produces them
+        started = time.perf_counter()
+        fd, part_path = tempfile.mkstemp(dir=self.directory, suffix='.part')
+        complete = False
+        try:
+            with os.fdopen(fd, 'wb') as part_file:
+                sink = _ArchiveSink(part_file)
+                with zipfile.ZipFile(sink, 'w') as zip_file:
+                    for arcname, path in entries:
+                        force_zip64 = os.path.getsize(path) > ZIP64_THRESHOLD
+                        # An entry opened by name takes the archive's compression settings and the fixed
+                        # 1980-01-01 timestamp of ZipInfo, so rebuilding gives the same bytes and the ETag stays valid
+                        zip_file.compression, zip_file.compresslevel = _compression(arcname)
+                        with open(path, 'rb') as src, zip_file.open(arcname, 'w', force_zip64=force_zip64) as dst:
+                            for chunk in iter(lambda: src.read(self.chunk_size), b''):
+                                dst.write(chunk)
+                                if sink.pending:
+                                    yield sink.drain()
+                        # Permissions are only kept in the central directory, written when the archive is closed
+                        zip_file.getinfo(arcname).external_attr = ARCHIVE_FILE_MODE << 16
+                # Closing the archive writes the central directory
+                yield sink.drain()
+            os.replace(part_path, self.path(key))
+            complete = True
+            ARCHIVE_BUILD_SECONDS.observe(time.perf_counter() - started)
+            ARCHIVE_BUILT_BYTES.inc(os.path.getsize(self.path(key)))
+            logging.debug(f"Cached download archive {key}")
+            self.evict(keep=key)
+        finally:
+            if not complete and os.path.exists(part_path):
+                # The client went away before the archive was finished
+                os.remove(part_path)
+
+    def evict(self, keep=None):
+        archives = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.endswith('.zip') and os.path.isfile(path):
+                stat = os.stat(path)
+                archives.append((stat.st_mtime, stat.st_size, path))
+        total_size = sum(size for _, size, _ in archives)
+        for _, size, path in sorted(archives):
+            if total_size <= self.max_bytes:
+                break
+            if keep is not None and path == self.path(keep):
+                continue
+            os.remove(path)
+            total_size -= size
+            logging.debug(f"Evicted download archive {path}")
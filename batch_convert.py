@@ -0,0 +1,175 @@
+import argparse
+import hashlib
+import logging
+import os
+import sys
+import time
+
+from werkzeug.utils import secure_filename
+
+from blob_store import CHUNK_SIZE
+from conversion import CONVERTIBLE_FORMATS
+from conversion_cache import discard_blob
+from database import connect
+from jobs import JOB_DONE, JOB_FAILED
+
+# Models the viewer reads without converting them first
+DIRECT_FORMATS = ('.obj', '.stl', '.ply')
+SOURCE_FORMATS = CONVERTIBLE_FORMATS + DIRECT_FORMATS
+TEXTURE_FORMATS = ('.png', '.jpg', '.jpeg', '.bmp', '.tga', '.tif', '.tiff')
+TEXTURE_FOLDER = 'textures'
+
+
+def find_texture_folder(source_dir, root):
+    # The nearest textures/ folder at or above the source, without leaving the root
+    root = os.path.abspath(root)
+    directory = os.path.abspath(source_dir)
+    while True:
+        candidate = os.path.join(directory, TEXTURE_FOLDER)
+        if os.path.isdir(candidate):
+            return candidate
+        if directory == root or os.path.dirname(directory) == directory:
+            return None
+        directory = os.path.dirname(directory)
+
+
+def find_sources(root):
+    sources = []
+    for directory, dirs, files in os.walk(root):
+        dirs[:] = sorted(d for d in dirs if d != TEXTURE_FOLDER)
+        for name in sorted(files):
+            if os.path.splitext(name)[1].lower() not in SOURCE_FORMATS:
+                continue
+            texture_folder = find_texture_folder(directory, root)
+            textures = []
+            if texture_folder is not None:
+                textures = [os.path.join(texture_folder, texture) for texture in sorted(os.listdir(texture_folder))
+                            if os.path.splitext(texture)[1].lower() in TEXTURE_FORMATS]
+            sources.append((os.path.join(directory, name), textures))
+    return sources
+
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def link_textures(app, filename, texture_paths):
+    linked = 0
+    for path in texture_paths:
+        texture_filename = secure_filename(os.path.basename(path))
+        try:
+            app.validate_texture(path)
+        except ValueError as e:
+            logging.warning(f"Skipping texture {path}: {e}")
+            continue
+        texture_hash = app.blob_store.put_file(path)
+        # A changed image is relinked, the old content is collected once nothing else uses it
+        if not app.texture_assets.link(filename, texture_filename, texture_hash, replace=True):
+            continue
+        app.build_texture_levels(texture_filename, texture_hash)
+        linked += 1
+    return linked
+
+
+def convert_directory(root, workers=None, verbose=False):
+    # The app module sets up the database, blob store and worker pool used by the server
+    import app
+
+    if not verbose:
+        logging.getLogger().setLevel(logging.WARNING)
+    if workers:
+        app.conversion_queue.max_workers = workers
+    app.init_db()
+    started = time.time()
+    results = []
+    pending = {}
+    seen = {}
+    total_bytes = 0
+
+    def record(filename, status, detail=''):
+        # Each file is reported as soon as it is done
+        results.append((filename, status, detail))
+        print(f"{status:>10}  {filename}" + (f"  ({detail})" if detail else ''), flush=True)
+
+    for source_path, texture_paths in find_sources(root):
+        filename = secure_filename(os.path.basename(source_path))
+        if filename in seen:
+            record(filename, 'skipped', f"same name as {seen[filename]}")
+            continue
+        seen[filename] = source_path
+        file_started = time.time()
+        original_hash = file_digest(source_path)
+        with connect(app.DATABASE) as conn:
+            existing = conn.execute('SELECT original_hash, obj_hash FROM files WHERE filename = ?', (filename,)).fetchone()
+            unchanged = existing is not None and existing[0] == original_hash and existing[1] is not None
+            if existing is not None and not unchanged:
+                # The source changed or its conversion never finished, convert it again
+                conn.execute('DELETE FROM files WHERE filename = ?', (filename,))
+                if existing[0] != original_hash:
+                    discard_blob(conn, app.blob_store, existing[0])
+        if existing is not None and not unchanged:
+            app.model_artifacts.release(existing[1])
+        if unchanged:
+            linked = link_textures(app, filename, texture_paths)
+            record(filename, 'unchanged', f"{linked} textures updated" if linked else '')
+            continue
+
+        total_bytes += os.path.getsize(source_path)
+        app.blob_store.put_file(source_path)
+        job_id = app.register_source(filename, original_hash)
+        linked = link_textures(app, filename, texture_paths)
+        if job_id is None:
+            record(filename, 'stored', f"{time.time() - file_started:.2f}s, {linked} textures")
+        else:
+            pending[job_id] = (filename, linked)
+
+    while pending:
+        for job_id in list(pending):
+            job = app.conversion_queue.get_job(job_id)
+            if job['status'] not in (JOB_DONE, JOB_FAILED):
+                continue
+            filename, linked = pending.pop(job_id)
+            if job['status'] == JOB_DONE:
+                record(filename, 'converted', f"ran {job['finished_at'] - job['started_at']:.2f}s, "
+                                              f"waited {job['started_at'] - job['queued_at']:.2f}s, {linked} textures")
+            else:
+                record(filename, 'failed', job['error'])
+        time.sleep(0.2)
+
+    # Metadata, levels of detail and scenes of the last models are still being built on the same pool
+    app.conversion_queue.join()
+    app.conversion_queue.shutdown(wait=True)
+    return results, total_bytes, time.time() - started
+
+
+def print_summary(results, total_bytes, elapsed):
+    counts = {}
+    for _, status, _ in results:
+        counts[status] = counts.get(status, 0) + 1
+    processed = counts.get('converted', 0) + counts.get('stored', 0)
+    print(', '.join(f"{count} {status}" for status, count in sorted(counts.items())) or 'No source files found')
+    if elapsed > 0:
+        print(f"Ingested {processed} files ({total_bytes / 1024 / 1024:.1f} MB) in {elapsed:.2f}s: "
+              f"{processed / elapsed:.2f} files/s, {total_bytes / 1024 / 1024 / elapsed:.2f} MB/s")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Convert every model under a directory into the files database.')
+    parser.add_argument('directory', help='Directory to walk for source models and their textures/ folders')
+    parser.add_argument('--workers', type=int, help='Worker processes to convert with, defaults to CONVERSION_WORKERS')
+    parser.add_argument('--verbose', action='store_true', help='Show the debug log')
+    args = parser.parse_args(argv)
+    if not os.path.isdir(args.directory):
+        parser.error(f"Not a directory: {args.directory}")
+
+    results, total_bytes, elapsed = convert_directory(args.directory, args.workers, args.verbose)
+    print_summary(results, total_bytes, elapsed)
+    return 1 if any(status == 'failed' for _, status, _ in results) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
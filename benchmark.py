@@ -0,0 +1,364 @@
+import argparse
+import base64
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pyvista as pv
+from PIL import Image
+
+# Synthetic mesh sizes, in triangles, and texture sizes, in pixels on a side
+BENCHMARK_TRIANGLES = (10000, 100000, 1000000, 5000000)
+BENCHMARK_TEXTURE_SIZES = (512, 1024, 2048, 4096, 8192)
+QUICK_TRIANGLES = (10000, 100000)
+QUICK_TEXTURE_SIZES = (512, 1024)
+# Rows in the files table for the dropdown list queries
+BENCHMARK_LIST_ROWS = (1000, 10000)
+BENCHMARK_REPEAT = 3
+# Results slower than the baseline by more than this share fail a comparison
+COMPARE_TOLERANCE = 0.1
+RESULTS_VERSION = 1
+
+
+def synthetic_mesh(n_triangles):
+    # A rippled plane with texture coordinates, the same mesh for the same size on every run
+    resolution = max(int(round((n_triangles / 2) ** 0.5)), 1)
+    mesh = pv.Plane(i_size=1, j_size=1, i_resolution=resolution, j_resolution=resolution).triangulate()
+    x, y = mesh.points[:, 0], mesh.points[:, 1]
+    mesh.points[:, 2] = 0.02 * np.sin(40 * x) * np.cos(40 * y)
+    return mesh
+
+
+def synthetic_texture(size, path, seed=0):
+    # Noise tiles over a gradient, so the PNG neither compresses to nothing nor is pure noise
+    rng = np.random.default_rng(seed)
+    tile = rng.integers(0, 64, (64, 64, 3), dtype=np.uint8)
+    gradient = np.linspace(0, 191, size, dtype=np.uint8)
+    image = np.tile(tile, (size // 64 + 1, size // 64 + 1, 1))[:size, :size]
+    image = image + gradient[:, None, None]
+    Image.fromarray(image).save(path, 'PNG')
+    return path
+
+
+def timed(fn, repeat=BENCHMARK_REPEAT, setup=None):
+    runs = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        started = time.perf_counter()
+        fn()
+        runs.append(time.perf_counter() - started)
+    return {'min': min(runs), 'median': statistics.median(runs), 'mean': statistics.fmean(runs), 'runs': runs}
+
+
+def git_commit(directory):
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=directory, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class BenchmarkRun:
+    """Collects timings for one run of the suite and writes them as JSON.
+
+    Each result is identified by a benchmark name and its parameters, such
+    as the triangle count, so two result files can be compared entry by
+    entry. Benchmarks whose dependencies are missing are listed as skipped
+    with the reason instead of failing the run.
+    """
+
+    def __init__(self, repeat=BENCHMARK_REPEAT, verbose=True):
+        self.repeat = repeat
+        self.verbose = verbose
+        self.results = []
+        self.skipped = []
+
+    def measure(self, name, fn, setup=None, repeat=None, size_bytes=None, **params):
+        seconds = timed(fn, repeat or self.repeat, setup)
+        result = {'name': name, 'params': params, 'seconds': seconds}
+        if size_bytes:
+            result['bytes'] = size_bytes
+            result['mb_per_s'] = size_bytes / 1024 / 1024 / seconds['median'] if seconds['median'] else None
+        self.results.append(result)
+        if self.verbose:
+            described = ', '.join(f"{key}={value}" for key, value in params.items())
+            print(f"{name:>24}  {described:<28} {seconds['median'] * 1000:10.2f} ms", flush=True)
+        return result
+
+    def skip(self, name, reason):
+        self.skipped.append({'name': name, 'reason': reason})
+        if self.verbose:
+            print(f"{name:>24}  skipped: {reason}", flush=True)
+
+    def as_dict(self, commit=None):
+        return {
+            'version': RESULTS_VERSION,
+            'created_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'commit': commit,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'packages': {'numpy': np.__version__, 'pyvista': pv.__version__},
+            'repeat': self.repeat,
+            'results': self.results,
+            'skipped': self.skipped,
+        }
+
+
+def write_obj_file(mesh, path):
+    from mesh_payload import prepare_mesh, write_obj
+
+    with open(path, 'wb') as f:
+        write_obj(prepare_mesh(mesh), f)
+    return path
+
+
+def bench_parsing(run, workdir, meshes):
+    from blob_store import BlobStore
+    from mesh_arrays import MeshArrayCache, read_obj, to_polydata
+    from mesh_payload import prepare_arrays
+
+    store = BlobStore(os.path.join(workdir, 'parse_blobs'))
+    for n_triangles, path in meshes:
+        size = os.path.getsize(path)
+        run.measure('obj_parse_numpy', lambda: read_obj(path), size_bytes=size, triangles=n_triangles)
+        run.measure('obj_parse_vtk', lambda: pv.read(path), size_bytes=size, triangles=n_triangles)
+        obj_hash = store.put_file(path)
+        cache = MeshArrayCache(store)
+        run.measure('mesh_cache_cold', lambda: cache.load(obj_hash), setup=lambda: cache.discard(obj_hash),
+                    size_bytes=size, triangles=n_triangles)
+        run.measure('mesh_cache_warm', lambda: to_polydata(cache.load(obj_hash)), triangles=n_triangles)
+        arrays = cache.load(obj_hash)
+        run.measure('payload_prepare', lambda: prepare_arrays(arrays), triangles=n_triangles)
+
+
+def bench_conversion(run, workdir, meshes):
+    from conversion import convert_to_obj, load_assimp
+
+    try:
+        load_assimp()
+    except RuntimeError as e:
+        run.skip('convert_to_obj', str(e))
+        return
+    output_path = os.path.join(workdir, 'converted.obj')
+    for n_triangles, path in meshes:
+        run.measure('convert_to_obj', lambda: convert_to_obj(path, output_path),
+                    size_bytes=os.path.getsize(path), triangles=n_triangles)
+
+
+def bench_upload(run, workdir, meshes):
+    from blob_store import BlobStore
+
+    store = BlobStore(os.path.join(workdir, 'upload_blobs'))
+    for n_triangles, path in meshes:
+        with open(path, 'rb') as f:
+            data = f.read()
+        digest = store.put_bytes(data)
+        # What dcc.Upload sends to the upload callback
+        content = f"data:application/octet-stream;base64,{base64.b64encode(data).decode()}"
+        run.measure('upload_decode', lambda: base64.b64decode(content.split(',')[1]), size_bytes=len(data),
+                    triangles=n_triangles)
+        run.measure('upload_store', lambda: store.put_bytes(data), setup=lambda: store.delete(digest),
+                    size_bytes=len(data), triangles=n_triangles)
+
+
+def bench_textures(run, workdir, textures):
+    from blob_store import BlobStore
+    from database import close_pool, connect
+    from textures import TextureVariants, init_texture_variants_table, validate_texture
+
+    database = os.path.join(workdir, 'textures.db')
+    with connect(database) as conn:
+        init_texture_variants_table(conn)
+    store = BlobStore(os.path.join(workdir, 'texture_blobs'))
+    variants = TextureVariants(database, store)
+
+    def clear_levels(texture_hash):
+        with connect(database) as conn:
+            conn.execute('DELETE FROM texture_variants WHERE texture_hash = ?', (texture_hash,))
+
+    for size, path in textures:
+        texture_hash = store.put_file(path)
+        run.measure('texture_validate', lambda: validate_texture(path), size_bytes=os.path.getsize(path), pixels=size)
+        run.measure('texture_levels', lambda: variants.build(texture_hash, '.png'), setup=lambda: clear_levels(texture_hash),
+                    pixels=size)
+    close_pool(database)
+
+
+def bench_list_queries(run, workdir, row_counts=BENCHMARK_LIST_ROWS):
+    from database import QueryCache, close_pool, connect
+    from mesh_metadata import init_metadata_table, like_pattern, source_list_query
+
+    for n_rows in row_counts:
+        database = os.path.join(workdir, f"list_{n_rows}.db")
+        with connect(database) as conn:
+            conn.execute('CREATE TABLE files (id INTEGER PRIMARY KEY, filename TEXT UNIQUE, obj_hash TEXT)')
+            conn.execute('CREATE INDEX idx_files_obj_hash ON files (obj_hash)')
+            init_metadata_table(conn)
+            conn.executemany('INSERT INTO files (filename, obj_hash) VALUES (?, ?)',
+                             ((f"model_{i:06d}.obj", f"{i:064x}") for i in range(n_rows)))
+            conn.executemany('INSERT INTO mesh_metadata (obj_hash, n_points, n_faces, surface_area, materials, has_uvs) VALUES (?, ?, ?, ?, ?, ?)',
+                             ((f"{i:064x}", i * 2, i * 4, float(i), json.dumps([f"material_{i % 7}"]), i % 2) for i in range(n_rows)))
+        sql = source_list_query('faces')
+        params = (like_pattern('model_00'),) * 2
+        cache = QueryCache(database)
+
+        def query():
+            with connect(database) as conn:
+                return conn.execute(sql, params).fetchall()
+
+        run.measure('list_sources_query', query, rows=n_rows)
+        cache.fetchall(sql, params)
+        run.measure('list_sources_cached', lambda: cache.fetchall(sql, params), rows=n_rows)
+        run.measure('list_files_query', lambda: cache.fetchall('SELECT filename FROM files'), setup=cache.clear, rows=n_rows)
+        close_pool(database)
+
+
+def bench_app(run, workdir, meshes, textures):
+    # The app module keeps its database and folders in the current directory, which is the benchmark workspace
+    names = ('upload_register', 'texture_register', 'download_zip_stream', 'download_zip_cached')
+    if 'app' in sys.modules:
+        for name in names:
+            run.skip(name, "app was imported before the benchmark workspace was set up")
+        return
+    try:
+        import app
+    except (KeyboardInterrupt, SystemExit):
+        raise
+    except BaseException as e:
+        for name in names:
+            run.skip(name, f"{type(e).__name__}: {e}")
+        return
+    logging.getLogger().setLevel(logging.WARNING)
+    app.init_db()
+    client = app.server.test_client()
+    texture_size, texture_path = textures[0]
+    with open(texture_path, 'rb') as f:
+        texture_data = f.read()
+    counter = iter(range(10 ** 9))
+
+    for n_triangles, path in meshes:
+        with open(path, 'rb') as f:
+            digest = app.blob_store.put_bytes(f.read())
+        run.measure('upload_register', lambda: app.register_source(f"model_{next(counter)}.obj", digest),
+                    triangles=n_triangles)
+        # Metadata and levels of detail for the model are built before it is downloaded
+        app.conversion_queue.join()
+        filename = f"model_{next(counter)}.obj"
+        app.register_source(filename, digest)
+        texture_hash = app.blob_store.put_bytes(texture_data)
+        run.measure('texture_register', lambda: app.register_texture(filename, f"texture_{next(counter)}.png", texture_hash),
+                    pixels=texture_size)
+        app.conversion_queue.join()
+
+        url = f"/download-model/{filename}/texture.png"
+
+        def download():
+            response = client.get(url)
+            assert response.status_code == 200, response.status_code
+            return response.get_data()
+
+        def clear_archives():
+            for name in os.listdir(app.DOWNLOAD_DIRECTORY):
+                os.remove(os.path.join(app.DOWNLOAD_DIRECTORY, name))
+
+        run.measure('download_zip_stream', download, setup=clear_archives, triangles=n_triangles)
+        run.measure('download_zip_cached', download, triangles=n_triangles)
+    app.conversion_queue.join()
+    app.conversion_queue.shutdown(wait=True)
+
+
+def run_benchmarks(triangles=BENCHMARK_TRIANGLES, texture_sizes=BENCHMARK_TEXTURE_SIZES, repeat=BENCHMARK_REPEAT,
+                   list_rows=BENCHMARK_LIST_ROWS, with_app=True, verbose=True):
+    run = BenchmarkRun(repeat, verbose)
+    source_dir = os.getcwd()
+    commit = git_commit(os.path.dirname(os.path.abspath(__file__)))
+    with tempfile.TemporaryDirectory(prefix='benchmark-') as workdir:
+        os.chdir(workdir)
+        # Modules that keep paths relative to the current directory are only imported from here on
+        sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+        try:
+            meshes = [(n, write_obj_file(synthetic_mesh(n), os.path.join(workdir, f"mesh_{n}.obj"))) for n in triangles]
+            textures = [(size, synthetic_texture(size, os.path.join(workdir, f"texture_{size}.png")))
+                        for size in texture_sizes]
+            bench_parsing(run, workdir, meshes)
+            bench_conversion(run, workdir, meshes)
+            bench_upload(run, workdir, meshes)
+            bench_textures(run, workdir, textures)
+            bench_list_queries(run, workdir, list_rows)
+            if with_app:
+                bench_app(run, workdir, meshes, textures)
+        finally:
+            os.chdir(source_dir)
+            sys.path.pop(0)
+    return run.as_dict(commit)
+
+
+def result_key(result):
+    return result['name'], json.dumps(result['params'], sort_keys=True)
+
+
+def compare(baseline, current, tolerance=COMPARE_TOLERANCE):
+    # (name, params, baseline seconds, current seconds, ratio) for results present in both runs, by median time
+    baseline_results = {result_key(result): result for result in baseline['results']}
+    rows = []
+    for result in current['results']:
+        before = baseline_results.get(result_key(result))
+        if before is None:
+            continue
+        old, new = before['seconds']['median'], result['seconds']['median']
+        rows.append((result['name'], result['params'], old, new, new / old if old else float('inf')))
+    regressions = [row for row in rows if row[4] > 1 + tolerance]
+    return rows, regressions
+
+
+def print_comparison(rows, tolerance):
+    for name, params, old, new, ratio in rows:
+        described = ', '.join(f"{key}={value}" for key, value in params.items())
+        flag = '  SLOWER' if ratio > 1 + tolerance else ''
+        print(f"{name:>24}  {described:<28} {old * 1000:10.2f} ms -> {new * 1000:10.2f} ms  x{ratio:.2f}{flag}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Time conversion, ingest, list, parsing and download paths on synthetic data.')
+    parser.add_argument('--output', help='JSON file to write the results to, defaults to benchmark-<commit>.json')
+    parser.add_argument('--quick', action='store_true', help='Only the smaller meshes and textures')
+    parser.add_argument('--triangles', type=int, nargs='+', help='Synthetic mesh sizes in triangles')
+    parser.add_argument('--texture-sizes', type=int, nargs='+', help='Synthetic texture sizes in pixels')
+    parser.add_argument('--repeat', type=int, default=BENCHMARK_REPEAT, help='Runs per measurement, the median is compared')
+    parser.add_argument('--compare', nargs=2, metavar=('BASELINE', 'CURRENT'),
+                        help='Compare two result files instead of running, fails when CURRENT is slower')
+    parser.add_argument('--tolerance', type=float, default=COMPARE_TOLERANCE,
+                        help='Share a result may be slower than the baseline before a comparison fails')
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        with open(args.compare[0]) as f:
+            baseline = json.load(f)
+        with open(args.compare[1]) as f:
+            current = json.load(f)
+        rows, regressions = compare(baseline, current, args.tolerance)
+        print_comparison(rows, args.tolerance)
+        print(f"{len(rows)} results compared, {len(regressions)} slower by more than {args.tolerance:.0%}")
+        return 1 if regressions else 0
+
+    triangles = args.triangles or (QUICK_TRIANGLES if args.quick else BENCHMARK_TRIANGLES)
+    texture_sizes = args.texture_sizes or (QUICK_TEXTURE_SIZES if args.quick else BENCHMARK_TEXTURE_SIZES)
+    results = run_benchmarks(triangles, texture_sizes, args.repeat)
+    output = args.output or f"benchmark-{(results['commit'] or 'unknown')[:10]}.json"
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"{len(results['results'])} results written to {output}, {len(results['skipped'])} skipped")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
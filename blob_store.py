@@ -0,0 +1,136 @@
+import glob
+import hashlib
+import logging
+import mmap
+import os
+import shutil
+import tempfile
+
+from metrics import counter, histogram
+
+BLOB_STORE_DIR = os.path.join(os.getcwd(), "blob_store")
+CHUNK_SIZE = 1024 * 1024  # 1 MB
+
+BLOB_WRITE_SECONDS = histogram('blob_write_seconds', 'Time spent hashing and writing blobs to the store')
+BLOB_WRITTEN_BYTES = counter('blob_written_bytes_total', 'Bytes hashed and written to the blob store')
+
+
+class BlobStore:
+    """Content-addressed, deduplicated file store for model and texture data.
+
+    Blobs are named by the SHA-256 of their content and written and read in
+    ``CHUNK_SIZE`` chunks, so callers can stream them through file handles or
+    mmap instead of holding whole files in memory. Readers that pick a parser
+    by file extension ask for :meth:`path` with an extension and get a hard
+    link inside the store, so nothing outside the store can write to a blob.
+    """
+
+    def __init__(self, root=BLOB_STORE_DIR, chunk_size=CHUNK_SIZE):
+        self.root = root
+        self.chunk_size = chunk_size
+        if not os.path.exists(root):
+            os.makedirs(root)
+
+    def _blob_path(self, digest):
+        return os.path.join(self.root, digest[:2], digest)
+
+    def path(self, digest, ext=None):
+        blob_path = self._blob_path(digest)
+        if not ext:
+            return blob_path
+        alias_path = f"{blob_path}{ext.lower()}"
+        if not os.path.exists(alias_path):
+            try:
+                os.link(blob_path, alias_path)
+            except FileExistsError:
+                pass
+            except OSError:
+                shutil.copyfile(blob_path, alias_path)
+        return alias_path
+
+    def exists(self, digest):
+        return digest is not None and os.path.exists(self._blob_path(digest))
+
+    def size(self, digest):
+        return os.path.getsize(self._blob_path(digest))
+
+    def put_stream(self, stream):
+        digest = hashlib.sha256()
+        size = 0
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, suffix='.part')
+        try:
+            with BLOB_WRITE_SECONDS.time(), os.fdopen(fd, 'wb') as tmp_file:
+                for chunk in iter(lambda: stream.read(self.chunk_size), b''):
+                    digest.update(chunk)
+                    tmp_file.write(chunk)
+                    size += len(chunk)
+            BLOB_WRITTEN_BYTES.inc(size)
+            return self._commit(tmp_path, digest.hexdigest()), size
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def put_file(self, path):
+        with open(path, 'rb') as f:
+            return self.put_stream(f)[0]
+
+    def adopt(self, path, digest):
+        # Move a fully written file whose hash is already known into the store
+        try:
+            return self._commit(path, digest)
+        finally:
+            if os.path.exists(path):
+                os.remove(path)
+
+    def put_bytes(self, data):
+        digest = hashlib.sha256(data).hexdigest()
+        if self.exists(digest):
+            return digest
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, suffix='.part')
+        try:
+            with BLOB_WRITE_SECONDS.time(), os.fdopen(fd, 'wb') as tmp_file:
+                tmp_file.write(data)
+            BLOB_WRITTEN_BYTES.inc(len(data))
+            return self._commit(tmp_path, digest)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def _commit(self, tmp_path, digest):
+        blob_path = self._blob_path(digest)
+        if os.path.exists(blob_path):
+            logging.debug(f"Blob {digest} already stored")
+            return digest
+        os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+        os.replace(tmp_path, blob_path)
+        logging.debug(f"Stored blob {digest}")
+        return digest
+
+    def open(self, digest):
+        return open(self._blob_path(digest), 'rb')
+
+    def mmap(self, digest):
+        with self.open(digest) as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return b''
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def iter_chunks(self, digest):
+        with self.open(digest) as f:
+            for chunk in iter(lambda: f.read(self.chunk_size), b''):
+                yield chunk
+
+    def read(self, digest):
+        with self.open(digest) as f:
+            return f.read()
+
+    def copy_to(self, digest, dest_path):
+        with self.open(digest) as src, open(dest_path, 'wb') as dst:
+            shutil.copyfileobj(src, dst, self.chunk_size)
+        return dest_path
+
+    def delete(self, digest):
+        blob_path = self._blob_path(digest)
+        for path in glob.glob(f"{glob.escape(blob_path)}*"):
+            os.remove(path)
+        logging.debug(f"Deleted blob {digest}")
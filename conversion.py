@@ -0,0 +1,95 @@
+import logging
+import os
+from functools import lru_cache
+
+# The assimp library (assimp-vc140-mt.dll, libassimp.so) or the folder holding it, impasse searches its
+# own folder and the system library path when this is not set
+ASSIMP_LIBRARY_PATH = os.environ.get('ASSIMP_LIBRARY_PATH')
+# Where Windows installs kept the DLL before ASSIMP_LIBRARY_PATH, still used when it is present
+LEGACY_ASSIMP_DLL = os.path.join(os.getcwd(), 'assimp-vc140-mt.dll')
+
+# Source formats that are converted before being stored
+CONVERTIBLE_FORMATS = ('.fbx', '.3ds', '.gltf', '.glb', '.dae', '.blend')
+
+# Export targets: format name -> (assimp exporter id, file extension)
+EXPORT_FORMATS = {
+    'glb': ('glb2', '.glb'),
+    'obj': ('obj', '.obj'),
+    'ply': ('plyb', '.ply'),
+    'stl': ('stlb', '.stl'),
+}
+
+# Post-processing step -> name of the impasse.constants.ProcessingStep flag
+POST_PROCESSING_STEPS = {
+    'triangulate': 'Triangulate',
+    'join_identical_vertices': 'JoinIdenticalVertices',
+    'optimize_meshes': 'OptimizeMeshes',
+    'generate_normals': 'GenSmoothNormals',
+}
+
+# Converted models are stored as binary glTF, other formats are exported from it on request
+STORAGE_FORMAT = 'glb'
+DEFAULT_POST_PROCESSING = ('triangulate', 'join_identical_vertices', 'generate_normals')
+
+
+@lru_cache(maxsize=None)
+def load_assimp():
+    """Import impasse, which loads the native assimp library, once per process.
+
+    The folder of ``ASSIMP_LIBRARY_PATH``, or of the legacy DLL next to the
+    app, is put on the library search path impasse reads when it is imported.
+    Raises RuntimeError when the library cannot be found or loaded.
+    """
+    library_path = ASSIMP_LIBRARY_PATH or (LEGACY_ASSIMP_DLL if os.path.exists(LEGACY_ASSIMP_DLL) else None)
+    if library_path:
+        directory = library_path if os.path.isdir(library_path) else os.path.dirname(os.path.abspath(library_path))
+        variable = 'PATH' if os.name == 'nt' else 'LD_LIBRARY_PATH'
+        search_path = os.environ.get(variable, '')
+        if directory not in search_path.split(os.pathsep):
+            os.environ[variable] = os.pathsep.join(filter(None, [directory, search_path]))
+        logging.debug(f"Looking for the assimp library in {directory}")
+    try:
+        import impasse
+        import impasse.constants
+    except (KeyboardInterrupt, SystemExit):
+        raise
+    except BaseException as e:
+        # impasse raises AssimpError, a BaseException that cannot be pickled back from a worker process
+        raise RuntimeError(f"Could not load the assimp library, set ASSIMP_LIBRARY_PATH: {e}") from None
+    return impasse
+
+
+def processing_flags(post_processing):
+    for step in post_processing:
+        if step not in POST_PROCESSING_STEPS:
+            raise ValueError(f"Unknown post-processing step: {step}")
+    flags = 0
+    for step in post_processing:
+        flags |= getattr(load_assimp().constants.ProcessingStep, POST_PROCESSING_STEPS[step])
+    return flags
+
+
+def convert_model(input_path, output_path, target_format=STORAGE_FORMAT, post_processing=DEFAULT_POST_PROCESSING):
+    if target_format not in EXPORT_FORMATS:
+        raise ValueError(f"Unsupported target format: {target_format}")
+    exporter, _ = EXPORT_FORMATS[target_format]
+    assimp = load_assimp()
+    try:
+        logging.debug(f"Loading file for conversion: {input_path}")
+        scene = assimp.load(input_path, processing=processing_flags(post_processing))
+        if scene.meshes:
+            logging.debug(f"Scene loaded successfully with {len(scene.meshes)} meshes")
+            logging.debug(f"Exporting scene to {target_format.upper()}: {output_path}")
+            # Post-processing already ran on import
+            assimp.export(scene, output_path, file_type=exporter, processing=0)
+            logging.debug(f"Exported scene to {target_format.upper()} successfully")
+        else:
+            logging.warning("Scene loaded but contains no meshes.")
+            raise ValueError("Loaded scene contains no meshes.")
+    except Exception as e:
+        logging.error(f"Error during conversion: {e}")
+        raise
+
+
+def convert_to_obj(input_path, output_path):
+    convert_model(input_path, output_path, 'obj', ('triangulate',))
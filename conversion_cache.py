@@ -0,0 +1,159 @@
+import hashlib
+import logging
+import os
+import threading
+import time
+
+from database import connect
+from metrics import counter
+
+# Conversions cached before the blob store existed are migrated out of here
+CONVERSION_CACHE_DIR = os.path.join(os.getcwd(), "conversion_cache")
+# Size cap for the cached conversions
+CONVERSION_CACHE_MAX_BYTES = int(os.environ.get('CONVERSION_CACHE_MAX_BYTES', 2 * 1024 * 1024 * 1024))
+
+CONVERSION_CACHE_LOOKUPS = counter('conversion_cache_lookups_total', 'Conversion cache lookups made instead of converting', ['result'])
+
+
+def cache_key(content_hash, target_format='obj', post_processing=()):
+    # content_hash is the blob store hash of the source, so streamed uploads need no second pass
+    key = f"{content_hash}|{target_format}|{','.join(sorted(post_processing))}"
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+def init_cache_table(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS conversion_cache (
+            key TEXT PRIMARY KEY,
+            target_format TEXT,
+            blob_hash TEXT,
+            size INTEGER,
+            conversion_seconds REAL,
+            hits INTEGER DEFAULT 0,
+            created_at REAL,
+            last_access REAL
+        )''')
+    columns = [row[1] for row in conn.execute('PRAGMA table_info(conversion_cache)')]
+    if 'blob_hash' not in columns:
+        conn.execute('ALTER TABLE conversion_cache ADD COLUMN blob_hash TEXT')
+
+
+def blob_is_referenced(conn, blob_hash):
+    # Models, texture assets and the downscaled texture levels own their blobs
+    return conn.execute('''
+        SELECT 1 FROM files WHERE original_hash = ? OR obj_hash = ?
+        UNION ALL SELECT 1 FROM texture_assets WHERE texture_hash = ?
+        UNION ALL SELECT 1 FROM texture_variants WHERE variant_hash = ? LIMIT 1''',
+        (blob_hash, blob_hash, blob_hash, blob_hash)).fetchone() is not None
+
+
+def discard_blob(conn, store, blob_hash):
+    # Deletes a blob nothing references, such as the original of a refused upload or a failed conversion
+    if blob_hash is None or blob_is_referenced(conn, blob_hash):
+        return False
+    if conn.execute('SELECT 1 FROM conversion_cache WHERE blob_hash = ?', (blob_hash,)).fetchone() is not None:
+        return False
+    store.delete(blob_hash)
+    return True
+
+
+class ConversionCache:
+    """Content-addressed index of converted models with LRU eviction.
+
+    Entries are keyed by :func:`cache_key` and point at the converted model
+    in the blob store. Once the cache grows past ``max_bytes`` the least
+    recently used entries are dropped, and their blobs are deleted unless a
+    ``files`` row or texture asset still references them.
+    """
+
+    def __init__(self, database, store, max_bytes=CONVERSION_CACHE_MAX_BYTES):
+        self.database = database
+        self.store = store
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        return connect(self.database)
+
+    def get(self, key, count=True):
+        # Only lookups made instead of converting count as hits or misses
+        with self._connect() as conn:
+            entry = conn.execute('SELECT blob_hash FROM conversion_cache WHERE key = ?', (key,)).fetchone()
+            blob_hash = entry['blob_hash'] if entry else None
+            if not self.store.exists(blob_hash):
+                if count:
+                    with self._lock:
+                        self.misses += 1
+                    CONVERSION_CACHE_LOOKUPS.inc(result='miss')
+                return None
+            if count:
+                conn.execute('UPDATE conversion_cache SET hits = hits + 1, last_access = ? WHERE key = ?', (time.time(), key))
+            else:
+                conn.execute('UPDATE conversion_cache SET last_access = ? WHERE key = ?', (time.time(), key))
+        if count:
+            with self._lock:
+                self.hits += 1
+            CONVERSION_CACHE_LOOKUPS.inc(result='hit')
+            logging.debug(f"Conversion cache hit for {key}")
+        return blob_hash
+
+    def put(self, key, output_path, conversion_seconds=None, target_format='obj'):
+        blob_hash = self.store.put_file(output_path)
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO conversion_cache (key, target_format, blob_hash, size, conversion_seconds, hits, created_at, last_access) VALUES (?, ?, ?, ?, ?, 0, ?, ?)',
+                (key, target_format, blob_hash, self.store.size(blob_hash), conversion_seconds, now, now))
+        logging.debug(f"Stored conversion {key} in cache")
+        self.evict(keep=key)
+        return blob_hash
+
+    def evict(self, keep=None):
+        with self._connect() as conn:
+            total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM conversion_cache').fetchone()[0]
+            if total <= self.max_bytes:
+                return
+            candidates = conn.execute(
+                'SELECT key, blob_hash, size FROM conversion_cache WHERE key != ? ORDER BY last_access',
+                (keep or '',)).fetchall()
+            for entry in candidates:
+                if total <= self.max_bytes:
+                    break
+                conn.execute('DELETE FROM conversion_cache WHERE key = ?', (entry['key'],))
+                total -= entry['size']
+                still_cached = conn.execute('SELECT 1 FROM conversion_cache WHERE blob_hash = ?', (entry['blob_hash'],)).fetchone()
+                if entry['blob_hash'] and not still_cached and not blob_is_referenced(conn, entry['blob_hash']):
+                    self.store.delete(entry['blob_hash'])
+                logging.debug(f"Evicted conversion {entry['key']} from cache")
+
+    def migrate_legacy_entries(self, conn, cache_dir=CONVERSION_CACHE_DIR):
+        # Move conversions cached as files in cache_dir into the blob store
+        legacy = conn.execute('SELECT key, target_format FROM conversion_cache WHERE blob_hash IS NULL').fetchall()
+        for key, target_format in legacy:
+            legacy_path = os.path.join(cache_dir, f"{key}.{target_format}")
+            if os.path.exists(legacy_path):
+                conn.execute('UPDATE conversion_cache SET blob_hash = ? WHERE key = ?', (self.store.put_file(legacy_path), key))
+                os.remove(legacy_path)
+            else:
+                conn.execute('DELETE FROM conversion_cache WHERE key = ?', (key,))
+
+    def stats(self):
+        with self._connect() as conn:
+            row = conn.execute('''
+                SELECT COUNT(*) AS entries, COALESCE(SUM(size), 0) AS size,
+                       COALESCE(SUM(hits), 0) AS total_hits,
+                       COALESCE(SUM(hits * conversion_seconds), 0) AS seconds_saved
+                FROM conversion_cache''').fetchone()
+        with self._lock:
+            hits, misses = self.hits, self.misses
+        return {
+            'hits': hits,
+            'misses': misses,
+            'entries': row['entries'],
+            'size_bytes': row['size'],
+            'max_bytes': self.max_bytes,
+            'total_hits': row['total_hits'],
+            'conversion_seconds_saved': row['seconds_saved'],
+        }
@@ -0,0 +1,174 @@
+import logging
+import os
+import queue
+import sqlite3
+import threading
+from collections import OrderedDict
+
+from metrics import counter, histogram
+
+# Idle connections kept open per database file and process
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 8))
+# Seconds a writer waits for another writer before "database is locked"
+DB_BUSY_TIMEOUT = 30
+# Prepared statements kept per connection, pooled connections reuse them across requests
+DB_CACHED_STATEMENTS = 256
+# Query results kept in memory per cache, the least recently used are dropped past this
+QUERY_CACHE_MAX_ENTRIES = int(os.environ.get('QUERY_CACHE_MAX_ENTRIES', 128))
+
+DB_QUERY_SECONDS = histogram('db_query_seconds', 'Time spent executing SQL statements', ['statement'])
+QUERY_CACHE_LOOKUPS = counter('query_cache_lookups_total', 'In-memory query cache lookups', ['result'])
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def _open(database, timeout=DB_BUSY_TIMEOUT, factory=sqlite3.Connection):
+    conn = sqlite3.connect(database, timeout=timeout, check_same_thread=False,
+                           cached_statements=DB_CACHED_STATEMENTS, factory=factory)
+    conn.row_factory = sqlite3.Row
+    # WAL lets readers carry on while a writer commits, NORMAL sync is safe in WAL mode
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    return conn
+
+
+def _statement(sql):
+    # The leading keyword keeps the label set small: SELECT, INSERT, UPDATE, PRAGMA...
+    return sql.lstrip().split(None, 1)[0].upper() if sql.strip() else ''
+
+
+class PooledConnection(sqlite3.Connection):
+    """SQLite connection that goes back to its pool when closed or when its ``with`` block ends."""
+
+    pool = None
+
+    def execute(self, sql, parameters=()):
+        with DB_QUERY_SECONDS.time(statement=_statement(sql)):
+            return super().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        with DB_QUERY_SECONDS.time(statement=_statement(sql)):
+            return super().executemany(sql, seq_of_parameters)
+
+    def close(self):
+        if self.pool is None or not self.pool._release(self):
+            super().close()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # Commit or roll back as sqlite3 does, then hand the connection back
+        result = super().__exit__(exc_type, exc_value, traceback)
+        self.close()
+        return result
+
+
+class ConnectionPool:
+    """Thread-safe pool of WAL-mode SQLite connections for one database file.
+
+    Connections handed out by :meth:`connection` are used like the ones
+    from ``sqlite3.connect``; closing them, or leaving their ``with`` block,
+    returns them to the pool. When every pooled connection is in use an
+    extra one is opened rather than waiting, so nested use cannot deadlock.
+    """
+
+    def __init__(self, database, size=DB_POOL_SIZE, timeout=DB_BUSY_TIMEOUT):
+        self.database = database
+        self.timeout = timeout
+        self._idle = queue.LifoQueue(maxsize=size)
+
+    def connection(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            conn = _open(self.database, self.timeout, factory=PooledConnection)
+            conn.pool = self
+            return conn
+
+    def _release(self, conn):
+        if conn.in_transaction:
+            conn.rollback()
+        try:
+            self._idle.put_nowait(conn)
+            return True
+        except queue.Full:
+            conn.pool = None
+            return False
+
+    def close(self):
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            conn.pool = None
+            conn.close()
+
+
+def get_pool(database):
+    # Connections cannot cross a fork, so worker processes get pools of their own
+    key = (os.path.abspath(database), os.getpid())
+    with _pools_lock:
+        if key not in _pools:
+            _pools[key] = ConnectionPool(database)
+        return _pools[key]
+
+
+def connect(database):
+    return get_pool(database).connection()
+
+
+def close_pool(database):
+    with _pools_lock:
+        pool = _pools.pop((os.path.abspath(database), os.getpid()), None)
+    if pool is not None:
+        pool.close()
+
+
+class QueryCache:
+    """Keeps query results in memory until the database is written to.
+
+    Writes are detected with ``PRAGMA data_version`` on a connection of the
+    cache's own, which changes whenever any other connection commits, in
+    this process or another one, so cached results never outlive a write
+    made by a job, another server worker or the batch converter. Parameters
+    can come from the user, such as list filters, so at most ``max_entries``
+    results are kept and the least recently used ones are dropped.
+    """
+
+    def __init__(self, database, max_entries=QUERY_CACHE_MAX_ENTRIES):
+        self.database = database
+        self.max_entries = max_entries
+        self._conn = None
+        self._pid = None
+        self._version = None
+        self._results = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _data_version(self):
+        if self._conn is None or self._pid != os.getpid():
+            self._conn = _open(self.database)
+            self._pid = os.getpid()
+        return self._conn.execute('PRAGMA data_version').fetchone()[0]
+
+    def fetchall(self, sql, params=()):
+        with self._lock:
+            version = self._data_version()
+            if version != self._version:
+                if self._results:
+                    logging.debug("Database changed, cleared cached queries")
+                self._results.clear()
+                self._version = version
+            key = (sql, tuple(params))
+            QUERY_CACHE_LOOKUPS.inc(result='hit' if key in self._results else 'miss')
+            if key in self._results:
+                self._results.move_to_end(key)
+            else:
+                with connect(self.database) as conn:
+                    self._results[key] = conn.execute(sql, params).fetchall()
+                while len(self._results) > self.max_entries:
+                    self._results.popitem(last=False)
+            return self._results[key]
+
+    def clear(self):
+        with self._lock:
+            self._results.clear()
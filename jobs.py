@@ -0,0 +1,288 @@
+import logging
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ProcessPoolExecutor
+
+from conversion_cache import discard_blob
+from database import connect
+from metrics import counter, histogram
+
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_DONE = 'done'
+JOB_FAILED = 'failed'
+
+# Number of worker processes used for conversions, defaults to one per core
+CONVERSION_WORKERS = int(os.environ.get('CONVERSION_WORKERS', os.cpu_count() or 1))
+# Conversion jobs queued or running at once across all server processes, new conversions are refused past this
+MAX_PENDING_CONVERSIONS = int(os.environ.get('MAX_PENDING_CONVERSIONS', 32))
+
+# Conversions run in the worker processes, they are timed from the job rows once they finish
+CONVERSION_SECONDS = histogram('conversion_seconds', 'Time spent in convert_to_obj per job', ['status'])
+CONVERSION_JOBS = counter('conversion_jobs_total', 'Finished conversion jobs', ['status'])
+
+
+class ConversionQueueFull(RuntimeError):
+    pass
+
+
+_process_owner = None
+
+
+def process_owner():
+    # Identifies the server process that queued a job; the random part tells it from an earlier process with the same pid
+    global _process_owner
+    if _process_owner is None or not _process_owner.startswith(f"{os.getpid()}:"):
+        _process_owner = f"{os.getpid()}:{uuid.uuid4().hex[:8]}"
+    return _process_owner
+
+
+def owner_alive(owner):
+    if owner == process_owner():
+        return True
+    try:
+        pid = int(owner.split(':')[0])
+    except (AttributeError, ValueError):
+        return False
+    # An earlier process with our pid is gone; Windows runs a single server process, so any other owner is too
+    if pid == os.getpid() or os.name == 'nt':
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def init_jobs_table(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS conversion_jobs (
+            id INTEGER PRIMARY KEY,
+            filename TEXT,
+            input_path TEXT,
+            output_path TEXT,
+            status TEXT,
+            error TEXT,
+            queued_at REAL,
+            started_at REAL,
+            finished_at REAL,
+            owner TEXT
+        )''')
+    if 'owner' not in [row[1] for row in conn.execute('PRAGMA table_info(conversion_jobs)')]:
+        conn.execute('ALTER TABLE conversion_jobs ADD COLUMN owner TEXT')
+
+
+def fail_interrupted_jobs(conn, store):
+    # Jobs left behind by a process that has exited will never finish. Other gunicorn workers share the
+    # table, so jobs whose owner is still running are left to it. Called once every table that can
+    # reference a blob exists.
+    orphaned = [(job_id, filename) for job_id, filename, owner in conn.execute(
+                    'SELECT id, filename, owner FROM conversion_jobs WHERE status IN (?, ?)', (JOB_QUEUED, JOB_RUNNING))
+                if not owner_alive(owner)]
+    for job_id, filename in orphaned:
+        # Like a failed conversion, the unconverted source and its original are removed so the name can be uploaded again
+        original = conn.execute('SELECT original_hash FROM files WHERE filename = ? AND obj_hash IS NULL', (filename,)).fetchone()
+        if original is not None:
+            conn.execute('DELETE FROM files WHERE filename = ? AND obj_hash IS NULL', (filename,))
+            discard_blob(conn, store, original[0])
+        conn.execute('UPDATE conversion_jobs SET status = ?, error = ? WHERE id = ?',
+                     (JOB_FAILED, 'Interrupted by server restart', job_id))
+    if orphaned:
+        logging.warning(f"Failed {len(orphaned)} conversion jobs interrupted by a server restart")
+    return len(orphaned)
+
+
+def _run_conversion_job(database, job_id, convert, input_path, output_path):
+    # Runs inside a worker process
+    with connect(database) as conn:
+        conn.execute('UPDATE conversion_jobs SET status = ?, started_at = ? WHERE id = ?',
+                     (JOB_RUNNING, time.time(), job_id))
+    convert(input_path, output_path)
+
+
+class ConversionJobQueue:
+    """Runs source conversions on a pool of worker processes.
+
+    Job state is kept in the ``conversion_jobs`` table so every server worker
+    can report it. Once a job finishes the converted model is put in the blob
+    store, or in the conversion cache when one is given, and its hash and
+    format are filled in on the job's ``files`` row.
+    """
+
+    def __init__(self, database, convert, store, max_workers=None, cache=None, on_converted=None,
+                 max_pending=MAX_PENDING_CONVERSIONS):
+        self.database = database
+        self.convert = convert
+        self.store = store
+        self.cache = cache
+        self.on_converted = on_converted
+        self.max_workers = max_workers or CONVERSION_WORKERS
+        self.max_pending = max_pending
+        self._executor = None
+        self._closing = False
+        self._active = 0
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+
+    def _get_executor(self):
+        # None while the pool shuts down; a later call starts a new pool
+        with self._lock:
+            if self._closing:
+                return None
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+            return self._executor
+
+    def pending(self):
+        with connect(self.database) as conn:
+            return conn.execute('SELECT COUNT(*) FROM conversion_jobs WHERE status IN (?, ?)', (JOB_QUEUED, JOB_RUNNING)).fetchone()[0]
+
+    def check_capacity(self):
+        # Called before a conversion's upload is accepted, so clients back off instead of queueing without bound
+        pending = self.pending()
+        if pending >= self.max_pending:
+            raise ConversionQueueFull(f"{pending} conversions are already queued, try again shortly")
+
+    def submit(self, filename, input_path, output_path, cache_key=None, workspace=None):
+        # A workspace holding output_path is released when the job is done, and kept when it failed
+        with connect(self.database) as conn:
+            cursor = conn.execute(
+                'INSERT INTO conversion_jobs (filename, input_path, output_path, status, queued_at, owner) VALUES (?, ?, ?, ?, ?, ?)',
+                (filename, input_path, output_path, JOB_QUEUED, time.time(), process_owner()))
+            job_id = cursor.lastrowid
+        logging.debug(f"Queued conversion job {job_id} for {filename}")
+        executor = self._get_executor()
+        if executor is None:
+            # Submitted while the pool shuts down, the job fails like the queued ones shutdown cancels
+            future = Future()
+            future.cancel()
+        else:
+            future = executor.submit(
+                _run_conversion_job, self.database, job_id, self.convert, input_path, output_path)
+        self._track(future, lambda f: self._on_done(job_id, filename, output_path, cache_key, workspace, f))
+        return job_id
+
+    def _track(self, future, callback):
+        # Work counts as active until its callback has run, so join() also waits for the work a callback queues
+        with self._idle:
+            self._active += 1
+
+        def done(f):
+            try:
+                callback(f)
+            finally:
+                with self._idle:
+                    self._active -= 1
+                    self._idle.notify_all()
+        future.add_done_callback(done)
+
+    def join(self, timeout=None):
+        # Waits for every job and task submitted so far, and the follow-up work they queue; False on timeout
+        with self._idle:
+            return self._idle.wait_for(lambda: self._active == 0, timeout)
+
+    def _on_done(self, job_id, filename, output_path, cache_key, workspace, future):
+        error = RuntimeError('Cancelled by server shutdown') if future.cancelled() else future.exception()
+        finished_at = time.time()
+        # The output extension is the format the model was converted to
+        model_format = os.path.splitext(output_path)[1].lower()
+        job = self.get_job(job_id)
+        started_at = job['started_at'] if job is not None else None
+        try:
+            if error is None:
+                try:
+                    if self.cache is not None and cache_key is not None:
+                        obj_hash = self.cache.put(cache_key, output_path, finished_at - (started_at or finished_at),
+                                                  target_format=model_format.lstrip('.'))
+                    else:
+                        obj_hash = self.store.put_file(output_path)
+                    os.remove(output_path)
+                except Exception as e:
+                    # A full disk or a failed blob write fails the job instead of leaving it running
+                    logging.exception(f"Storing the output of conversion job {job_id} failed")
+                    error = e
+            with connect(self.database) as conn:
+                if error is None:
+                    conn.execute('UPDATE files SET obj_hash = ?, obj_cache_key = ?, model_format = ? WHERE filename = ?',
+                                 (obj_hash, cache_key, model_format, filename))
+                    conn.execute('UPDATE conversion_jobs SET status = ?, finished_at = ? WHERE id = ?',
+                                 (JOB_DONE, finished_at, job_id))
+                    logging.debug(f"Conversion job {job_id} finished for {filename}")
+                else:
+                    # A failed conversion leaves no source behind, as before, and its original goes with it
+                    original = conn.execute('SELECT original_hash FROM files WHERE filename = ?', (filename,)).fetchone()
+                    conn.execute('DELETE FROM files WHERE filename = ?', (filename,))
+                    if original is not None:
+                        discard_blob(conn, self.store, original['original_hash'])
+                    conn.execute('UPDATE conversion_jobs SET status = ?, error = ?, finished_at = ? WHERE id = ?',
+                                 (JOB_FAILED, str(error), finished_at, job_id))
+                    logging.error(f"Conversion job {job_id} failed for {filename}: {error}")
+        finally:
+            # Failed conversions keep their workspace for inspection until it is evicted
+            if workspace is not None:
+                workspace.release(keep=error is not None)
+        status = JOB_DONE if error is None else JOB_FAILED
+        if started_at is not None:
+            CONVERSION_SECONDS.observe(finished_at - started_at, status=status)
+        CONVERSION_JOBS.inc(status=status)
+        if error is None and self.on_converted is not None:
+            self.on_converted(filename, obj_hash, model_format)
+
+    def run_in_pool(self, fn, *args):
+        # Follow-up work such as building levels of detail shares the conversion workers. Work queued by
+        # a conversion that finishes while the pool shuts down runs in the calling thread instead.
+        executor = self._get_executor()
+        if executor is None:
+            future = Future()
+            try:
+                future.set_result(fn(*args))
+            except Exception as e:
+                future.set_exception(e)
+        else:
+            future = executor.submit(fn, *args)
+        self._track(future, self._log_task_error)
+        return future
+
+    def _log_task_error(self, future):
+        if not future.cancelled() and future.exception() is not None:
+            logging.error(f"Background task failed: {future.exception()}")
+
+    def get_job(self, job_id):
+        with connect(self.database) as conn:
+            return conn.execute('SELECT * FROM conversion_jobs WHERE id = ?', (job_id,)).fetchone()
+
+    def recent_jobs(self, limit=10):
+        with connect(self.database) as conn:
+            return conn.execute('SELECT * FROM conversion_jobs ORDER BY id DESC LIMIT ?', (limit,)).fetchall()
+
+    def shutdown(self, wait=True, cancel_pending=False):
+        # cancel_pending drops jobs that have not started, they are marked failed; running ones are waited for.
+        # The lock is not held while waiting, the callbacks of running jobs take it to queue their follow-up work.
+        with self._lock:
+            executor, self._executor = self._executor, None
+            if executor is not None:
+                self._closing = True
+        if executor is None:
+            return
+        try:
+            executor.shutdown(wait=wait, cancel_futures=cancel_pending)
+        finally:
+            with self._lock:
+                self._closing = False
+
+
+def describe_job(job):
+    queued_at, started_at, finished_at = job['queued_at'], job['started_at'], job['finished_at']
+    description = f"#{job['id']} {job['filename']}: {job['status']}"
+    if started_at is not None:
+        description += f" (waited {started_at - queued_at:.1f}s"
+        if finished_at is not None:
+            description += f", ran {finished_at - started_at:.1f}s"
+        description += ")"
+    if job['error']:
+        description += f" - {job['error']}"
+    return description
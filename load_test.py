@@ -0,0 +1,174 @@
+import argparse
+import http.client
+import json
+import math
+import os
+import platform
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote, urlsplit
+
+# Requests per scenario, requests in flight at once, and the size of each uploaded model
+LOAD_TEST_REQUESTS = 200
+LOAD_TEST_CONCURRENCY = 16
+LOAD_TEST_UPLOAD_BYTES = 1024 * 1024
+LOAD_TEST_CHUNK_BYTES = 256 * 1024
+LOAD_TEST_SCENARIOS = ('list', 'upload', 'download')
+RESULTS_VERSION = 1
+
+
+def synthetic_obj(size_bytes, tag):
+    # A strip of triangles written as OBJ text of about size_bytes; the tag makes every upload a new blob
+    lines = [f"# {tag}"]
+    n = max(size_bytes // 60, 3)
+    lines += [f"v {i * 0.001:.6f} {(i % 2) * 0.001:.6f} 0.000000" for i in range(n)]
+    lines += [f"f {i} {i + 1} {i + 2}" for i in range(1, n - 1)]
+    return ('\n'.join(lines) + '\n').encode('ascii')
+
+
+def percentile(values, share):
+    # Nearest-rank percentile, the latency that share of the requests stayed under
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered), max(math.ceil(share * len(ordered)), 1)) - 1]
+
+
+class LoadClient:
+    """One keep-alive HTTP connection per thread to the server under test."""
+
+    def __init__(self, base_url, timeout=120):
+        parts = urlsplit(base_url)
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connection(self):
+        if getattr(self._local, 'connection', None) is None:
+            self._local.connection = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        return self._local.connection
+
+    def request(self, method, path, body=None, headers=None):
+        # Returns the status and the whole body, read so streamed downloads are timed to their last byte
+        connection = self._connection()
+        try:
+            connection.request(method, path, body=body, headers=headers or {})
+            response = connection.getresponse()
+            return response.status, response.read()
+        except (OSError, http.client.HTTPException):
+            connection.close()
+            self._local.connection = None
+            raise
+
+    def upload(self, filename, content, chunk_size=LOAD_TEST_CHUNK_BYTES):
+        status, body = self.request('POST', '/uploads', json.dumps({'filename': filename, 'size': len(content)}),
+                                    {'Content-Type': 'application/json'})
+        if status != 201:
+            return status
+        upload_id = json.loads(body)['id']
+        for start in range(0, len(content), chunk_size):
+            chunk = content[start:start + chunk_size]
+            status, _ = self.request('PUT', f'/uploads/{upload_id}', chunk,
+                                     {'Content-Range': f"bytes {start}-{start + len(chunk) - 1}/{len(content)}"})
+            if status != 200:
+                return status
+        status, _ = self.request('POST', f'/uploads/{upload_id}/complete')
+        return status
+
+
+def run_scenario(name, operation, requests, concurrency):
+    # Each operation returns an HTTP status; 503 counts as turned away by backpressure, not as an error
+    latencies, statuses, errors = [], {}, 0
+    lock = threading.Lock()
+
+    def timed(i):
+        nonlocal errors
+        started = time.perf_counter()
+        try:
+            status = operation(i)
+        except (OSError, http.client.HTTPException):
+            with lock:
+                errors += 1
+            return
+        elapsed = time.perf_counter() - started
+        with lock:
+            statuses[status] = statuses.get(status, 0) + 1
+            if status < 400:
+                latencies.append(elapsed)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(timed, range(requests)))
+    elapsed = time.perf_counter() - started
+    return {
+        'name': name,
+        'requests': requests,
+        'concurrency': concurrency,
+        'ok': len(latencies),
+        'rejected': statuses.get(503, 0),
+        'errors': errors + sum(count for status, count in statuses.items() if status >= 400 and status != 503),
+        'statuses': {str(status): count for status, count in sorted(statuses.items())},
+        'seconds': elapsed,
+        'requests_per_s': len(latencies) / elapsed if elapsed else None,
+        'p50_ms': percentile(latencies, 0.5) * 1000 if latencies else None,
+        'p99_ms': percentile(latencies, 0.99) * 1000 if latencies else None,
+    }
+
+
+def run_load_test(base_url, scenarios=LOAD_TEST_SCENARIOS, requests=LOAD_TEST_REQUESTS, concurrency=LOAD_TEST_CONCURRENCY,
+                  upload_bytes=LOAD_TEST_UPLOAD_BYTES, verbose=True):
+    client = LoadClient(base_url)
+    run_id = uuid.uuid4().hex[:8]
+    # One model is uploaded first, the download scenario fetches it
+    seed = f"loadtest-{run_id}-seed.obj"
+    status = client.upload(seed, synthetic_obj(upload_bytes, seed))
+    if status != 201:
+        raise RuntimeError(f"Uploading the seed model failed with status {status}")
+    operations = {
+        'list': lambda i: client.request('GET', '/sources')[0],
+        'upload': lambda i: client.upload(f"loadtest-{run_id}-{i}.obj", synthetic_obj(upload_bytes, f"{run_id}-{i}")),
+        'download': lambda i: client.request('GET', f"/download-model/{quote(seed)}/view_only_mesh")[0],
+    }
+    results = []
+    for name in scenarios:
+        result = run_scenario(name, operations[name], requests, concurrency)
+        results.append(result)
+        if verbose:
+            p50 = f"{result['p50_ms']:9.1f}" if result['p50_ms'] is not None else f"{'-':>9}"
+            p99 = f"{result['p99_ms']:9.1f}" if result['p99_ms'] is not None else f"{'-':>9}"
+            print(f"{name:>10}  {result['ok']:6d} ok {result['rejected']:5d} busy {result['errors']:5d} failed"
+                  f"  {result['requests_per_s'] or 0:9.1f} req/s  p50 {p50} ms  p99 {p99} ms", flush=True)
+    return {
+        'version': RESULTS_VERSION,
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'url': base_url,
+        'python': platform.python_version(),
+        'cpu_count': os.cpu_count(),
+        'upload_bytes': upload_bytes,
+        'results': results,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Measure requests/s and p99 latency of listing, uploading and downloading under concurrency.')
+    parser.add_argument('url', nargs='?', default='http://localhost:8050', help='Base URL of a running server')
+    parser.add_argument('--requests', type=int, default=LOAD_TEST_REQUESTS, help='Requests per scenario')
+    parser.add_argument('--concurrency', type=int, default=LOAD_TEST_CONCURRENCY, help='Requests in flight at once')
+    parser.add_argument('--upload-bytes', type=int, default=LOAD_TEST_UPLOAD_BYTES, help='Size of each uploaded model')
+    parser.add_argument('--scenarios', nargs='+', choices=LOAD_TEST_SCENARIOS, default=list(LOAD_TEST_SCENARIOS))
+    parser.add_argument('--output', help='JSON file to write the results to')
+    args = parser.parse_args(argv)
+
+    results = run_load_test(args.url, args.scenarios, args.requests, args.concurrency, args.upload_bytes)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.output}")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,44 @@
+import logging
+import time
+
+from mesh_arrays import MeshArrayCache, to_polydata
+from mesh_payload import MeshPayloadCache, as_polydata, prepare_arrays, prepare_mesh
+
+# Share of the full-resolution triangles removed at each level after level 0
+LOD_REDUCTIONS = (0.75, 0.9, 0.97)
+# Meshes with fewer triangles than this are only served at full resolution
+MIN_LOD_FACES = 10000
+
+
+def decimate_levels(mesh, reductions=LOD_REDUCTIONS, min_faces=MIN_LOD_FACES):
+    mesh = as_polydata(mesh).triangulate()
+    full_faces = mesh.n_cells
+    if full_faces < min_faces:
+        return
+    previous_reduction = 0.0
+    for level, reduction in enumerate(reductions, start=1):
+        # Each level is decimated from the one before it, which is much cheaper than starting over
+        relative_reduction = 1 - (1 - reduction) / (1 - previous_reduction)
+        mesh = mesh.decimate(relative_reduction, attribute_error=True, scalars=False, vectors=False,
+                             normals=False, tcoords=True, tensors=False)
+        previous_reduction = reduction
+        yield level, mesh
+
+
+def build_lod_pyramid(database, store, obj_hash, ext='.obj'):
+    # Runs inside a worker process
+    payloads = MeshPayloadCache(database, store)
+    if len(payloads.levels(obj_hash)) > 1:
+        return len(payloads.levels(obj_hash))
+    started = time.time()
+    arrays = MeshArrayCache(store).load(obj_hash, ext)
+    payloads.store_level(obj_hash, 0, prepare_arrays(arrays), time.time() - started)
+    mesh = to_polydata(arrays)
+    n_levels = 1
+    for level, reduced in decimate_levels(mesh):
+        level_started = time.time()
+        arrays = prepare_mesh(reduced)
+        payloads.store_level(obj_hash, level, arrays, time.time() - level_started, with_obj=True)
+        n_levels += 1
+    logging.debug(f"Built {n_levels} levels of detail for {obj_hash} in {time.time() - started:.2f}s")
+    return n_levels
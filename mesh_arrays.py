@@ -0,0 +1,352 @@
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+from mesh_optimize import MESH_OPTIMIZE, MESH_QUANTIZE, MESH_WELD_TOLERANCE, QUANTIZATION_BITS, dequantize, optimize_arrays
+from metrics import histogram
+
+# Parsed meshes are kept under the blob store root, in a folder no blob prefix can collide with
+MESH_ARRAYS_DIRNAME = 'mesh_arrays'
+# Arrays written for every cached mesh, tcoords and normals only when the mesh has them
+MESH_ARRAY_NAMES = ('points', 'faces', 'tcoords', 'normals')
+# Written next to the arrays: how to scale quantized arrays back, and what optimizing the mesh changed
+QUANTIZATION_FILENAME = 'quantization.json'
+REPORT_FILENAME = 'optimization.json'
+
+MESH_LOAD_SECONDS = histogram('mesh_load_seconds', 'Time spent loading meshes, mapped from the cache or parsed', ['source'])
+
+_SPACE = ord(' ')
+# Tabs and carriage returns parse as spaces, face corners also have their slashes turned into spaces
+_VALUE_SEPARATORS = bytes.maketrans(b'\t\r', b'  ')
+_INDEX_SEPARATORS = bytes.maketrans(b'\t\r/', b'   ')
+
+
+def _line_bounds(buf):
+    ends = np.flatnonzero(buf == ord('\n'))
+    starts = np.concatenate(([0], ends + 1))
+    ends = np.concatenate((ends, [len(buf)]))
+    if starts[-1] == len(buf):
+        starts, ends = starts[:-1], ends[:-1]
+    return starts, ends
+
+
+def _line_types(buf, starts, ends):
+    # The first two bytes of each line tell vertex, texture coordinate, normal, face and group lines apart
+    padded = np.concatenate((buf, np.zeros(2, dtype=np.uint8)))
+    first = np.where(ends > starts, padded[starts], 0)
+    second = np.where(ends > starts + 1, padded[starts + 1], 0)
+    blank = (second == _SPACE) | (second == ord('\t'))
+    return {
+        'v': (first == ord('v')) & blank,
+        'vt': (first == ord('v')) & (second == ord('t')),
+        'vn': (first == ord('v')) & (second == ord('n')),
+        'f': (first == ord('f')) & blank,
+        'g': ((first == ord('o')) | (first == ord('g'))) & blank,
+    }
+
+
+def _runs(mask):
+    # (first, last) line numbers of each block of consecutive selected lines
+    edges = np.diff(np.concatenate(([0], mask.astype(np.int8), [0])))
+    return zip(np.flatnonzero(edges == 1), np.flatnonzero(edges == -1) - 1)
+
+
+def _select_text(data, starts, ends, mask, keyword, separators=_VALUE_SEPARATORS):
+    # The selected lines with their keyword blanked out, one block of consecutive lines at a time
+    blank = b' ' * len(keyword)
+    return b'\n'.join(data[starts[first]:ends[last]].translate(separators).replace(keyword, blank)
+                      for first, last in _runs(mask))
+
+
+def _parse_rows(text, n_rows, dtype, min_columns):
+    values = np.fromstring(text, dtype=dtype, sep=' ')
+    if n_rows == 0:
+        return values.reshape(0, min_columns)
+    if len(values) % n_rows or len(values) // n_rows < min_columns:
+        raise ValueError("Rows have differing numbers of values")
+    return values.reshape(n_rows, -1)[:, :min_columns]
+
+
+def _tokens_per_line(text, corners_per_token):
+    text = np.frombuffer(text, dtype=np.uint8)
+    newline = text == ord('\n')
+    is_space = (text == _SPACE) | newline
+    line_starts = np.concatenate(([0], np.flatnonzero(newline) + 1))
+    token_starts = np.flatnonzero(~is_space & np.concatenate(([True], is_space[:-1])))
+    tokens = np.bincount(np.searchsorted(line_starts, token_starts, side='right') - 1, minlength=len(line_starts))
+    return tokens // corners_per_token
+
+
+def _fan_triangles(counts):
+    # Polygons with n corners become n - 2 triangles sharing their first corner
+    if np.all(counts == 3):
+        return np.arange(3 * len(counts)).reshape(-1, 3)
+    offsets = np.cumsum(counts) - counts
+    polygons = counts >= 3
+    counts, offsets = counts[polygons], offsets[polygons]
+    n_triangles = counts - 2
+    first_corner = np.repeat(offsets, n_triangles)
+    step = np.arange(n_triangles.sum()) - np.repeat(np.cumsum(n_triangles) - n_triangles, n_triangles)
+    return np.stack((first_corner, first_corner + step + 1, first_corner + step + 2), axis=1)
+
+
+def _face_groups(data, starts, ends, types, corners_per_face):
+    # Each triangle's o or g group, numbered in order of first appearance; faces before any group are in 'default'
+    group_lines = types['g']
+    ids = {'default': 0}
+    line_groups = [0]
+    for line in np.flatnonzero(group_lines):
+        name = data[starts[line] + 1:ends[line]].strip().decode(errors='replace') or 'default'
+        line_groups.append(ids.setdefault(name, len(ids)))
+    face_groups = np.asarray(line_groups, dtype=np.int32)[np.cumsum(group_lines)[types['f']]]
+    # Triangle fans come out face by face, polygons with fewer than three corners give none
+    return np.repeat(face_groups, np.maximum(corners_per_face - 2, 0)), list(ids)
+
+
+def read_obj(path, groups=False):
+    """Read the triangles of a Wavefront OBJ file with vectorized NumPy parsing.
+
+    Polygons are split into triangle fans, and vertices whose position,
+    texture coordinate and normal indices differ between faces are
+    duplicated, as VTK's OBJ reader does. Raises ValueError for files this
+    reader does not handle, such as relative indices or mixed face formats.
+    With ``groups`` the result also has ``groups``, the index into
+    ``group_names`` of the o or g group each triangle belongs to.
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    if not data:
+        raise ValueError("Empty OBJ file")
+    if b'\\\n' in data or b'\\\r\n' in data:
+        raise ValueError("Line continuations are not supported")
+    buf = np.frombuffer(data, dtype=np.uint8)
+    starts, ends = _line_bounds(buf)
+    types = _line_types(buf, starts, ends)
+
+    points = _parse_rows(_select_text(data, starts, ends, types['v'], b'v'), int(types['v'].sum()), np.float64, 3)
+    tcoords = _parse_rows(_select_text(data, starts, ends, types['vt'], b'vt'), int(types['vt'].sum()), np.float64, 2)
+    normals = _parse_rows(_select_text(data, starts, ends, types['vn'], b'vn'), int(types['vn'].sum()), np.float64, 3)
+    points, tcoords, normals = (values.astype(np.float32) for values in (points, tcoords, normals))
+
+    n_faces = int(types['f'].sum())
+    if not n_faces:
+        arrays = {'points': points, 'faces': np.empty((0, 3), dtype=np.int32), 'tcoords': None, 'normals': None}
+        if groups:
+            arrays['groups'], arrays['group_names'] = np.empty(0, dtype=np.int32), ['default']
+        return arrays
+    # The first corner shows the index layout: v, v/vt, v//vn or v/vt/vn
+    first_line = int(np.argmax(types['f']))
+    first_corner = data[starts[first_line]:ends[first_line]].split()[1].split(b'/')
+    layout = [i for i, index in enumerate(first_corner) if index]
+    text = _select_text(data, starts, ends, types['f'], b'f', _INDEX_SEPARATORS)
+    corners = np.fromstring(text, dtype=np.int64, sep=' ')
+    if len(corners) == 3 * n_faces * len(layout):
+        # Every face has at least three corners, so this many indices means only triangles
+        corners_per_face = np.full(n_faces, 3)
+    else:
+        corners_per_face = _tokens_per_line(text, len(layout))
+        if len(corners_per_face) != n_faces or len(corners) != corners_per_face.sum() * len(layout):
+            raise ValueError("Faces mix index layouts")
+    corners = corners.reshape(-1, len(layout))
+    if np.any(corners <= 0):
+        raise ValueError("Relative or zero indices are not supported")
+    corners -= 1
+
+    columns = {'v': corners[:, 0], 'vt': None, 'vn': None}
+    for column, kind in zip(corners.T[1:], [('vt', 'vn')[i - 1] for i in layout[1:]]):
+        columns[kind] = column
+    for kind, values in (('v', points), ('vt', tcoords), ('vn', normals)):
+        if columns[kind] is not None and columns[kind].size and columns[kind].max() >= len(values):
+            raise ValueError(f"Face index out of range for {kind}")
+    triangles = _fan_triangles(corners_per_face)
+
+    if all(columns[kind] is None or (len(values) == len(points) and np.array_equal(columns[kind], columns['v']))
+           for kind, values in (('vt', tcoords), ('vn', normals))):
+        # Every corner uses the same index for all attributes, as the viewer's own OBJ files do
+        arrays = {
+            'points': points,
+            'faces': columns['v'][triangles].astype(np.int32),
+            'tcoords': tcoords if columns['vt'] is not None else None,
+            'normals': normals if columns['vn'] is not None else None,
+        }
+    else:
+        unique, inverse = np.unique(corners, axis=0, return_inverse=True)
+        unique_columns = dict(zip(['v'] + [('vt', 'vn')[i - 1] for i in layout[1:]], unique.T))
+        arrays = {
+            'points': points[unique_columns['v']],
+            'faces': inverse.reshape(-1)[triangles].astype(np.int32),
+            'tcoords': tcoords[unique_columns['vt']] if 'vt' in unique_columns else None,
+            'normals': normals[unique_columns['vn']] if 'vn' in unique_columns else None,
+        }
+    if groups:
+        arrays['groups'], arrays['group_names'] = _face_groups(data, starts, ends, types, corners_per_face)
+    return arrays
+
+
+def as_polydata(mesh):
+    import pyvista as pv
+
+    # glTF files read as a MultiBlock with one block per primitive
+    if isinstance(mesh, pv.MultiBlock):
+        mesh = mesh.combine()
+    if not isinstance(mesh, pv.PolyData):
+        mesh = mesh.extract_surface()
+    # Give glTF attributes the names VTK filters expect
+    if 'NORMAL' in mesh.point_data:
+        mesh.point_data['Normals'] = mesh.point_data.pop('NORMAL')
+    if mesh.active_texture_coordinates is None and 'TEXCOORD_0' in mesh.point_data:
+        mesh.active_texture_coordinates = mesh.point_data['TEXCOORD_0']
+    return mesh
+
+
+def polydata_arrays(mesh):
+    mesh = as_polydata(mesh).triangulate()
+    faces = mesh.faces.reshape(-1, 4)[:, 1:] if mesh.faces.size else np.empty((0, 3))
+    tcoords = mesh.active_texture_coordinates
+    normals = mesh.point_data.get('Normals')
+    return {
+        'points': np.asarray(mesh.points, dtype=np.float32),
+        'faces': np.asarray(faces, dtype=np.int32),
+        'tcoords': None if tcoords is None else np.asarray(tcoords, dtype=np.float32),
+        'normals': None if normals is None else np.asarray(normals, dtype=np.float32),
+    }
+
+
+def read_mesh_arrays(path, ext):
+    if ext.lower() == '.obj':
+        try:
+            return read_obj(path)
+        except ValueError as e:
+            logging.debug(f"Falling back to VTK for {path}: {e}")
+    import pyvista as pv
+
+    return polydata_arrays(pv.read(path))
+
+
+def to_polydata(arrays):
+    import pyvista as pv
+
+    points, faces = np.asarray(arrays['points']), np.asarray(arrays['faces'])
+    mesh = pv.PolyData.from_regular_faces(points, faces) if len(faces) else pv.PolyData(points)
+    if arrays.get('tcoords') is not None:
+        # The name VTK's OBJ reader gives texture coordinates
+        mesh.point_data['Texture Coordinates'] = np.asarray(arrays['tcoords'])
+        mesh.point_data.active_texture_coordinates_name = 'Texture Coordinates'
+    if arrays.get('normals') is not None:
+        mesh.point_data['Normals'] = np.asarray(arrays['normals'])
+    return mesh
+
+
+class MeshArrayCache:
+    """Parsed meshes kept as memory-mapped ``.npy`` arrays, keyed by the model's content hash.
+
+    The first load of a model parses it, with :func:`read_obj` for OBJ and
+    VTK for other formats, optimizes it with
+    :func:`mesh_optimize.optimize_arrays` unless ``optimize`` is off, and
+    writes its points, triangles, texture coordinates and normals as one
+    ``.npy`` file each. Later loads, in any process, map those files instead
+    of parsing the model again. Quantized arrays are scaled back to float32
+    on load, so they are read into memory rather than mapped.
+    """
+
+    def __init__(self, store, directory=None, optimize=MESH_OPTIMIZE, quantize=MESH_QUANTIZE):
+        self.store = store
+        self.directory = directory or os.path.join(store.root, MESH_ARRAYS_DIRNAME)
+        self.optimize = optimize
+        self.quantize = quantize
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory)
+
+    def _path(self, digest):
+        return os.path.join(self.directory, digest[:2], digest)
+
+    def _read_json(self, digest, filename):
+        try:
+            with open(os.path.join(self._path(digest), filename)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def get(self, digest):
+        path = self._path(digest)
+        if not os.path.isdir(path):
+            return None
+        arrays = {}
+        for name in MESH_ARRAY_NAMES:
+            array_path = os.path.join(path, f"{name}.npy")
+            arrays[name] = np.load(array_path, mmap_mode='r') if os.path.exists(array_path) else None
+        quantization = self._read_json(digest, QUANTIZATION_FILENAME)
+        return arrays if quantization is None else dequantize(arrays, quantization)
+
+    def report(self, digest):
+        # What the optimization pass changed, None for meshes cached without it
+        return self._read_json(digest, REPORT_FILENAME)
+
+    def put(self, digest, arrays, quantization=None, report=None):
+        path = self._path(digest)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Arrays are written to a scratch folder that is renamed into place, readers never see a partial mesh
+        tmp_path = tempfile.mkdtemp(dir=os.path.dirname(path), suffix='.part')
+        try:
+            for name in MESH_ARRAY_NAMES:
+                if arrays.get(name) is not None:
+                    np.save(os.path.join(tmp_path, f"{name}.npy"), np.ascontiguousarray(arrays[name]))
+            for filename, value in ((QUANTIZATION_FILENAME, quantization), (REPORT_FILENAME, report)):
+                if value is not None:
+                    with open(os.path.join(tmp_path, filename), 'w') as f:
+                        json.dump(value, f)
+            os.rename(tmp_path, path)
+        except OSError:
+            if not os.path.isdir(path):
+                raise
+            # Another worker cached the same mesh first
+        finally:
+            if os.path.exists(tmp_path):
+                shutil.rmtree(tmp_path)
+        return self.get(digest)
+
+    def entries(self):
+        # (digest, last modified) of every cached mesh, scratch folders of writes in progress excepted
+        for prefix in os.listdir(self.directory):
+            prefix_path = os.path.join(self.directory, prefix)
+            if not os.path.isdir(prefix_path):
+                continue
+            for name in os.listdir(prefix_path):
+                if not name.endswith('.part'):
+                    yield name, os.path.getmtime(os.path.join(prefix_path, name))
+
+    def put_parsed(self, digest, arrays):
+        # Freshly parsed arrays are optimized, unless optimize is off, before they are cached
+        quantization, report = None, None
+        if self.optimize:
+            optimize_started = time.perf_counter()
+            arrays, quantization, report = optimize_arrays(arrays, MESH_WELD_TOLERANCE, QUANTIZATION_BITS if self.quantize else None)
+            report['optimize_seconds'] = time.perf_counter() - optimize_started
+            logging.debug(f"Optimized mesh {digest}: {report['vertices_before']} to {report['vertices_after']} vertices, "
+                          f"{report['bytes_before']} to {report['bytes_after']} bytes")
+        return self.put(digest, arrays, quantization, report)
+
+    def load(self, digest, ext='.obj'):
+        started = time.perf_counter()
+        arrays = self.get(digest)
+        if arrays is not None:
+            MESH_LOAD_SECONDS.observe(time.perf_counter() - started, source='cache')
+            return arrays
+        arrays = self.put_parsed(digest, read_mesh_arrays(self.store.path(digest, ext), ext))
+        elapsed = time.perf_counter() - started
+        MESH_LOAD_SECONDS.observe(elapsed, source='parse')
+        logging.debug(f"Parsed mesh {digest} in {elapsed:.2f}s")
+        return arrays
+
+    def discard(self, digest):
+        shutil.rmtree(self._path(digest), ignore_errors=True)
+
+
+def load_mesh(store, digest, ext='.obj'):
+    # A PyVista mesh of the stored model, parsed once and mapped from the cache afterwards
+    return to_polydata(MeshArrayCache(store).load(digest, ext))
@@ -0,0 +1,186 @@
+import io
+import json
+import logging
+import mmap
+import re
+import struct
+import time
+
+from PIL import Image
+
+from database import connect
+from mesh_arrays import as_polydata, load_mesh
+from textures import THUMBNAIL_SIZE
+
+# Orderings offered by the source list, only these are ever put into ORDER BY
+SOURCE_SORTS = {
+    'name': 'files.filename',
+    'newest': 'files.id DESC',
+    'faces': 'mesh_metadata.n_faces DESC',
+    'points': 'mesh_metadata.n_points DESC',
+    'area': 'mesh_metadata.surface_area DESC',
+}
+# The source list never returns more rows than this, the filter narrows it down
+SOURCE_LIST_LIMIT = 500
+
+
+def init_metadata_table(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS mesh_metadata (
+            obj_hash TEXT PRIMARY KEY,
+            n_points INTEGER,
+            n_faces INTEGER,
+            bounds TEXT,
+            surface_area REAL,
+            materials TEXT,
+            has_uvs INTEGER,
+            thumbnail_hash TEXT,
+            compute_seconds REAL
+        )''')
+    # The source list sorts and filters on these without reading any mesh
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_mesh_metadata_faces ON mesh_metadata (n_faces)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_mesh_metadata_points ON mesh_metadata (n_points)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_mesh_metadata_area ON mesh_metadata (surface_area)')
+
+
+def glb_material_names(data):
+    # A GLB starts with a 12 byte header followed by the JSON chunk
+    length, chunk_type = struct.unpack_from('<I4s', data, 12)
+    if chunk_type != b'JSON':
+        return []
+    document = json.loads(bytes(data[20:20 + length]))
+    return [material.get('name') or f"material_{i}" for i, material in enumerate(document.get('materials', []))]
+
+
+def obj_material_names(data):
+    names = []
+    for match in re.finditer(rb'^usemtl[ \t]+(.+?)[ \t]*\r?$', data, re.MULTILINE):
+        name = match.group(1).decode(errors='replace')
+        if name not in names:
+            names.append(name)
+    return names
+
+
+def material_names(path, ext):
+    # Materials are read from the file itself, VTK readers drop their names
+    ext = ext.lower()
+    with open(path, 'rb') as f:
+        if ext == '.glb':
+            return glb_material_names(f.read(64 * 1024 * 1024))
+        if ext == '.gltf':
+            return [material.get('name') or f"material_{i}" for i, material in enumerate(json.load(f).get('materials', []))]
+        if ext == '.obj':
+            try:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                    return obj_material_names(data)
+            except ValueError:
+                # Empty files cannot be mapped
+                return []
+    return []
+
+
+def render_thumbnail(mesh, size=THUMBNAIL_SIZE):
+    # PNG bytes of an offscreen rendering, None where no OpenGL context is available
+    import pyvista as pv
+
+    try:
+        plotter = pv.Plotter(off_screen=True, window_size=(size, size))
+        try:
+            plotter.set_background('white')
+            plotter.add_mesh(mesh, color='lightsteelblue', smooth_shading=True)
+            plotter.view_isometric()
+            image = plotter.screenshot(return_img=True)
+        finally:
+            plotter.close()
+    except Exception as e:
+        logging.warning(f"Could not render a thumbnail: {e}")
+        return None
+    output = io.BytesIO()
+    Image.fromarray(image).save(output, 'PNG', optimize=True)
+    return output.getvalue()
+
+
+def describe_mesh(mesh):
+    mesh = as_polydata(mesh)
+    surface = mesh.triangulate() if mesh.n_cells else mesh
+    return {
+        'n_points': mesh.n_points,
+        'n_faces': mesh.n_cells,
+        'bounds': [float(value) for value in mesh.bounds],
+        'surface_area': float(surface.area) if mesh.n_cells else 0.0,
+        'has_uvs': mesh.active_texture_coordinates is not None,
+    }
+
+
+class MeshMetadata:
+    """Statistics and a thumbnail for every stored model, computed once per model hash.
+
+    The record covers point and face counts, bounds, surface area, material
+    names, whether the model has texture coordinates and a small offscreen
+    rendering, so the source list can show, filter and sort models without
+    reading any mesh data.
+    """
+
+    def __init__(self, database, store):
+        self.database = database
+        self.store = store
+
+    def get(self, obj_hash):
+        with connect(self.database) as conn:
+            return conn.execute('SELECT * FROM mesh_metadata WHERE obj_hash = ?', (obj_hash,)).fetchone()
+
+    def build(self, obj_hash, ext='.obj', mesh=None):
+        existing = self.get(obj_hash)
+        if existing is not None:
+            return existing
+        started = time.time()
+        path = self.store.path(obj_hash, ext)
+        if mesh is None:
+            mesh = load_mesh(self.store, obj_hash, ext)
+        record = describe_mesh(mesh)
+        thumbnail = render_thumbnail(as_polydata(mesh)) if record['n_points'] else None
+        thumbnail_hash = self.store.put_bytes(thumbnail) if thumbnail is not None else None
+        materials = material_names(path, ext)
+        compute_seconds = time.time() - started
+        with connect(self.database) as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO mesh_metadata (obj_hash, n_points, n_faces, bounds, surface_area, materials, has_uvs, thumbnail_hash, compute_seconds) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (obj_hash, record['n_points'], record['n_faces'], json.dumps(record['bounds']), record['surface_area'],
+                 json.dumps(materials), int(record['has_uvs']), thumbnail_hash, compute_seconds))
+        logging.debug(f"Indexed model {obj_hash} in {compute_seconds:.2f}s")
+        return self.get(obj_hash)
+
+
+def source_list_query(sort='name', with_uvs=False):
+    # The filter matches file and material names, the ordering comes from SOURCE_SORTS only
+    order = SOURCE_SORTS.get(sort, SOURCE_SORTS['name'])
+    uv_filter = ' AND mesh_metadata.has_uvs = 1' if with_uvs else ''
+    return f'''
+        SELECT files.filename, mesh_metadata.n_points, mesh_metadata.n_faces, mesh_metadata.surface_area,
+               mesh_metadata.materials, mesh_metadata.has_uvs, mesh_metadata.thumbnail_hash
+        FROM files LEFT JOIN mesh_metadata ON mesh_metadata.obj_hash = files.obj_hash
+        WHERE (files.filename LIKE ? ESCAPE '\\' OR mesh_metadata.materials LIKE ? ESCAPE '\\'){uv_filter}
+        ORDER BY {order}, files.filename
+        LIMIT {SOURCE_LIST_LIMIT}'''
+
+
+def like_pattern(text):
+    escaped = (text or '').replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return f"%{escaped}%"
+
+
+def describe_source(row):
+    if row['n_faces'] is None:
+        return row['filename']
+    details = [f"{row['n_faces']:,} faces", f"{row['n_points']:,} points"]
+    materials = json.loads(row['materials'] or '[]')
+    if materials:
+        details.append(f"{len(materials)} material{'s' if len(materials) != 1 else ''}")
+    if row['has_uvs']:
+        details.append('UVs')
+    return f"{row['filename']} ({', '.join(details)})"
+
+
+def build_mesh_metadata(database, store, obj_hash, ext='.obj'):
+    # Runs inside a worker process
+    return dict(MeshMetadata(database, store).build(obj_hash, ext))
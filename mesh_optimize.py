@@ -0,0 +1,175 @@
+import os
+
+import numpy as np
+
+# Parsed meshes are welded, cleaned and reordered before they are cached, MESH_OPTIMIZE=0 caches them as read
+MESH_OPTIMIZE = os.environ.get('MESH_OPTIMIZE', '1') != '0'
+# Vertices closer than this share one vertex, relative to the model's bounding box diagonal
+MESH_WELD_TOLERANCE = float(os.environ.get('MESH_WELD_TOLERANCE', 1e-6))
+# Texture coordinates and normals closer than this count as equal when welding
+ATTRIBUTE_WELD_TOLERANCE = 1e-5
+# MESH_QUANTIZE=1 stores positions, normals and texture coordinates as 16-bit integers
+MESH_QUANTIZE = os.environ.get('MESH_QUANTIZE') == '1'
+QUANTIZATION_BITS = 16
+
+_MORTON_BITS = 10
+
+
+def _weld_keys(values, tolerance):
+    # Values are snapped to a grid of the tolerance; close values in neighbouring cells stay apart
+    return np.floor(np.asarray(values, dtype=np.float64) / tolerance + 0.5).astype(np.int64)
+
+
+def weld_vertices(arrays, tolerance=MESH_WELD_TOLERANCE):
+    """Merge vertices whose position, texture coordinate and normal agree within the tolerance.
+
+    Returns the welded arrays and the largest distance a position moved.
+    """
+    points = np.asarray(arrays['points'])
+    if not len(points):
+        return dict(arrays), 0.0
+    diagonal = float(np.linalg.norm(points.max(axis=0) - points.min(axis=0))) or 1.0
+    keys = [_weld_keys(points, tolerance * diagonal)]
+    for name in ('tcoords', 'normals'):
+        if arrays.get(name) is not None:
+            keys.append(_weld_keys(arrays[name], ATTRIBUTE_WELD_TOLERANCE))
+    _, first, inverse = np.unique(np.hstack(keys), axis=0, return_index=True, return_inverse=True)
+    inverse = inverse.reshape(-1)
+    welded = {name: None if arrays.get(name) is None else np.asarray(arrays[name])[first]
+              for name in ('points', 'tcoords', 'normals')}
+    welded['faces'] = inverse[np.asarray(arrays['faces'])].astype(np.int32)
+    moved = np.linalg.norm(points - welded['points'][inverse], axis=1)
+    return welded, float(moved.max())
+
+
+def remove_degenerate_faces(points, faces):
+    # Triangles that reuse a corner or have no area draw nothing
+    faces = np.asarray(faces)
+    distinct = (faces[:, 0] != faces[:, 1]) & (faces[:, 1] != faces[:, 2]) & (faces[:, 0] != faces[:, 2])
+    corners = np.asarray(points, dtype=np.float64)[faces]
+    area = np.linalg.norm(np.cross(corners[:, 1] - corners[:, 0], corners[:, 2] - corners[:, 0]), axis=1)
+    return faces[distinct & (area > 0)]
+
+
+def _spread_bits(values):
+    # Inserts two zero bits after each of the low 10 bits, for interleaving three coordinates
+    values = values.astype(np.uint32) & 0x3FF
+    values = (values | (values << 16)) & 0x030000FF
+    values = (values | (values << 8)) & 0x0300F00F
+    values = (values | (values << 4)) & 0x030C30C3
+    return (values | (values << 2)) & 0x09249249
+
+
+def morton_order(points, faces):
+    # Triangles sorted along a Z-order curve through their centroids, so neighbours are drawn together
+    centroids = np.asarray(points, dtype=np.float64)[faces].mean(axis=1)
+    low, high = centroids.min(axis=0), centroids.max(axis=0)
+    cells = (centroids - low) / np.where(high > low, high - low, 1) * ((1 << _MORTON_BITS) - 1)
+    codes = _spread_bits(cells[:, 0]) | (_spread_bits(cells[:, 1]) << 1) | (_spread_bits(cells[:, 2]) << 2)
+    return np.argsort(codes, kind='stable')
+
+
+def reorder_vertices(arrays, faces):
+    # Vertices are numbered in the order the triangles first use them, unused vertices are dropped
+    flat = faces.reshape(-1)
+    _, first_use = np.unique(flat, return_index=True)
+    order = flat[np.sort(first_use)]
+    remap = np.empty(len(arrays['points']), dtype=np.int32)
+    remap[order] = np.arange(len(order), dtype=np.int32)
+    reordered = {name: None if arrays.get(name) is None else np.asarray(arrays[name])[order]
+                 for name in ('points', 'tcoords', 'normals')}
+    reordered['faces'] = remap[faces]
+    return reordered
+
+
+def quantize(arrays, bits=QUANTIZATION_BITS):
+    """Store positions and texture coordinates as unsigned and normals as signed 16-bit integers.
+
+    Positions share one scale across axes so the model keeps its proportions.
+    Returns the quantized arrays and the parameters :func:`dequantize` needs.
+    """
+    steps = (1 << bits) - 1
+    quantized, quantization = dict(arrays), {'bits': bits}
+    for name, shared_scale in (('points', True), ('tcoords', False)):
+        values = arrays.get(name)
+        if values is None or not len(values):
+            continue
+        values = np.asarray(values, dtype=np.float64)
+        low, extent = values.min(axis=0), values.max(axis=0) - values.min(axis=0)
+        if shared_scale:
+            extent = np.full_like(extent, extent.max())
+        scale = np.where(extent > 0, extent, 1) / steps
+        quantized[name] = np.round((values - low) / scale).astype(np.uint16)
+        quantization[name] = {'offset': low.tolist(), 'scale': scale.tolist()}
+    if arrays.get('normals') is not None:
+        limit = (1 << (bits - 1)) - 1
+        quantized['normals'] = np.round(np.clip(arrays['normals'], -1, 1) * limit).astype(np.int16)
+        quantization['normals'] = {'offset': [0.0] * 3, 'scale': [1 / limit] * 3}
+    return quantized, quantization
+
+
+def dequantize(arrays, quantization):
+    restored = dict(arrays)
+    for name in ('points', 'tcoords', 'normals'):
+        if name in quantization and arrays.get(name) is not None:
+            params = quantization[name]
+            restored[name] = (arrays[name] * np.asarray(params['scale']) + np.asarray(params['offset'])).astype(np.float32)
+    return restored
+
+
+def _nbytes(arrays):
+    return int(sum(np.asarray(arrays[name]).nbytes for name in ('points', 'faces', 'tcoords', 'normals')
+                   if arrays.get(name) is not None))
+
+
+def _max_error(before, after):
+    if before is None or not len(before):
+        return 0.0
+    return float(np.abs(np.asarray(before, dtype=np.float64) - after).max())
+
+
+def optimize_arrays(arrays, tolerance=MESH_WELD_TOLERANCE, quantize_bits=None):
+    """Weld, clean and reorder parsed mesh arrays, optionally quantizing them.
+
+    Returns the optimized arrays, the quantization parameters or None, and a
+    report of the vertex, face and byte counts before and after along with
+    the largest change made to any position, normal or texture coordinate.
+    Point clouds are only quantized, they have no triangles to clean or reorder.
+    """
+    points = np.asarray(arrays['points'])
+    report = {
+        'vertices_before': len(points),
+        'faces_before': len(arrays['faces']),
+        'bytes_before': _nbytes(arrays),
+        'weld_tolerance': tolerance,
+        'max_weld_distance': 0.0,
+        'degenerate_faces': 0,
+    }
+    optimized = dict(arrays)
+    if len(arrays['faces']) and len(points):
+        welded, report['max_weld_distance'] = weld_vertices(arrays, tolerance)
+        faces = remove_degenerate_faces(welded['points'], welded['faces'])
+        report['degenerate_faces'] = len(arrays['faces']) - len(faces)
+        if len(faces):
+            faces = faces[morton_order(welded['points'], faces)]
+            optimized = reorder_vertices(welded, faces)
+        else:
+            optimized = {'points': points[:0], 'faces': faces, 'tcoords': None, 'normals': None}
+    quantization = None
+    report['quantized'] = bool(quantize_bits)
+    report['max_quantization_error'] = {}
+    if quantize_bits and len(optimized['points']):
+        stored, quantization = quantize(optimized, quantize_bits)
+        restored = dequantize(stored, quantization)
+        report['max_quantization_error'] = {name: _max_error(optimized.get(name), restored[name])
+                                            for name in ('points', 'tcoords', 'normals') if optimized.get(name) is not None}
+        optimized = stored
+    report.update({
+        'vertices_after': len(optimized['points']),
+        'faces_after': len(optimized['faces']),
+        'bytes_after': _nbytes(optimized),
+    })
+    # Positions move by at most the weld distance plus the quantization error along each axis
+    report['max_position_error'] = report['max_weld_distance'] + float(np.sqrt(3)) * report['max_quantization_error'].get('points', 0.0)
+    return optimized, quantization, report
+
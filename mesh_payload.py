@@ -0,0 +1,167 @@
+import logging
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from database import connect
+from mesh_arrays import MeshArrayCache, as_polydata, to_polydata
+
+# Payloads are binary little-endian PLY: a short text header followed by packed
+# float32 vertex records and uint8 count + int32 triangle index records, which
+# vtk.js and most WebGL loaders read without any conversion
+PAYLOAD_MIMETYPE = 'application/octet-stream'
+
+
+def init_payload_table(conn):
+    columns = [row[1] for row in conn.execute('PRAGMA table_info(mesh_payloads)')]
+    if columns and 'level' not in columns:
+        # Payloads are derived data, tables from before level-of-detail support are rebuilt on demand
+        conn.execute('DROP TABLE mesh_payloads')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS mesh_payloads (
+            obj_hash TEXT,
+            level INTEGER,
+            payload_hash TEXT,
+            lod_obj_hash TEXT,
+            n_points INTEGER,
+            n_faces INTEGER,
+            prepare_seconds REAL,
+            PRIMARY KEY (obj_hash, level)
+        )''')
+
+
+def prepare_mesh(mesh):
+    mesh = as_polydata(mesh).triangulate()
+    uvs = mesh.active_texture_coordinates
+    if mesh.faces.size:
+        mesh = mesh.compute_normals(cell_normals=False, split_vertices=False)
+        normals = mesh.point_data['Normals']
+        faces = mesh.faces.reshape(-1, 4)[:, 1:]
+    else:
+        # Point clouds and line sets have nothing to shade
+        normals = np.zeros((mesh.n_points, 3))
+        faces = np.empty((0, 3))
+    return {
+        'positions': np.asarray(mesh.points, dtype='<f4'),
+        'normals': np.asarray(normals, dtype='<f4'),
+        'uvs': None if uvs is None else np.asarray(uvs, dtype='<f4'),
+        'indices': np.asarray(faces, dtype='<i4'),
+    }
+
+
+def prepare_arrays(arrays):
+    # Cached meshes that already carry normals are packed without going through VTK
+    if arrays['normals'] is None or not len(arrays['faces']):
+        return prepare_mesh(to_polydata(arrays))
+    return {
+        'positions': np.asarray(arrays['points'], dtype='<f4'),
+        'normals': np.asarray(arrays['normals'], dtype='<f4'),
+        'uvs': None if arrays['tcoords'] is None else np.asarray(arrays['tcoords'], dtype='<f4'),
+        'indices': np.asarray(arrays['faces'], dtype='<i4'),
+    }
+
+
+def _write_rows(output, fmt, rows, chunk_rows=65536):
+    # Formats a block of rows with one % operation instead of one per row as np.savetxt does
+    line = fmt + '\n'
+    for start in range(0, len(rows), chunk_rows):
+        chunk = rows[start:start + chunk_rows]
+        output.write((line * len(chunk) % tuple(chunk.ravel().tolist())).encode('ascii'))
+
+
+def write_obj(arrays, output):
+    positions, normals, uvs, indices = arrays['positions'], arrays['normals'], arrays['uvs'], arrays['indices']
+    _write_rows(output, 'v %.6g %.6g %.6g', positions)
+    if uvs is not None:
+        _write_rows(output, 'vt %.6g %.6g', uvs)
+    _write_rows(output, 'vn %.6g %.6g %.6g', normals)
+    # OBJ indices are 1-based and every vertex shares its position, uv and normal index
+    corners = np.repeat(indices + 1, 3 if uvs is not None else 2, axis=1)
+    fmt = 'f %d/%d/%d %d/%d/%d %d/%d/%d' if uvs is not None else 'f %d//%d %d//%d %d//%d'
+    _write_rows(output, fmt, corners)
+
+
+def write_ply(arrays, output):
+    positions, normals, uvs, indices = arrays['positions'], arrays['normals'], arrays['uvs'], arrays['indices']
+    fields = [('x', '<f4'), ('y', '<f4'), ('z', '<f4'), ('nx', '<f4'), ('ny', '<f4'), ('nz', '<f4')]
+    if uvs is not None:
+        fields += [('s', '<f4'), ('t', '<f4')]
+    vertices = np.empty(len(positions), dtype=fields)
+    vertices['x'], vertices['y'], vertices['z'] = positions.T
+    vertices['nx'], vertices['ny'], vertices['nz'] = normals.T
+    if uvs is not None:
+        vertices['s'], vertices['t'] = uvs.T
+    faces = np.empty(len(indices), dtype=[('count', 'u1'), ('indices', '<i4', (3,))])
+    faces['count'] = 3
+    faces['indices'] = indices
+
+    header = ['ply', 'format binary_little_endian 1.0', f'element vertex {len(vertices)}']
+    header += [f'property float {name}' for name, _ in fields]
+    header += [f'element face {len(faces)}', 'property list uchar int vertex_indices', 'end_header']
+    output.write(('\n'.join(header) + '\n').encode('ascii'))
+    output.write(vertices.tobytes())
+    output.write(faces.tobytes())
+
+
+class MeshPayloadCache:
+    """Prepares browser mesh payloads once per converted model and keeps them in the blob store.
+
+    Payloads are keyed by the hash of the model they were prepared from, so
+    selecting a model again, or another source that converted to the same
+    model, is served straight from the store.
+    """
+
+    def __init__(self, database, store):
+        self.database = database
+        self.store = store
+
+    def _connect(self):
+        return connect(self.database)
+
+    def get(self, obj_hash, ext='.obj', level=0):
+        # Serve the requested level, or the closest finer one when it was not built
+        with self._connect() as conn:
+            payload = conn.execute(
+                'SELECT * FROM mesh_payloads WHERE obj_hash = ? AND level <= ? ORDER BY level DESC LIMIT 1',
+                (obj_hash, level)).fetchone()
+        if payload is not None and self.store.exists(payload['payload_hash']):
+            return payload
+        return self.prepare(obj_hash, ext)
+
+    def levels(self, obj_hash):
+        with self._connect() as conn:
+            return conn.execute('SELECT * FROM mesh_payloads WHERE obj_hash = ? ORDER BY level', (obj_hash,)).fetchall()
+
+    def store_level(self, obj_hash, level, arrays, prepare_seconds, with_obj=False):
+        payload_hash = self._put(write_ply, arrays, '.ply')
+        lod_obj_hash = self._put(write_obj, arrays, '.obj') if with_obj else None
+        with self._connect() as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO mesh_payloads (obj_hash, level, payload_hash, lod_obj_hash, n_points, n_faces, prepare_seconds) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (obj_hash, level, payload_hash, lod_obj_hash, len(arrays['positions']), len(arrays['indices']), prepare_seconds))
+            return conn.execute('SELECT * FROM mesh_payloads WHERE obj_hash = ? AND level = ?', (obj_hash, level)).fetchone()
+
+    def _put(self, write, arrays, suffix):
+        fd, tmp_path = tempfile.mkstemp(suffix=suffix)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                write(arrays, f)
+            return self.store.put_file(tmp_path)
+        finally:
+            os.remove(tmp_path)
+
+    def with_obj(self, obj_hash, ext='.obj'):
+        # The full-resolution payload along with an OBJ of it, for meshes that only exist as cached arrays
+        payload = self.get(obj_hash, ext)
+        if payload['lod_obj_hash'] is None or not self.store.exists(payload['lod_obj_hash']):
+            payload = self.prepare(obj_hash, ext, with_obj=True)
+        return payload
+
+    def prepare(self, obj_hash, ext='.obj', with_obj=False):
+        started = time.time()
+        arrays = prepare_arrays(MeshArrayCache(self.store).load(obj_hash, ext))
+        prepare_seconds = time.time() - started
+        logging.debug(f"Prepared mesh payload for {obj_hash} in {prepare_seconds:.2f}s")
+        return self.store_level(obj_hash, 0, arrays, prepare_seconds, with_obj=with_obj)
@@ -0,0 +1,215 @@
+import logging
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+# METRICS_ENABLED=0 turns every counter and timer into a no-op
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '1') != '0'
+# Upper bounds, in seconds, of the latency histogram buckets
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+# Log level of the app, and the share of DEBUG records from hot paths that are written
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+LOG_SAMPLE_RATE = float(os.environ.get('LOG_SAMPLE_RATE', 1.0))
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labelnames, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values)]
+    pairs += [f'{name}="{_escape(value)}"' for name, value in extra]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _label_key(labelnames, labels):
+    return tuple(str(labels.get(name, '')) for name in labelnames)
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonic count, such as bytes written or cache hits, kept per label combination."""
+
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        if not METRICS_ENABLED:
+            return
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(_label_key(self.labelnames, labels), 0)
+
+    def samples(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        for key, value in values:
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+
+class Gauge:
+    """Current value, such as bytes on disk, kept per label combination and replaced on every set."""
+
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def set(self, value, **labels):
+        if not METRICS_ENABLED:
+            return
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            self._values[key] = value
+
+    def value(self, **labels):
+        return self._values.get(_label_key(self.labelnames, labels), 0)
+
+    def samples(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        for key, value in values:
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+
+class Histogram:
+    """Distribution of durations in seconds, kept per label combination in cumulative buckets."""
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        if not METRICS_ENABLED:
+            return
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            counts, total = self._values.get(key, (None, 0.0))
+            if counts is None:
+                counts = [0] * len(self.buckets)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            self._values[key] = (counts, total + value)
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def count(self, **labels):
+        counts, _ = self._values.get(_label_key(self.labelnames, labels), ([0], 0.0))
+        return sum(counts)
+
+    def samples(self):
+        with self._lock:
+            values = sorted((key, (list(counts), total)) for key, (counts, total) in self._values.items())
+        for key, (counts, total) in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, [('le', _format_value(float(bound)))])
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(total)}"
+            yield f"{self.name}_count{_format_labels(self.labelnames, key)} {cumulative}"
+
+
+class MetricsRegistry:
+    """The counters, gauges and histograms of one process, rendered in the Prometheus text format.
+
+    Metrics are kept in memory per process. Work done in the conversion
+    worker processes is reported by the server process when a job finishes.
+    """
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, cls, name, documentation, labelnames, **kwargs):
+        with self._lock:
+            if name not in self._metrics:
+                self._metrics[name] = cls(name, documentation, labelnames, **kwargs)
+            return self._metrics[name]
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter, name, documentation, labelnames)
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._register(Gauge, name, documentation, labelnames)
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram, name, documentation, labelnames, buckets=buckets)
+
+    def render(self):
+        lines = []
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda metric: metric.name)
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = MetricsRegistry()
+
+
+def counter(name, documentation, labelnames=()):
+    return REGISTRY.counter(name, documentation, labelnames)
+
+
+def gauge(name, documentation, labelnames=()):
+    return REGISTRY.gauge(name, documentation, labelnames)
+
+
+def histogram(name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+    return REGISTRY.histogram(name, documentation, labelnames, buckets)
+
+
+class SamplingFilter(logging.Filter):
+    """Passes only a share of DEBUG records, records at INFO and above always pass."""
+
+    def __init__(self, rate=LOG_SAMPLE_RATE):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        return record.levelno > logging.DEBUG or self.rate >= 1 or random.random() < self.rate
+
+
+def configure_logging(level=LOG_LEVEL, sample_rate=LOG_SAMPLE_RATE, filename='app.log'):
+    handlers = [logging.FileHandler(filename), logging.StreamHandler()]
+    for handler in handlers:
+        handler.addFilter(SamplingFilter(sample_rate))
+    logging.basicConfig(level=level, format='%(asctime)s - %(levelname)s - %(message)s', handlers=handlers)
@@ -0,0 +1,90 @@
+import logging
+import os
+import time
+
+from conversion_cache import discard_blob
+from database import connect
+from mesh_arrays import MeshArrayCache
+
+# Cached meshes that no table knows about are only deleted once this old, so a mesh being cached right
+# now for a model just registered is left alone
+MODEL_ARTIFACT_GRACE_SECONDS = float(os.environ.get('MODEL_ARTIFACT_GRACE_SECONDS', 3600))
+
+
+class ModelArtifacts:
+    """Data derived from stored models, kept for as long as a ``files`` row uses the model.
+
+    The parsed arrays, viewer payloads and levels of detail, metadata with
+    its thumbnail, and the scene split with the arrays of every mesh are all
+    keyed by the model's hash or by keys derived from it. :meth:`release`
+    deletes them once no source references the model, after a re-conversion
+    or a deletion, and :meth:`collect` sweeps up whatever earlier runs left.
+    """
+
+    def __init__(self, database, store, grace_seconds=MODEL_ARTIFACT_GRACE_SECONDS):
+        self.database = database
+        self.store = store
+        self.grace_seconds = grace_seconds
+        self.meshes = MeshArrayCache(store)
+
+    def _mesh_keys(self, conn, obj_hashes):
+        # The model's own key and those of its meshes and merged node subsets
+        keys = set(obj_hashes)
+        for obj_hash in obj_hashes:
+            keys.update(row[0] for row in conn.execute(
+                '''SELECT mesh_hash FROM scene_nodes WHERE obj_hash = ? AND mesh_hash IS NOT NULL
+                   UNION SELECT mesh_hash FROM scene_subsets WHERE obj_hash = ?''', (obj_hash, obj_hash)))
+        return keys
+
+    def _delete(self, conn, obj_hashes, keys):
+        blobs = set()
+        for key in keys:
+            blobs.update(blob for row in conn.execute('SELECT payload_hash, lod_obj_hash FROM mesh_payloads WHERE obj_hash = ?', (key,))
+                         for blob in row if blob is not None)
+            conn.execute('DELETE FROM mesh_payloads WHERE obj_hash = ?', (key,))
+        for obj_hash in obj_hashes:
+            blobs.update(row[0] for row in conn.execute('SELECT thumbnail_hash FROM mesh_metadata WHERE obj_hash = ? AND thumbnail_hash IS NOT NULL', (obj_hash,)))
+            conn.execute('DELETE FROM mesh_metadata WHERE obj_hash = ?', (obj_hash,))
+            conn.execute('DELETE FROM scene_nodes WHERE obj_hash = ?', (obj_hash,))
+            conn.execute('DELETE FROM scene_subsets WHERE obj_hash = ?', (obj_hash,))
+        for blob in blobs:
+            # Identical payloads or thumbnails of another model share the blob
+            shared = conn.execute('''
+                SELECT 1 FROM mesh_payloads WHERE payload_hash = ? OR lod_obj_hash = ?
+                UNION ALL SELECT 1 FROM mesh_metadata WHERE thumbnail_hash = ? LIMIT 1''', (blob, blob, blob)).fetchone()
+            if shared is None:
+                discard_blob(conn, self.store, blob)
+        for key in keys:
+            self.meshes.discard(key)
+
+    def release(self, obj_hash):
+        # Returns whether the model's artifacts were deleted, they stay while any source uses it
+        if obj_hash is None:
+            return False
+        with connect(self.database) as conn:
+            if conn.execute('SELECT 1 FROM files WHERE obj_hash = ? LIMIT 1', (obj_hash,)).fetchone() is not None:
+                return False
+            self._delete(conn, [obj_hash], self._mesh_keys(conn, [obj_hash]))
+        logging.debug(f"Deleted the artifacts derived from model {obj_hash}")
+        return True
+
+    def collect(self, now=None):
+        # Deletes artifacts of every model no source uses, returns their hashes
+        now = now if now is not None else time.time()
+        with connect(self.database) as conn:
+            live_models = {row[0] for row in conn.execute('SELECT obj_hash FROM files WHERE obj_hash IS NOT NULL')}
+            models = {row[0] for row in conn.execute('''
+                SELECT obj_hash FROM mesh_metadata UNION SELECT obj_hash FROM scene_nodes UNION SELECT obj_hash FROM scene_subsets''')}
+            live = self._mesh_keys(conn, live_models)
+            dead_models = models - live_models
+            dead = self._mesh_keys(conn, dead_models) - live
+            # Payloads of models stored before scene subsets were recorded are only known by their key
+            dead.update(row[0] for row in conn.execute('SELECT DISTINCT obj_hash FROM mesh_payloads') if row[0] not in live)
+            self._delete(conn, dead_models, dead)
+        cutoff = now - self.grace_seconds
+        stale = [digest for digest, modified in self.meshes.entries() if digest not in live and modified < cutoff]
+        for digest in stale:
+            self.meshes.discard(digest)
+        if dead_models or dead or stale:
+            logging.info(f"Deleted artifacts of {len(dead_models)} unused models, {len(dead)} mesh keys and {len(stale)} stray cached meshes")
+        return sorted(dead_models)
@@ -0,0 +1,327 @@
+import base64
+import hashlib
+import json
+import logging
+import struct
+import time
+
+import numpy as np
+
+from database import connect
+from mesh_arrays import MeshArrayCache, read_obj
+from mesh_optimize import reorder_vertices
+
+# NumPy types of glTF accessor component types, and the number of components of each element type
+GLTF_COMPONENT_TYPES = {5120: np.int8, 5121: np.uint8, 5122: np.int16, 5123: np.uint16, 5125: np.uint32, 5126: np.float32}
+GLTF_ELEMENT_SIZES = {'SCALAR': 1, 'VEC2': 2, 'VEC3': 3, 'VEC4': 4, 'MAT4': 16}
+GLTF_TRIANGLES = 4
+# Formats split into meshes of their own, everything else is a scene with one mesh
+SCENE_FORMATS = ('.glb', '.gltf', '.obj')
+
+
+def init_scene_table(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS scene_nodes (
+            obj_hash TEXT,
+            node_id INTEGER,
+            parent_id INTEGER,
+            name TEXT,
+            mesh_hash TEXT,
+            n_points INTEGER,
+            n_faces INTEGER,
+            PRIMARY KEY (obj_hash, node_id)
+        )''')
+    # Merged meshes of several nodes, recorded so they are deleted along with the model
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS scene_subsets (
+            obj_hash TEXT,
+            mesh_hash TEXT,
+            PRIMARY KEY (obj_hash, mesh_hash)
+        )''')
+
+
+def mesh_key(obj_hash, node_ids):
+    # Cache key of the arrays of one or more of a model's meshes, merged in node order
+    ids = ','.join(str(node_id) for node_id in sorted(set(node_ids)))
+    return hashlib.sha256(f"{obj_hash}/scene/{ids}".encode()).hexdigest()
+
+
+def merge_arrays(parts):
+    """Concatenate mesh arrays into one mesh.
+
+    Texture coordinates and normals are kept only when every part has them.
+    """
+    parts = list(parts)
+    offsets = np.cumsum([0] + [len(part['points']) for part in parts])
+    merged = {
+        'points': np.concatenate([np.asarray(part['points'], dtype=np.float32) for part in parts] or [np.empty((0, 3), dtype=np.float32)]),
+        'faces': np.concatenate([np.asarray(part['faces'], dtype=np.int32) + offset for part, offset in zip(parts, offsets)]
+                                or [np.empty((0, 3), dtype=np.int32)]),
+    }
+    for name in ('tcoords', 'normals'):
+        values = [part.get(name) for part in parts]
+        merged[name] = np.concatenate([np.asarray(value, dtype=np.float32) for value in values]) \
+            if values and all(value is not None for value in values) else None
+    return merged
+
+
+def read_gltf(data):
+    """Split GLB or glTF content into its JSON document and a list of its buffers.
+
+    Buffers come from the GLB binary chunk or base64 data URIs; buffers in
+    files of their own raise ValueError, the blob store keeps single files.
+    """
+    binary = None
+    if data[:4] == b'glTF':
+        # A 12 byte header, then chunks of a length, a type and the padded content
+        offset, document = 12, None
+        while offset + 8 <= len(data):
+            length, chunk_type = struct.unpack_from('<I4s', data, offset)
+            chunk = data[offset + 8:offset + 8 + length]
+            if chunk_type == b'JSON':
+                document = json.loads(bytes(chunk))
+            elif chunk_type == b'BIN\x00' and binary is None:
+                binary = bytes(chunk)
+            offset += 8 + length
+        if document is None:
+            raise ValueError("GLB file has no JSON chunk")
+    else:
+        document = json.loads(data)
+    buffers = []
+    for buffer in document.get('buffers', []):
+        uri = buffer.get('uri')
+        if uri is None and binary is not None:
+            buffers.append(binary)
+        elif uri is not None and uri.startswith('data:'):
+            buffers.append(base64.b64decode(uri.split(',', 1)[1]))
+        else:
+            raise ValueError("External glTF buffers are not supported")
+    return document, buffers
+
+
+def _accessor(document, buffers, index):
+    accessor = document['accessors'][index]
+    if 'bufferView' not in accessor or 'sparse' in accessor:
+        raise ValueError("Sparse glTF accessors are not supported")
+    view = document['bufferViews'][accessor['bufferView']]
+    dtype = np.dtype(GLTF_COMPONENT_TYPES[accessor['componentType']]).newbyteorder('<')
+    width = GLTF_ELEMENT_SIZES[accessor['type']]
+    stride = view.get('byteStride') or dtype.itemsize * width
+    values = np.ndarray((accessor['count'], width), dtype=dtype, buffer=buffers[view['buffer']],
+                        offset=view.get('byteOffset', 0) + accessor.get('byteOffset', 0), strides=(stride, dtype.itemsize))
+    if accessor.get('normalized') and dtype.kind in 'iu':
+        return np.maximum(values / np.iinfo(dtype).max, -1.0)
+    return np.array(values)
+
+
+def node_matrix(node):
+    # A node's transform relative to its parent, from its column-major matrix or its translation, rotation and scale
+    if 'matrix' in node:
+        return np.asarray(node['matrix'], dtype=np.float64).reshape(4, 4).T
+    x, y, z, w = node.get('rotation', (0, 0, 0, 1))
+    rotation = np.array([
+        [1 - 2 * (y * y + z * z), 2 * (x * y - z * w), 2 * (x * z + y * w)],
+        [2 * (x * y + z * w), 1 - 2 * (x * x + z * z), 2 * (y * z - x * w)],
+        [2 * (x * z - y * w), 2 * (y * z + x * w), 1 - 2 * (x * x + y * y)],
+    ])
+    matrix = np.eye(4)
+    matrix[:3, :3] = rotation * np.asarray(node.get('scale', (1, 1, 1)), dtype=np.float64)
+    matrix[:3, 3] = node.get('translation', (0, 0, 0))
+    return matrix
+
+
+def transform_arrays(arrays, matrix):
+    # Positions and normals moved into world space, triangles turned around when the transform mirrors them
+    linear = matrix[:3, :3]
+    transformed = dict(arrays)
+    transformed['points'] = (np.asarray(arrays['points'], dtype=np.float64) @ linear.T + matrix[:3, 3]).astype(np.float32)
+    if arrays.get('normals') is not None:
+        normals = np.asarray(arrays['normals'], dtype=np.float64) @ np.linalg.inv(linear)
+        lengths = np.linalg.norm(normals, axis=1, keepdims=True)
+        transformed['normals'] = (normals / np.where(lengths > 0, lengths, 1)).astype(np.float32)
+    if np.linalg.det(linear) < 0:
+        transformed['faces'] = np.asarray(arrays['faces'])[:, ::-1]
+    return transformed
+
+
+def gltf_mesh_arrays(document, buffers, mesh):
+    # The triangle primitives of a glTF mesh as one mesh, points and lines are left out
+    parts = []
+    for primitive in mesh.get('primitives', []):
+        if primitive.get('mode', GLTF_TRIANGLES) != GLTF_TRIANGLES:
+            continue
+        attributes = primitive['attributes']
+        points = _accessor(document, buffers, attributes['POSITION'])
+        if 'indices' in primitive:
+            faces = _accessor(document, buffers, primitive['indices']).reshape(-1, 3)
+        else:
+            faces = np.arange(len(points) - len(points) % 3).reshape(-1, 3)
+        parts.append({
+            'points': points,
+            'faces': faces,
+            'tcoords': _accessor(document, buffers, attributes['TEXCOORD_0']) if 'TEXCOORD_0' in attributes else None,
+            'normals': _accessor(document, buffers, attributes['NORMAL']) if 'NORMAL' in attributes else None,
+        })
+    return merge_arrays(parts)
+
+
+def gltf_scene_nodes(data):
+    """The node tree of a glTF scene with the meshes of its nodes in world space.
+
+    Returns dicts of node_id, parent_id, name and arrays, None for nodes
+    without a mesh. A mesh used by several nodes is placed once per node.
+    """
+    document, buffers = read_gltf(data)
+    nodes = document.get('nodes', [])
+    scenes = document.get('scenes', [])
+    if scenes:
+        roots = scenes[document.get('scene', 0)].get('nodes', [])
+    else:
+        children = {child for node in nodes for child in node.get('children', [])}
+        roots = [i for i in range(len(nodes)) if i not in children]
+    scene_nodes = []
+    stack = [(root, None, np.eye(4)) for root in reversed(roots)]
+    while stack:
+        node_id, parent_id, parent_matrix = stack.pop()
+        node = nodes[node_id]
+        matrix = parent_matrix @ node_matrix(node)
+        arrays = None
+        if 'mesh' in node:
+            mesh = document['meshes'][node['mesh']]
+            arrays = transform_arrays(gltf_mesh_arrays(document, buffers, mesh), matrix)
+            name = node.get('name') or mesh.get('name')
+        else:
+            name = node.get('name')
+        scene_nodes.append({'node_id': node_id, 'parent_id': parent_id, 'name': name or f"node_{node_id}", 'arrays': arrays})
+        stack.extend((child, node_id, matrix) for child in reversed(node.get('children', [])))
+    return scene_nodes
+
+
+def obj_scene_nodes(path):
+    # OBJ files are flat, each o or g group becomes a node holding the triangles of that group
+    arrays = read_obj(path, groups=True)
+    scene_nodes = []
+    for group_id, name in enumerate(arrays['group_names']):
+        faces = np.asarray(arrays['faces'])[arrays['groups'] == group_id]
+        if len(faces):
+            scene_nodes.append({'node_id': len(scene_nodes), 'parent_id': None, 'name': name,
+                                'arrays': reorder_vertices(arrays, faces)})
+    return scene_nodes
+
+
+def read_scene_nodes(path, ext):
+    # An empty list means the model is read as a single mesh
+    ext = ext.lower()
+    if ext not in SCENE_FORMATS:
+        return []
+    try:
+        if ext == '.obj':
+            return obj_scene_nodes(path)
+        with open(path, 'rb') as f:
+            return gltf_scene_nodes(f.read())
+    except (ValueError, KeyError, IndexError, TypeError, struct.error) as e:
+        logging.debug(f"Reading {path} as a single mesh: {e}")
+        return []
+
+
+class SceneGraph:
+    """The node hierarchy of every stored model, with each mesh cached on its own.
+
+    GLB and glTF models keep their node tree, each node with a mesh holds
+    that mesh in world space; OBJ models get a node per o or g group; other
+    formats are one node. Every mesh is optimized and kept in the
+    :class:`~mesh_arrays.MeshArrayCache` under a key of its own, so one part
+    of a large scene is viewed or downloaded without loading the rest. A
+    model with a single mesh uses the model's own cache entry.
+    """
+
+    def __init__(self, database, store):
+        self.database = database
+        self.store = store
+        self.meshes = MeshArrayCache(store)
+
+    def nodes(self, obj_hash):
+        with connect(self.database) as conn:
+            return conn.execute('SELECT * FROM scene_nodes WHERE obj_hash = ? ORDER BY node_id', (obj_hash,)).fetchall()
+
+    def _split(self, obj_hash, ext):
+        # Caches every mesh of the model and returns the node records
+        scene_nodes = read_scene_nodes(self.store.path(obj_hash, ext), ext)
+        meshes = [node for node in scene_nodes if node['arrays'] is not None]
+        if len(meshes) < 2:
+            # The whole model is the one mesh, already parsed when the scene was read
+            arrays = self.meshes.get(obj_hash)
+            if arrays is None:
+                arrays = self.meshes.put_parsed(obj_hash, meshes[0]['arrays']) if meshes else self.meshes.load(obj_hash, ext)
+            name = meshes[0]['name'] if meshes else 'model'
+            return [(0, None, name, obj_hash, len(arrays['points']), len(arrays['faces']))]
+        records = []
+        for node in scene_nodes:
+            mesh_hash, n_points, n_faces = None, None, None
+            if node['arrays'] is not None:
+                mesh_hash = mesh_key(obj_hash, [node['node_id']])
+                arrays = self.meshes.get(mesh_hash) or self.meshes.put_parsed(mesh_hash, node['arrays'])
+                n_points, n_faces = len(arrays['points']), len(arrays['faces'])
+            records.append((node['node_id'], node['parent_id'], node['name'], mesh_hash, n_points, n_faces))
+        return records
+
+    def build(self, obj_hash, ext='.obj'):
+        existing = self.nodes(obj_hash)
+        if existing:
+            return existing
+        started = time.time()
+        records = self._split(obj_hash, ext)
+        with connect(self.database) as conn:
+            conn.executemany(
+                'INSERT OR REPLACE INTO scene_nodes (obj_hash, node_id, parent_id, name, mesh_hash, n_points, n_faces) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                [(obj_hash,) + record for record in records])
+        logging.debug(f"Split model {obj_hash} into {sum(record[3] is not None for record in records)} meshes in {time.time() - started:.2f}s")
+        return self.nodes(obj_hash)
+
+    def mesh_arrays(self, obj_hash, ext, node):
+        arrays = self.meshes.get(node['mesh_hash'])
+        if arrays is None:
+            # The cached arrays were discarded, the model is split again
+            if node['mesh_hash'] == obj_hash:
+                return self.meshes.load(obj_hash, ext)
+            self._split(obj_hash, ext)
+            arrays = self.meshes.get(node['mesh_hash'])
+        return arrays
+
+    def subset(self, obj_hash, ext, node_ids):
+        """Cache key of the arrays holding the meshes of the chosen nodes.
+
+        One node's key is that mesh's own entry; several nodes are merged
+        once and cached under a key of their own. Raises KeyError for ids
+        that are not nodes with a mesh.
+        """
+        nodes = {node['node_id']: node for node in self.build(obj_hash, ext) if node['mesh_hash'] is not None}
+        unknown = sorted(set(node_ids) - set(nodes))
+        if unknown or not node_ids:
+            raise KeyError(f"No meshes at nodes {unknown}")
+        node_ids = sorted(set(node_ids))
+        if len(node_ids) == 1:
+            self.mesh_arrays(obj_hash, ext, nodes[node_ids[0]])
+            return nodes[node_ids[0]]['mesh_hash']
+        key = mesh_key(obj_hash, node_ids)
+        if self.meshes.get(key) is None:
+            self.meshes.put(key, merge_arrays(self.mesh_arrays(obj_hash, ext, nodes[node_id]) for node_id in node_ids))
+            with connect(self.database) as conn:
+                conn.execute('INSERT OR IGNORE INTO scene_subsets (obj_hash, mesh_hash) VALUES (?, ?)', (obj_hash, key))
+        return key
+
+
+def describe_node(node):
+    return {
+        'node_id': node['node_id'],
+        'parent_id': node['parent_id'],
+        'name': node['name'],
+        'has_mesh': node['mesh_hash'] is not None,
+        'n_points': node['n_points'],
+        'n_faces': node['n_faces'],
+    }
+
+
+def build_scene_graph(database, store, obj_hash, ext='.obj'):
+    # Runs inside a worker process
+    return [describe_node(node) for node in SceneGraph(database, store).build(obj_hash, ext)]
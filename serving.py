@@ -0,0 +1,177 @@
+import argparse
+import importlib.util
+import logging
+import os
+import signal
+import threading
+import time
+
+from flask import jsonify
+from werkzeug.wsgi import ClosingIterator
+
+# Address and size of the production server: worker processes, and threads per process serving requests.
+# Each process has its own conversion pool, so more threads scale transfers better than more processes.
+SERVER_HOST = os.environ.get('SERVER_HOST', '0.0.0.0')
+SERVER_PORT = int(os.environ.get('SERVER_PORT', 8050))
+SERVER_WORKERS = int(os.environ.get('SERVER_WORKERS', 1))
+SERVER_THREADS = int(os.environ.get('SERVER_THREADS', 16))
+# gthread workers hand each request a thread; gevent, when installed, serves transfers on greenlets instead
+SERVER_WORKER_CLASS = os.environ.get('SERVER_WORKER_CLASS', 'gthread')
+# Uploads and downloads handled at once per server process; more wait up to TRANSFER_QUEUE_TIMEOUT seconds for
+# a slot and are then answered 503 with a Retry-After header
+MAX_CONCURRENT_TRANSFERS = int(os.environ.get('MAX_CONCURRENT_TRANSFERS', 8))
+TRANSFER_QUEUE_TIMEOUT = float(os.environ.get('TRANSFER_QUEUE_TIMEOUT', 2))
+RETRY_AFTER_SECONDS = 5
+# Seconds transfers in progress get to finish on shutdown, running conversions are always waited for
+SHUTDOWN_TIMEOUT = float(os.environ.get('SHUTDOWN_TIMEOUT', 30))
+
+
+def busy_response(message, retry_after=RETRY_AFTER_SECONDS):
+    response = jsonify({'error': message})
+    response.status_code = 503
+    response.headers['Retry-After'] = str(retry_after)
+    return response
+
+
+class TransferLimiter:
+    """Bounds the uploads and downloads one server process handles at once.
+
+    A request over the limit waits up to ``timeout`` seconds for a slot and
+    is turned away when none frees up, so clients back off instead of piling
+    up threads, open files and half-written staging files. A streamed
+    download keeps its slot until the last byte is sent. Once draining, no
+    new slots are handed out.
+    """
+
+    def __init__(self, limit=MAX_CONCURRENT_TRANSFERS, timeout=TRANSFER_QUEUE_TIMEOUT):
+        self.limit = limit
+        self.timeout = timeout
+        self.draining = False
+        self._slots = threading.BoundedSemaphore(limit)
+        self._active = 0
+        self._idle = threading.Condition()
+
+    def acquire(self):
+        if self.draining or not self._slots.acquire(timeout=self.timeout):
+            return False
+        if self.draining:
+            self._slots.release()
+            return False
+        with self._idle:
+            self._active += 1
+        return True
+
+    def release(self):
+        with self._idle:
+            self._active -= 1
+            self._idle.notify_all()
+        self._slots.release()
+
+    def release_on_close(self, response):
+        # The slot is given back once the server has sent the response and closed it
+        released = threading.Lock()
+
+        def release_once():
+            if released.acquire(blocking=False):
+                self.release()
+
+        if not response.direct_passthrough:
+            response.call_on_close(release_once)
+            return response
+        # send_file responses skip call_on_close; chaining the file's own close keeps the server's sendfile path
+        iterable = response.response
+        close = getattr(iterable, 'close', None)
+
+        def close_and_release():
+            try:
+                if close is not None:
+                    close()
+            finally:
+                release_once()
+
+        try:
+            iterable.close = close_and_release
+        except AttributeError:
+            response.response = ClosingIterator(iterable, close_and_release)
+        return response
+
+    def active(self):
+        with self._idle:
+            return self._active
+
+    def drain(self, timeout=SHUTDOWN_TIMEOUT):
+        # Returns whether every transfer finished within the timeout
+        self.draining = True
+        deadline = time.monotonic() + timeout
+        with self._idle:
+            while self._active and time.monotonic() < deadline:
+                self._idle.wait(deadline - time.monotonic())
+            return self._active == 0
+
+
+def serve_gunicorn(host, port, workers, threads, worker_class):
+    from gunicorn.app.base import BaseApplication
+
+    class Application(BaseApplication):
+        def load_config(self):
+            self.cfg.set('bind', f"{host}:{port}")
+            self.cfg.set('workers', workers)
+            self.cfg.set('threads', threads)
+            self.cfg.set('worker_class', worker_class)
+            # Workers finish the requests they have on SIGTERM, then shut down their conversion pools
+            self.cfg.set('graceful_timeout', SHUTDOWN_TIMEOUT)
+            self.cfg.set('worker_exit', lambda server, worker: shutdown_app())
+
+        def load(self):
+            import app
+
+            return app.create_app()
+
+    Application().run()
+
+
+def serve_threaded(host, port):
+    # Gunicorn does not run on Windows, Werkzeug's threaded server with the same limits does
+    from werkzeug.serving import make_server
+
+    import app
+
+    httpd = make_server(host, port, app.create_app(), threaded=True)
+
+    def stop(signum, frame):
+        logging.info(f"Received signal {signum}, shutting down")
+        threading.Thread(target=httpd.shutdown).start()
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+    logging.info(f"Serving on http://{host}:{port}/dash/")
+    httpd.serve_forever()
+    shutdown_app()
+
+
+def shutdown_app():
+    import app
+
+    app.shutdown()
+
+
+def serve(host=SERVER_HOST, port=SERVER_PORT, workers=SERVER_WORKERS, threads=SERVER_THREADS, worker_class=SERVER_WORKER_CLASS):
+    if importlib.util.find_spec('gunicorn') is None or os.name == 'nt':
+        serve_threaded(host, port)
+    else:
+        serve_gunicorn(host, port, workers, threads, worker_class)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Serve the app with gunicorn, or a threaded server where gunicorn is not available.')
+    parser.add_argument('--host', default=SERVER_HOST)
+    parser.add_argument('--port', type=int, default=SERVER_PORT)
+    parser.add_argument('--workers', type=int, default=SERVER_WORKERS, help='Server processes, each with its own conversion pool')
+    parser.add_argument('--threads', type=int, default=SERVER_THREADS, help='Request threads per gunicorn process')
+    parser.add_argument('--worker-class', default=SERVER_WORKER_CLASS, help='gunicorn worker class, gthread or gevent')
+    args = parser.parse_args(argv)
+    serve(args.host, args.port, args.workers, args.threads, args.worker_class)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,5 @@
 import unittest
+import hashlib
 import os
 import sqlite3
 import shutil
@@ -8,6 +9,8 @@ from io import BytesIO
 import impasse as assimp
 from app import server, init_db, get_db_connection, TEMP_UPLOAD_FOLDER, TEXTURE_UPLOAD_FOLDER, convert_to_obj
 import tempfile
+import uuid
+import zipfile
 
 
 class TestApp(unittest.TestCase):
@@ -52,7 +55,66 @@ class TestApp(unittest.TestCase):
             if os.path.exists(output_file_path):
                 os.remove(output_file_path)
 
-   
+    def test_chunked_upload(self):
+        # A new name each run, the test database is reused
+        filename = f"chunked_{uuid.uuid4().hex[:8]}.obj"
+        data = b'v 0 0 0\nv 1 0 0\nv 0 1 0\nf 1 2 3\n'
+        response = self.app.post('/uploads', json={'filename': filename, 'size': len(data)})
+        self.assertEqual(response.status_code, 201)
+        upload_id = response.get_json()['id']
+
+        response = self.app.put(f'/uploads/{upload_id}', data=data[:10], headers={'Content-Range': f'bytes 0-9/{len(data)}'})
+        self.assertEqual(response.get_json()['received'], 10)
+        # Resuming continues from the offset the server reports
+        offset = self.app.get(f'/uploads/{upload_id}').get_json()['received']
+        self.assertEqual(offset, 10)
+        response = self.app.put(f'/uploads/{upload_id}', data=data[:5], headers={'Content-Range': f'bytes 0-4/{len(data)}'})
+        self.assertEqual(response.status_code, 409)
+        response = self.app.put(f'/uploads/{upload_id}', data=data[offset:],
+                                headers={'Content-Range': f'bytes {offset}-{len(data) - 1}/{len(data)}'})
+        self.assertEqual(response.get_json()['received'], len(data))
+
+        response = self.app.post(f'/uploads/{upload_id}/complete')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.get_json()['hash'], hashlib.sha256(data).hexdigest())
+        self.assertEqual(self.app.get(f'/uploads/{upload_id}').status_code, 404)
+        response = self.app.post('/uploads', json={'filename': 'wood.png', 'kind': 'texture', 'obj_filename': filename})
+        self.assertEqual(response.status_code, 201)
+        self.app.delete(f"/uploads/{response.get_json()['id']}")
+
+    def test_chunked_upload_refuses_bad_requests(self):
+        response = self.app.post('/uploads', json={'filename': 'part.obj', 'size': 'large'})
+        self.assertEqual(response.status_code, 400)
+        response = self.app.post('/uploads', json={'filename': 'wood.png', 'kind': 'texture', 'obj_filename': 'missing.obj'})
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(self.app.put('/uploads/missing', data=b'v 0 0 0\n').status_code, 404)
+
+
+    def test_download_model_etag_and_range(self):
+        filename = f"download_{uuid.uuid4().hex[:8]}.obj"
+        data = b'v 0 0 0\nv 1 0 0\nv 0 1 0\nf 1 2 3\n'
+        upload_id = self.app.post('/uploads', json={'filename': filename}).get_json()['id']
+        self.app.put(f'/uploads/{upload_id}', data=data)
+        self.assertEqual(self.app.post(f'/uploads/{upload_id}/complete').status_code, 201)
+        url = f'/download-model/{filename}/none'
+
+        # The first download is built while it is streamed; responses are closed to give back their transfer slot
+        with self.app.get(url) as response:
+            self.assertEqual(response.status_code, 200)
+            archive = response.get_data()
+            etag = response.headers['ETag']
+        with zipfile.ZipFile(BytesIO(archive)) as zip_file:
+            self.assertEqual(zip_file.read(filename), data)
+
+        with self.app.get(url, headers={'If-None-Match': etag}) as response:
+            self.assertEqual(response.status_code, 304)
+        # Later ones come from the archive cache with the same bytes and support ranges
+        with self.app.get(url) as response:
+            self.assertEqual(response.headers['ETag'], etag)
+            self.assertEqual(response.get_data(), archive)
+        with self.app.get(url, headers={'Range': 'bytes=10-19'}) as response:
+            self.assertEqual(response.status_code, 206)
+            self.assertEqual(response.get_data(), archive[10:20])
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,65 @@
+import unittest
+import io
+import os
+import tempfile
+import zipfile
+from archives import ArchiveCache, archive_key
+
+
+class TestArchiveCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.cache = ArchiveCache(os.path.join(self.tmp_dir.name, 'downloads'), max_bytes=8 * 1024, chunk_size=1024)
+        self.entries = [('model.obj', self.write_file('model.obj', b'v 0 0 0\n' * 1000)),
+                        ('wood.png', self.write_file('wood.png', os.urandom(3000)))]
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def write_file(self, name, content):
+        path = os.path.join(self.tmp_dir.name, name)
+        with open(path, 'wb') as f:
+            f.write(content)
+        return path
+
+    def test_streamed_archive_is_cached(self):
+        chunks = list(self.cache.stream('key', self.entries))
+        self.assertGreater(len(chunks), 2)
+        data = b''.join(chunks)
+        with open(self.cache.get('key'), 'rb') as f:
+            self.assertEqual(f.read(), data)
+        with zipfile.ZipFile(io.BytesIO(data)) as zip_file:
+            self.assertEqual(zip_file.read('model.obj'), b'v 0 0 0\n' * 1000)
+            self.assertEqual(zip_file.getinfo('model.obj').compress_type, zipfile.ZIP_DEFLATED)
+            self.assertEqual(zip_file.getinfo('wood.png').compress_type, zipfile.ZIP_STORED)
+
+    def test_rebuilt_archive_has_same_bytes(self):
+        first = b''.join(self.cache.stream('key', self.entries))
+        os.remove(self.cache.path('key'))
+        self.assertEqual(b''.join(self.cache.stream('key', self.entries)), first)
+
+    def test_abandoned_stream_is_not_cached(self):
+        chunks = self.cache.stream('key', self.entries)
+        next(chunks)
+        chunks.close()
+        self.assertIsNone(self.cache.get('key'))
+        self.assertEqual(os.listdir(self.cache.directory), [])
+
+    def test_least_recently_used_archives_are_evicted(self):
+        for last_used, key in enumerate(('b', 'a')):
+            b''.join(self.cache.stream(key, self.entries))
+            os.utime(self.cache.path(key), (last_used, last_used))
+        b''.join(self.cache.stream('c', self.entries))
+        self.assertIsNotNone(self.cache.get('a'))
+        self.assertIsNone(self.cache.get('b'))
+        self.assertIsNotNone(self.cache.get('c'))
+
+    def test_key_depends_on_names_and_content(self):
+        self.assertEqual(archive_key([('a.obj', '1')]), archive_key([('a.obj', '1')]))
+        self.assertNotEqual(archive_key([('a.obj', '1')]), archive_key([('b.obj', '1')]))
+        self.assertNotEqual(archive_key([('a.obj', '1')]), archive_key([('a.obj', '2')]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+import unittest
+import os
+import subprocess
+import sys
+import tempfile
+from batch_convert import find_sources, find_texture_folder
+
+
+class TestBatchConvert(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.root = self.tmp_dir.name
+        for path in ('Table/source/obj3d/obj3d.obj', 'Table/source/notes.zip', 'Table/textures/wood.png',
+                     'Table/textures/readme.txt', 'Flower/flower.fbx', 'Flower/textures/petal.jpg', 'Loose/rock.stl'):
+            full_path = os.path.join(self.root, path)
+            os.makedirs(os.path.dirname(full_path), exist_ok=True)
+            with open(full_path, 'wb') as f:
+                f.write(path.encode())
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_sources_are_matched_with_nearest_textures(self):
+        sources = {os.path.relpath(path, self.root): [os.path.basename(texture) for texture in textures]
+                   for path, textures in find_sources(self.root)}
+        self.assertEqual(sources, {
+            os.path.join('Flower', 'flower.fbx'): ['petal.jpg'],
+            os.path.join('Loose', 'rock.stl'): [],
+            os.path.join('Table', 'source', 'obj3d', 'obj3d.obj'): ['wood.png'],
+        })
+
+    def test_texture_search_stays_inside_root(self):
+        os.makedirs(os.path.join(self.root, 'textures'))
+        loose_dir = os.path.join(self.root, 'Loose')
+        self.assertIsNone(find_texture_folder(loose_dir, loose_dir))
+        self.assertEqual(find_texture_folder(os.path.join(self.root, 'Loose'), self.root), os.path.join(self.root, 'textures'))
+
+    def convert(self, directory):
+        # The app module keeps its database and blob store in the working directory, so each run gets the temporary one
+        script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'batch_convert.py')
+        result = subprocess.run([sys.executable, script, directory], cwd=self.root, capture_output=True, text=True, timeout=120)
+        self.assertEqual(result.returncode, 0, result.stderr)
+        # Each file is printed as "<status>  <filename>  (<detail>)"
+        lines = [line.split() for line in result.stdout.splitlines()]
+        return {fields[1]: fields[0] for fields in lines if len(fields) > 1 and fields[1].endswith('.obj')}
+
+    def test_unchanged_sources_are_not_converted_again(self):
+        models = os.path.join(self.root, 'models')
+        os.makedirs(models)
+        for name in ('cube.obj', 'plane.obj'):
+            with open(os.path.join(models, name), 'w') as f:
+                f.write('v 0 0 0\nv 1 0 0\nv 0 1 0\nf 1 2 3\n')
+        self.assertEqual(self.convert(models), {'cube.obj': 'stored', 'plane.obj': 'stored'})
+        self.assertEqual(self.convert(models), {'cube.obj': 'unchanged', 'plane.obj': 'unchanged'})
+        with open(os.path.join(models, 'cube.obj'), 'a') as f:
+            f.write('v 0 0 1\nf 1 2 4\n')
+        self.assertEqual(self.convert(models), {'cube.obj': 'stored', 'plane.obj': 'unchanged'})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,34 @@
+import unittest
+import copy
+from benchmark import compare, run_benchmarks
+
+
+class TestBenchmark(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.results = run_benchmarks(triangles=(200,), texture_sizes=(64,), repeat=1, list_rows=(50,),
+                                     with_app=False, verbose=False)
+
+    def test_results_cover_each_path(self):
+        names = {result['name'] for result in self.results['results']}
+        names |= {skipped['name'] for skipped in self.results['skipped']}
+        for name in ('obj_parse_numpy', 'mesh_cache_warm', 'convert_to_obj', 'upload_decode', 'upload_store',
+                     'texture_levels', 'list_sources_query', 'list_sources_cached'):
+            self.assertIn(name, names)
+        parse = next(result for result in self.results['results'] if result['name'] == 'obj_parse_numpy')
+        self.assertEqual(parse['params'], {'triangles': 200})
+        self.assertEqual(len(parse['seconds']['runs']), 1)
+        self.assertGreater(parse['bytes'], 0)
+
+    def test_comparison_flags_slower_results(self):
+        slower = copy.deepcopy(self.results)
+        slower['results'][0]['seconds']['median'] *= 2
+        rows, regressions = compare(self.results, slower)
+        self.assertEqual(len(rows), len(self.results['results']))
+        self.assertEqual([row[0] for row in regressions], [slower['results'][0]['name']])
+        self.assertEqual(compare(self.results, self.results)[1], [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,44 @@
+import unittest
+import hashlib
+import io
+import os
+import tempfile
+from blob_store import BlobStore
+
+
+class TestBlobStore(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.store = BlobStore(self.tmp_dir.name, chunk_size=4)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_content_is_deduplicated(self):
+        digest = self.store.put_bytes(b'texture data')
+        stream_digest, size = self.store.put_stream(io.BytesIO(b'texture data'))
+        self.assertEqual(digest, hashlib.sha256(b'texture data').hexdigest())
+        self.assertEqual((stream_digest, size), (digest, 12))
+        self.assertEqual(len(os.listdir(os.path.join(self.tmp_dir.name, digest[:2]))), 1)
+
+    def test_streaming_reads(self):
+        digest = self.store.put_bytes(b'v 0 0 0\nv 1 0 0\n')
+        self.assertEqual(b''.join(self.store.iter_chunks(digest)), b'v 0 0 0\nv 1 0 0\n')
+        mapped = self.store.mmap(digest)
+        self.assertEqual(mapped[:7], b'v 0 0 0')
+        mapped.close()
+
+    def test_path_with_extension_aliases_blob(self):
+        digest = self.store.put_bytes(b'v 0 0 0\n')
+        obj_path = self.store.path(digest, '.OBJ')
+        self.assertTrue(obj_path.endswith('.obj'))
+        with open(obj_path, 'rb') as f:
+            self.assertEqual(f.read(), b'v 0 0 0\n')
+        self.store.delete(digest)
+        self.assertFalse(self.store.exists(digest))
+        self.assertFalse(os.path.exists(obj_path))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+import unittest
+import os
+import sqlite3
+import tempfile
+from conversion_cache import ConversionCache, cache_key, init_cache_table
+from blob_store import BlobStore
+from database import close_pool
+from textures import init_texture_asset_tables, init_texture_variants_table
+
+
+class TestConversionCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmp_dir.name, 'files.db')
+        with sqlite3.connect(self.db_path) as conn:
+            conn.execute('CREATE TABLE files (id INTEGER PRIMARY KEY, filename TEXT UNIQUE, original_hash TEXT, obj_hash TEXT, obj_cache_key TEXT)')
+            init_texture_asset_tables(conn)
+            init_texture_variants_table(conn)
+            init_cache_table(conn)
+        self.store = BlobStore(os.path.join(self.tmp_dir.name, 'blobs'))
+        self.cache = ConversionCache(self.db_path, self.store, max_bytes=25)
+
+    def tearDown(self):
+        close_pool(self.db_path)
+        self.tmp_dir.cleanup()
+
+    def write_output(self, content):
+        path = os.path.join(self.tmp_dir.name, 'out.obj')
+        with open(path, 'wb') as f:
+            f.write(content)
+        return path
+
+    def test_key_depends_on_format_and_flags(self):
+        self.assertEqual(cache_key('data', 'obj'), cache_key('data', 'obj'))
+        self.assertNotEqual(cache_key('data', 'obj'), cache_key('data', 'glb'))
+        self.assertNotEqual(cache_key('data', 'obj'), cache_key('data', 'obj', ('triangulate',)))
+
+    def test_hit_and_miss_counters(self):
+        key = cache_key('source')
+        self.assertIsNone(self.cache.get(key))
+        self.cache.put(key, self.write_output(b'v 0 0 0\n'), conversion_seconds=2.0)
+        self.assertIsNotNone(self.cache.get(key))
+        self.assertEqual(self.store.read(self.cache.get(key, count=False)), b'v 0 0 0\n')
+        stats = self.cache.stats()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+        self.assertEqual(stats['conversion_seconds_saved'], 2.0)
+
+    def test_lru_eviction_keeps_referenced_blobs(self):
+        first, second, third = cache_key('1'), cache_key('2'), cache_key('3')
+        first_hash = self.cache.put(first, self.write_output(b'x' * 10))
+        with sqlite3.connect(self.db_path) as conn:
+            conn.execute("INSERT INTO files (filename, obj_hash, obj_cache_key) VALUES ('a.fbx', ?, ?)", (first_hash, first))
+        second_hash = self.cache.put(second, self.write_output(b'y' * 10))
+        self.assertIsNotNone(self.cache.get(second))
+        self.cache.put(third, self.write_output(b'z' * 10))
+        self.assertIsNone(self.cache.get(first))
+        self.assertTrue(self.store.exists(first_hash))
+        self.assertIsNotNone(self.cache.get(second))
+        self.assertIsNotNone(self.cache.get(third))
+        self.assertTrue(self.store.exists(second_hash))
+
+
+if __name__ == '__main__':
+    unittest.main()
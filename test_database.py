@@ -0,0 +1,88 @@
+import unittest
+import os
+import sqlite3
+import tempfile
+import threading
+from database import QueryCache, close_pool, connect
+
+
+class TestDatabase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmp_dir.name, 'files.db')
+        with connect(self.db_path) as conn:
+            conn.execute('CREATE TABLE files (id INTEGER PRIMARY KEY, filename TEXT UNIQUE)')
+
+    def tearDown(self):
+        close_pool(self.db_path)
+        self.tmp_dir.cleanup()
+
+    def test_connections_use_wal_and_are_reused(self):
+        with connect(self.db_path) as conn:
+            self.assertEqual(conn.execute('PRAGMA journal_mode').fetchone()[0], 'wal')
+            first = conn
+        with connect(self.db_path) as conn:
+            self.assertIs(conn, first)
+
+    def test_closed_connection_returns_to_pool(self):
+        conn = connect(self.db_path)
+        self.assertIsInstance(conn, sqlite3.Connection)
+        conn.execute("INSERT INTO files (filename) VALUES ('a.obj')")
+        conn.close()
+        # Uncommitted work is rolled back before the connection is reused
+        with connect(self.db_path) as reused:
+            self.assertIs(reused, conn)
+            self.assertEqual(reused.execute('SELECT COUNT(*) FROM files').fetchone()[0], 0)
+
+    def test_failed_block_rolls_back(self):
+        with self.assertRaises(sqlite3.IntegrityError):
+            with connect(self.db_path) as conn:
+                conn.execute("INSERT INTO files (filename) VALUES ('a.obj')")
+                conn.execute("INSERT INTO files (filename) VALUES ('a.obj')")
+        with connect(self.db_path) as conn:
+            self.assertEqual(conn.execute('SELECT COUNT(*) FROM files').fetchone()[0], 0)
+
+    def test_concurrent_writers(self):
+        def insert(n):
+            for i in range(20):
+                with connect(self.db_path) as conn:
+                    conn.execute('INSERT INTO files (filename) VALUES (?)', (f"{n}-{i}.obj",))
+        threads = [threading.Thread(target=insert, args=(n,)) for n in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        with connect(self.db_path) as conn:
+            self.assertEqual(conn.execute('SELECT COUNT(*) FROM files').fetchone()[0], 160)
+
+    def test_query_cache_is_cleared_by_writes(self):
+        cache = QueryCache(self.db_path)
+        self.assertEqual(cache.fetchall('SELECT filename FROM files'), [])
+        with connect(self.db_path) as conn:
+            conn.execute("INSERT INTO files (filename) VALUES ('a.obj')")
+        self.assertEqual([row['filename'] for row in cache.fetchall('SELECT filename FROM files')], ['a.obj'])
+        # Writes from a connection outside the pool are seen too
+        with sqlite3.connect(self.db_path) as conn:
+            conn.execute("INSERT INTO files (filename) VALUES ('b.obj')")
+        self.assertEqual(len(cache.fetchall('SELECT filename FROM files')), 2)
+
+    def test_query_cache_serves_repeated_reads_from_memory(self):
+        cache = QueryCache(self.db_path)
+        first = cache.fetchall('SELECT filename FROM files WHERE filename = ?', ('a.obj',))
+        self.assertIs(cache.fetchall('SELECT filename FROM files WHERE filename = ?', ('a.obj',)), first)
+
+
+    def test_query_cache_keeps_the_most_recently_used_results(self):
+        cache = QueryCache(self.db_path, max_entries=2)
+        query = 'SELECT filename FROM files WHERE filename = ?'
+        first = cache.fetchall(query, ('a.obj',))
+        cache.fetchall(query, ('b.obj',))
+        self.assertIs(cache.fetchall(query, ('a.obj',)), first)
+        cache.fetchall(query, ('c.obj',))
+        self.assertEqual(len(cache._results), 2)
+        self.assertIs(cache.fetchall(query, ('a.obj',)), first)
+        self.assertNotIn((query, ('b.obj',)), cache._results)
+
+if __name__ == '__main__':
+    unittest.main()
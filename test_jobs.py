@@ -0,0 +1,178 @@
+import unittest
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from jobs import ConversionJobQueue, ConversionQueueFull, init_jobs_table, describe_job, fail_interrupted_jobs, process_owner, JOB_DONE, JOB_FAILED, JOB_RUNNING
+from blob_store import BlobStore
+from conversion_cache import init_cache_table
+from database import close_pool
+from textures import init_texture_asset_tables, init_texture_variants_table
+from workspaces import WorkspaceManager
+
+
+def fake_convert(input_path, output_path):
+    with open(input_path, 'rb') as src, open(output_path, 'wb') as dst:
+        dst.write(b'# converted\n' + src.read())
+
+
+def slow_convert(input_path, output_path):
+    time.sleep(1)
+    fake_convert(input_path, output_path)
+
+
+def touch(path):
+    open(path, 'w').close()
+
+
+def failing_convert(input_path, output_path):
+    raise ValueError("Loaded scene contains no meshes.")
+
+
+class FullBlobStore(BlobStore):
+    def put_file(self, path):
+        raise OSError(28, 'No space left on device')
+
+
+class TestConversionJobQueue(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmp_dir.name, 'files.db')
+        with sqlite3.connect(self.db_path) as conn:
+            conn.execute('CREATE TABLE files (id INTEGER PRIMARY KEY, filename TEXT UNIQUE, original_format TEXT, original_hash TEXT, obj_hash TEXT, obj_cache_key TEXT, model_format TEXT)')
+            init_jobs_table(conn)
+            init_cache_table(conn)
+            init_texture_variants_table(conn)
+            init_texture_asset_tables(conn)
+        self.input_path = os.path.join(self.tmp_dir.name, 'model.fbx')
+        self.output_path = os.path.join(self.tmp_dir.name, 'model.obj')
+        with open(self.input_path, 'wb') as f:
+            f.write(b'v 0 0 0\n')
+        self.store = BlobStore(os.path.join(self.tmp_dir.name, 'blobs'))
+        self.original_hash = self.store.put_file(self.input_path)
+        with sqlite3.connect(self.db_path) as conn:
+            conn.execute("INSERT INTO files (filename, original_format, original_hash) VALUES ('model.fbx', '.fbx', ?)", (self.original_hash,))
+
+    def tearDown(self):
+        close_pool(self.db_path)
+        self.tmp_dir.cleanup()
+
+    def wait_for(self, queue, job_id):
+        for _ in range(100):
+            job = queue.get_job(job_id)
+            if job['status'] in (JOB_DONE, JOB_FAILED):
+                return job
+            time.sleep(0.1)
+        self.fail(f"Job {job_id} did not finish")
+
+    def test_job_fills_in_files_row(self):
+        queue = ConversionJobQueue(self.db_path, fake_convert, self.store, max_workers=1)
+        try:
+            job = self.wait_for(queue, queue.submit('model.fbx', self.input_path, self.output_path))
+        finally:
+            queue.shutdown()
+        self.assertEqual(job['status'], JOB_DONE)
+        self.assertIsNotNone(job['started_at'])
+        self.assertIn('ran', describe_job(job))
+        with sqlite3.connect(self.db_path) as conn:
+            obj_hash, model_format = conn.execute("SELECT obj_hash, model_format FROM files WHERE filename = 'model.fbx'").fetchone()
+        self.assertEqual(self.store.read(obj_hash), b'# converted\nv 0 0 0\n')
+        self.assertEqual(model_format, '.obj')
+        self.assertFalse(os.path.exists(self.output_path))
+
+    def test_failed_job_removes_files_row(self):
+        queue = ConversionJobQueue(self.db_path, failing_convert, self.store, max_workers=1)
+        try:
+            job = self.wait_for(queue, queue.submit('model.fbx', self.input_path, self.output_path))
+        finally:
+            queue.shutdown()
+        self.assertEqual(job['status'], JOB_FAILED)
+        self.assertIn('no meshes', job['error'])
+        with sqlite3.connect(self.db_path) as conn:
+            self.assertIsNone(conn.execute("SELECT 1 FROM files WHERE filename = 'model.fbx'").fetchone())
+        self.assertFalse(self.store.exists(self.original_hash))
+
+    def test_failure_to_store_output_fails_job(self):
+        store = FullBlobStore(os.path.join(self.tmp_dir.name, 'blobs'))
+        workspaces = WorkspaceManager(os.path.join(self.tmp_dir.name, 'temp_uploads'))
+        workspace = workspaces.create()
+        queue = ConversionJobQueue(self.db_path, fake_convert, store, max_workers=1)
+        try:
+            job = self.wait_for(queue, queue.submit('model.fbx', self.input_path, workspace.file('model.obj'), workspace=workspace))
+        finally:
+            queue.shutdown()
+        self.assertEqual(job['status'], JOB_FAILED)
+        self.assertIn('No space left', job['error'])
+        self.assertFalse(workspace.in_use)
+        self.assertTrue(os.path.exists(workspace.file('model.obj')))
+        with sqlite3.connect(self.db_path) as conn:
+            self.assertIsNone(conn.execute("SELECT 1 FROM files WHERE filename = 'model.fbx'").fetchone())
+
+    def test_shutdown_waits_for_running_job_and_its_follow_up_work(self):
+        marker = os.path.join(self.tmp_dir.name, 'indexed')
+        follow_up = []
+        queue = ConversionJobQueue(self.db_path, slow_convert, self.store, max_workers=1,
+                                   on_converted=lambda filename, obj_hash, ext: follow_up.append(queue.run_in_pool(touch, marker)))
+        job_id = queue.submit('model.fbx', self.input_path, self.output_path)
+        for _ in range(100):
+            if queue.get_job(job_id)['status'] == JOB_RUNNING:
+                break
+            time.sleep(0.05)
+        stopping = threading.Thread(target=queue.shutdown, daemon=True)
+        stopping.start()
+        stopping.join(30)
+        self.assertFalse(stopping.is_alive(), "shutdown did not return")
+        self.assertEqual(queue.get_job(job_id)['status'], JOB_DONE)
+        self.assertIsNone(follow_up[0].exception())
+        self.assertTrue(os.path.exists(marker))
+
+    def test_join_waits_for_follow_up_work(self):
+        marker = os.path.join(self.tmp_dir.name, 'indexed')
+        queue = ConversionJobQueue(self.db_path, fake_convert, self.store, max_workers=1,
+                                   on_converted=lambda filename, obj_hash, ext: queue.run_in_pool(touch, marker))
+        try:
+            job_id = queue.submit('model.fbx', self.input_path, self.output_path)
+            self.assertTrue(queue.join(30))
+            self.assertEqual(queue.get_job(job_id)['status'], JOB_DONE)
+            self.assertTrue(os.path.exists(marker))
+        finally:
+            queue.shutdown()
+
+    def test_restart_only_fails_jobs_of_exited_processes(self):
+        exited = subprocess.Popen([sys.executable, '-c', 'pass'])
+        exited.wait()
+        owners = {'gone.fbx': f"{exited.pid}:0", 'legacy.fbx': None, 'mine.fbx': process_owner(),
+                  'sibling.fbx': f"{os.getppid()}:0"}
+        with sqlite3.connect(self.db_path) as conn:
+            conn.executemany("INSERT INTO conversion_jobs (filename, status, owner) VALUES (?, 'running', ?)", owners.items())
+            self.assertEqual(fail_interrupted_jobs(conn, self.store), 2)
+            statuses = dict(conn.execute('SELECT filename, status FROM conversion_jobs'))
+        self.assertEqual(statuses, {'gone.fbx': JOB_FAILED, 'legacy.fbx': JOB_FAILED, 'mine.fbx': JOB_RUNNING, 'sibling.fbx': JOB_RUNNING})
+
+    def test_interrupted_job_removes_files_row(self):
+        exited = subprocess.Popen([sys.executable, '-c', 'pass'])
+        exited.wait()
+        with sqlite3.connect(self.db_path) as conn:
+            conn.execute("INSERT INTO conversion_jobs (filename, status, owner) VALUES ('model.fbx', 'queued', ?)", (f"{exited.pid}:0",))
+            fail_interrupted_jobs(conn, self.store)
+            self.assertIsNone(conn.execute("SELECT 1 FROM files WHERE filename = 'model.fbx'").fetchone())
+            # The name can be uploaded again
+            conn.execute("INSERT INTO files (filename, original_format) VALUES ('model.fbx', '.fbx')")
+        self.assertFalse(self.store.exists(self.original_hash))
+
+    def test_full_queue_refuses_new_conversions(self):
+        queue = ConversionJobQueue(self.db_path, fake_convert, self.store, max_workers=1, max_pending=1)
+        queue.check_capacity()
+        with sqlite3.connect(self.db_path) as conn:
+            conn.execute("INSERT INTO conversion_jobs (filename, status) VALUES ('other.fbx', 'queued')")
+        self.assertEqual(queue.pending(), 1)
+        with self.assertRaises(ConversionQueueFull):
+            queue.check_capacity()
+
+
+if __name__ == '__main__':
+    unittest.main()
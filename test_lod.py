@@ -0,0 +1,50 @@
+import unittest
+import os
+import sqlite3
+import tempfile
+import pyvista as pv
+from blob_store import BlobStore
+from mesh_payload import MeshPayloadCache, init_payload_table, prepare_mesh, write_obj
+from lod import build_lod_pyramid, decimate_levels
+from database import close_pool
+
+
+class TestLevelsOfDetail(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmp_dir.name, 'files.db')
+        with sqlite3.connect(self.db_path) as conn:
+            init_payload_table(conn)
+        self.store = BlobStore(os.path.join(self.tmp_dir.name, 'blobs'))
+        self.sphere = pv.Sphere(theta_resolution=100, phi_resolution=100)
+
+    def tearDown(self):
+        close_pool(self.db_path)
+        self.tmp_dir.cleanup()
+
+    def test_levels_get_coarser(self):
+        faces = [mesh.n_cells for _, mesh in decimate_levels(self.sphere)]
+        self.assertEqual(len(faces), 3)
+        self.assertTrue(self.sphere.n_cells > faces[0] > faces[1] > faces[2])
+        self.assertLess(faces[2], self.sphere.n_cells * 0.05)
+
+    def test_small_meshes_have_no_levels(self):
+        self.assertEqual(list(decimate_levels(pv.Cube())), [])
+
+    def test_pyramid_is_stored_next_to_the_model(self):
+        obj_path = os.path.join(self.tmp_dir.name, 'sphere.obj')
+        with open(obj_path, 'wb') as f:
+            write_obj(prepare_mesh(self.sphere), f)
+        obj_hash = self.store.put_file(obj_path)
+        self.assertEqual(build_lod_pyramid(self.db_path, self.store, obj_hash), 4)
+        payloads = MeshPayloadCache(self.db_path, self.store)
+        levels = payloads.levels(obj_hash)
+        self.assertEqual([payload['level'] for payload in levels], [0, 1, 2, 3])
+        self.assertIsNone(levels[0]['lod_obj_hash'])
+        self.assertEqual(pv.read(self.store.path(levels[3]['lod_obj_hash'], '.obj')).n_cells, levels[3]['n_faces'])
+        self.assertEqual(payloads.get(obj_hash, level=9)['level'], 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
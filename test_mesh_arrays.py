@@ -0,0 +1,73 @@
+import unittest
+import os
+import tempfile
+import numpy as np
+import pyvista as pv
+from blob_store import BlobStore
+from mesh_arrays import MeshArrayCache, load_mesh, read_obj
+from mesh_payload import prepare_mesh, write_obj
+
+
+class TestMeshArrays(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.store = BlobStore(os.path.join(self.tmp_dir.name, 'blobs'))
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def write_file(self, name, content):
+        path = os.path.join(self.tmp_dir.name, name)
+        with open(path, 'wb') as f:
+            f.write(content)
+        return path
+
+    def test_reader_matches_vtk(self):
+        path = os.path.join(self.tmp_dir.name, 'plane.obj')
+        with open(path, 'wb') as f:
+            write_obj(prepare_mesh(pv.Plane(i_resolution=20, j_resolution=10)), f)
+        arrays = read_obj(path)
+        mesh = pv.read(path)
+        np.testing.assert_allclose(arrays['points'], mesh.points)
+        np.testing.assert_array_equal(arrays['faces'], mesh.faces.reshape(-1, 4)[:, 1:])
+        np.testing.assert_allclose(arrays['tcoords'], mesh.active_texture_coordinates)
+        self.assertEqual(arrays['normals'].shape, (231, 3))
+
+    def test_polygons_and_separate_indices(self):
+        path = self.write_file('quad.obj', b'# quad\nmtllib a.mtl\nv 0 0 0\nv 1 0 0\nv 1 1 0\r\nv 0 1 0\n'
+                                           b'vt 0 0\nvt 1 0\nvt 1 1\nvt 0 1\nvt 0.5 0.5\n'
+                                           b'g quad\nusemtl red\nf 1/1 2/2 3/3 4/4\nf 1/5 3/3 4/4\n')
+        arrays = read_obj(path)
+        # The first corner has two texture coordinates, so its position is used twice
+        self.assertEqual(len(arrays['points']), 5)
+        self.assertEqual(len(arrays['faces']), 3)
+        corners = arrays['tcoords'][arrays['faces']]
+        np.testing.assert_allclose(corners[2], [[0.5, 0.5], [1, 1], [0, 1]])
+        np.testing.assert_allclose(arrays['points'][arrays['faces'][0]], [[0, 0, 0], [1, 0, 0], [1, 1, 0]])
+        self.assertIsNone(arrays['normals'])
+
+    def test_unsupported_files_are_rejected(self):
+        with self.assertRaises(ValueError):
+            read_obj(self.write_file('relative.obj', b'v 0 0 0\nv 1 0 0\nv 1 1 0\nf -3 -2 -1\n'))
+
+    def test_parsed_mesh_is_mapped_from_the_cache(self):
+        path = os.path.join(self.tmp_dir.name, 'sphere.obj')
+        with open(path, 'wb') as f:
+            write_obj(prepare_mesh(pv.Sphere()), f)
+        obj_hash = self.store.put_file(path)
+        cache = MeshArrayCache(self.store)
+        self.assertIsNone(cache.get(obj_hash))
+        first = cache.load(obj_hash)
+        self.assertIsInstance(first['points'], np.memmap)
+        self.assertIsNone(first['tcoords'])
+        # Loads no longer read the model once its arrays are cached
+        os.remove(self.store.path(obj_hash, '.obj'))
+        os.remove(self.store.path(obj_hash))
+        mesh = load_mesh(self.store, obj_hash)
+        self.assertEqual(mesh.n_cells, len(first['faces']))
+        self.assertIn('Normals', mesh.point_data)
+
+
+if __name__ == '__main__':
+    unittest.main()
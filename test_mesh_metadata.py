@@ -0,0 +1,71 @@
+import unittest
+import json
+import os
+import sqlite3
+import tempfile
+import pyvista as pv
+from blob_store import BlobStore
+from mesh_payload import prepare_mesh, write_obj
+from mesh_metadata import MeshMetadata, describe_source, init_metadata_table, like_pattern, obj_material_names, source_list_query
+from database import close_pool, connect
+
+
+class TestMeshMetadata(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmp_dir.name, 'files.db')
+        with sqlite3.connect(self.db_path) as conn:
+            conn.execute('CREATE TABLE files (id INTEGER PRIMARY KEY, filename TEXT UNIQUE, obj_hash TEXT)')
+            init_metadata_table(conn)
+        self.store = BlobStore(os.path.join(self.tmp_dir.name, 'blobs'))
+        self.metadata = MeshMetadata(self.db_path, self.store)
+
+    def tearDown(self):
+        close_pool(self.db_path)
+        self.tmp_dir.cleanup()
+
+    def store_obj(self, mesh, material=None):
+        obj_path = os.path.join(self.tmp_dir.name, 'model.obj')
+        with open(obj_path, 'wb') as f:
+            if material:
+                f.write(f"mtllib model.mtl\nusemtl {material}\n".encode())
+            write_obj(prepare_mesh(mesh), f)
+        return self.store.put_file(obj_path)
+
+    def test_record_describes_the_model(self):
+        obj_hash = self.store_obj(pv.Plane(i_resolution=4, j_resolution=4), material='wood')
+        record = self.metadata.build(obj_hash)
+        self.assertEqual(record['n_points'], 25)
+        self.assertEqual(record['n_faces'], 32)
+        self.assertAlmostEqual(record['surface_area'], 1.0, places=5)
+        self.assertEqual(json.loads(record['bounds'])[:2], [-0.5, 0.5])
+        self.assertEqual(json.loads(record['materials']), ['wood'])
+        self.assertTrue(record['has_uvs'])
+        # Building again returns the stored record
+        self.assertEqual(self.metadata.build(obj_hash)['compute_seconds'], record['compute_seconds'])
+
+    def test_material_names_are_listed_once(self):
+        data = b'usemtl red\nf 1 2 3\nusemtl blue\r\nf 1 2 3\nusemtl red\n'
+        self.assertEqual(obj_material_names(data), ['red', 'blue'])
+
+    def test_source_list_filters_and_sorts_without_meshes(self):
+        small = self.store_obj(pv.Plane(i_resolution=2, j_resolution=2), material='stone')
+        large = self.store_obj(pv.Sphere())
+        self.metadata.build(small)
+        self.metadata.build(large)
+        with connect(self.db_path) as conn:
+            conn.executemany('INSERT INTO files (filename, obj_hash) VALUES (?, ?)',
+                             [('a_small.obj', small), ('b_large.obj', large), ('c_pending.fbx', None)])
+            rows = conn.execute(source_list_query('faces'), (like_pattern(''),) * 2).fetchall()
+            self.assertEqual([row['filename'] for row in rows], ['b_large.obj', 'a_small.obj', 'c_pending.fbx'])
+            rows = conn.execute(source_list_query('name'), (like_pattern('stone'),) * 2).fetchall()
+            self.assertEqual([row['filename'] for row in rows], ['a_small.obj'])
+            rows = conn.execute(source_list_query('name', with_uvs=True), (like_pattern(''),) * 2).fetchall()
+            self.assertEqual([row['filename'] for row in rows], ['a_small.obj'])
+            self.assertEqual(like_pattern('50%_off'), '%50\\%\\_off%')
+        self.assertEqual(describe_source(rows[0]), 'a_small.obj (8 faces, 9 points, 1 material, UVs)')
+
+
+if __name__ == '__main__':
+    unittest.main()
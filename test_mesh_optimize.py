@@ -0,0 +1,81 @@
+import unittest
+import os
+import tempfile
+import numpy as np
+import pyvista as pv
+from blob_store import BlobStore
+from mesh_arrays import MeshArrayCache
+from mesh_optimize import optimize_arrays
+from mesh_payload import prepare_mesh, write_obj
+
+
+def triangle_soup(mesh):
+    # Every triangle gets vertices of its own, as STL files and unwelded exports have
+    faces = mesh.triangulate().faces.reshape(-1, 4)[:, 1:]
+    return {'points': np.asarray(mesh.points[faces.reshape(-1)], dtype=np.float32),
+            'faces': np.arange(faces.size, dtype=np.int32).reshape(-1, 3), 'tcoords': None, 'normals': None}
+
+
+def corner_positions(arrays):
+    corners = np.asarray(arrays['points'], dtype=np.float64)[arrays['faces']]
+    return sorted(map(tuple, np.round(corners.reshape(len(corners), -1), 5)))
+
+
+class TestMeshOptimize(unittest.TestCase):
+
+    def test_duplicate_vertices_are_welded(self):
+        soup = triangle_soup(pv.Sphere())
+        optimized, quantization, report = optimize_arrays(soup)
+        self.assertIsNone(quantization)
+        self.assertEqual(report['vertices_after'], pv.Sphere().n_points)
+        self.assertLess(report['bytes_after'], report['bytes_before'])
+        self.assertEqual(corner_positions(optimized), corner_positions(soup))
+
+    def test_seams_with_different_uvs_are_kept(self):
+        arrays = {'points': np.array([[0, 0, 0], [1, 0, 0], [0, 1, 0], [0, 0, 0]], dtype=np.float32),
+                  'faces': np.array([[0, 1, 2], [3, 2, 1]], dtype=np.int32),
+                  'tcoords': np.array([[0, 0], [1, 0], [0, 1], [1, 1]], dtype=np.float32), 'normals': None}
+        _, _, report = optimize_arrays(arrays)
+        self.assertEqual(report['vertices_after'], 4)
+
+    def test_degenerate_faces_and_unused_vertices_are_dropped(self):
+        arrays = {'points': np.array([[0, 0, 0], [1, 0, 0], [0, 1, 0], [2, 0, 0], [5, 5, 5]], dtype=np.float32),
+                  'faces': np.array([[0, 1, 2], [0, 0, 1], [0, 1, 3]], dtype=np.int32), 'tcoords': None, 'normals': None}
+        optimized, _, report = optimize_arrays(arrays)
+        self.assertEqual(report['degenerate_faces'], 2)
+        self.assertEqual(len(optimized['faces']), 1)
+        self.assertEqual(len(optimized['points']), 3)
+        # Vertices are numbered in the order the triangles use them
+        np.testing.assert_array_equal(optimized['faces'], [[0, 1, 2]])
+
+    def test_quantization_error_is_reported(self):
+        mesh = pv.Sphere(radius=10)
+        arrays = {'points': np.asarray(mesh.points, dtype=np.float32), 'faces': mesh.faces.reshape(-1, 4)[:, 1:].astype(np.int32),
+                  'tcoords': None, 'normals': np.asarray(mesh.point_normals, dtype=np.float32)}
+        optimized, quantization, report = optimize_arrays(arrays, quantize_bits=16)
+        self.assertEqual(optimized['points'].dtype, np.uint16)
+        self.assertEqual(optimized['normals'].dtype, np.int16)
+        # Half a step of the 20 unit wide grid
+        self.assertLessEqual(report['max_quantization_error']['points'], 20 / 65535 / 2 + 1e-9)
+        self.assertLess(report['max_position_error'], 1e-3)
+        self.assertEqual(quantization['bits'], 16)
+
+    def test_cache_stores_quantized_arrays(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            store = BlobStore(os.path.join(tmp_dir, 'blobs'))
+            path = os.path.join(tmp_dir, 'plane.obj')
+            with open(path, 'wb') as f:
+                write_obj(prepare_mesh(pv.Plane(i_resolution=8, j_resolution=8)), f)
+            obj_hash = store.put_file(path)
+            cache = MeshArrayCache(store, quantize=True)
+            arrays = cache.load(obj_hash)
+            self.assertEqual(arrays['points'].dtype, np.float32)
+            self.assertEqual(arrays['tcoords'].shape, (81, 2))
+            report = cache.report(obj_hash)
+            self.assertTrue(report['quantized'])
+            self.assertEqual(report['faces_after'], 128)
+            self.assertIsNone(MeshArrayCache(store, optimize=False).report('0' * 64))
+
+
+if __name__ == '__main__':
+    unittest.main()
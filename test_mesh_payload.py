@@ -0,0 +1,63 @@
+import unittest
+import os
+import sqlite3
+import tempfile
+import pyvista as pv
+from blob_store import BlobStore
+from mesh_payload import MeshPayloadCache, as_polydata, init_payload_table, prepare_mesh, write_ply
+from database import close_pool
+
+QUAD_OBJ = b'v 0 0 0\nv 1 0 0\nv 1 1 0\nv 0 1 0\nvt 0 0\nvt 1 0\nvt 1 1\nvt 0 1\nf 1/1 2/2 3/3 4/4\n'
+
+
+class TestMeshPayload(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmp_dir.name, 'files.db')
+        with sqlite3.connect(self.db_path) as conn:
+            init_payload_table(conn)
+        self.store = BlobStore(os.path.join(self.tmp_dir.name, 'blobs'))
+
+    def tearDown(self):
+        close_pool(self.db_path)
+        self.tmp_dir.cleanup()
+
+    def test_prepare_mesh_triangulates_and_adds_normals(self):
+        arrays = prepare_mesh(pv.read(self.store.path(self.store.put_bytes(QUAD_OBJ), '.obj')))
+        self.assertEqual(arrays['positions'].shape, (4, 3))
+        self.assertEqual(arrays['indices'].shape, (2, 3))
+        self.assertEqual(arrays['uvs'].shape, (4, 2))
+        self.assertAlmostEqual(abs(float(arrays['normals'][0][2])), 1.0)
+
+    def test_gltf_blocks_are_combined_with_uvs(self):
+        quad = pv.Plane(i_resolution=1, j_resolution=1)
+        quad.point_data['TEXCOORD_0'] = quad.active_texture_coordinates.copy()
+        quad.point_data.remove('TextureCoordinates')
+        blocks = pv.MultiBlock([quad, pv.Sphere()])
+        mesh = as_polydata(blocks)
+        self.assertIsInstance(mesh, pv.PolyData)
+        self.assertEqual(mesh.n_points, quad.n_points + pv.Sphere().n_points)
+        self.assertIsNotNone(as_polydata(quad).active_texture_coordinates)
+
+    def test_ply_payload_round_trips(self):
+        arrays = prepare_mesh(pv.Sphere())
+        ply_path = os.path.join(self.tmp_dir.name, 'sphere.ply')
+        with open(ply_path, 'wb') as f:
+            write_ply(arrays, f)
+        mesh = pv.read(ply_path)
+        self.assertEqual(mesh.n_points, len(arrays['positions']))
+        self.assertEqual(mesh.n_cells, len(arrays['indices']))
+
+    def test_payload_is_prepared_once(self):
+        payloads = MeshPayloadCache(self.db_path, self.store)
+        obj_hash = self.store.put_bytes(QUAD_OBJ)
+        first = payloads.get(obj_hash)
+        second = payloads.get(obj_hash)
+        self.assertEqual(first['payload_hash'], second['payload_hash'])
+        self.assertEqual(first['prepare_seconds'], second['prepare_seconds'])
+        self.assertEqual((second['n_points'], second['n_faces']), (4, 2))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+import unittest
+import logging
+import os
+import tempfile
+from database import DB_QUERY_SECONDS, close_pool, connect
+from metrics import MetricsRegistry, SamplingFilter
+
+
+class TestMetrics(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = MetricsRegistry()
+
+    def test_counter_renders_per_label(self):
+        hits = self.registry.counter('cache_lookups_total', 'Cache lookups', ['result'])
+        hits.inc(result='hit')
+        hits.inc(2, result='hit')
+        hits.inc(result='miss')
+        text = self.registry.render()
+        self.assertIn('# TYPE cache_lookups_total counter', text)
+        self.assertIn('cache_lookups_total{result="hit"} 3', text)
+        self.assertIn('cache_lookups_total{result="miss"} 1', text)
+
+    def test_gauge_keeps_last_value(self):
+        usage = self.registry.gauge('disk_usage_bytes', 'Bytes on disk', ['directory'])
+        usage.set(100, directory='downloads')
+        usage.set(40, directory='downloads')
+        text = self.registry.render()
+        self.assertIn('# TYPE disk_usage_bytes gauge', text)
+        self.assertIn('disk_usage_bytes{directory="downloads"} 40', text)
+
+    def test_histogram_buckets_are_cumulative(self):
+        latency = self.registry.histogram('load_seconds', 'Load time', buckets=(0.1, 1))
+        for value in (0.05, 0.5, 5):
+            latency.observe(value)
+        text = self.registry.render()
+        self.assertIn('load_seconds_bucket{le="0.1"} 1', text)
+        self.assertIn('load_seconds_bucket{le="1.0"} 2', text)
+        self.assertIn('load_seconds_bucket{le="+Inf"} 3', text)
+        self.assertIn('load_seconds_count 3', text)
+        self.assertIn('load_seconds_sum 5.55', text)
+
+    def test_timer_observes_on_error(self):
+        latency = self.registry.histogram('work_seconds', 'Work time', ['step'])
+        with self.assertRaises(ValueError):
+            with latency.time(step='parse'):
+                raise ValueError()
+        self.assertEqual(latency.count(step='parse'), 1)
+
+    def test_label_values_are_escaped(self):
+        self.registry.counter('files_total', 'Files', ['name']).inc(name='a"b\\c')
+        self.assertIn('files_total{name="a\\"b\\\\c"} 1', self.registry.render())
+
+    def test_same_name_returns_same_metric(self):
+        self.assertIs(self.registry.counter('a_total', 'A'), self.registry.counter('a_total', 'A'))
+
+    def test_sampling_filter_keeps_info_records(self):
+        sampling = SamplingFilter(rate=0)
+        record = lambda level: logging.LogRecord('app', level, __file__, 1, 'message', None, None)
+        self.assertFalse(sampling.filter(record(logging.DEBUG)))
+        self.assertTrue(sampling.filter(record(logging.INFO)))
+        self.assertTrue(SamplingFilter(rate=1).filter(record(logging.DEBUG)))
+
+    def test_pooled_connections_time_statements(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            db_path = os.path.join(tmp_dir, 'files.db')
+            before = DB_QUERY_SECONDS.count(statement='CREATE')
+            with connect(db_path) as conn:
+                conn.execute('CREATE TABLE files (filename TEXT)')
+            close_pool(db_path)
+        self.assertEqual(DB_QUERY_SECONDS.count(statement='CREATE'), before + 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+import unittest
+import os
+import sqlite3
+import tempfile
+import time
+import numpy as np
+from blob_store import BlobStore
+from conversion_cache import init_cache_table
+from database import close_pool
+from mesh_metadata import init_metadata_table
+from mesh_payload import init_payload_table
+from model_artifacts import ModelArtifacts
+from scenes import init_scene_table, mesh_key
+from textures import init_texture_asset_tables, init_texture_variants_table
+
+TRIANGLE = {'points': np.array([[0, 0, 0], [1, 0, 0], [0, 1, 0]], dtype=np.float32), 'faces': np.array([[0, 1, 2]])}
+
+
+class TestModelArtifacts(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmp_dir.name, 'files.db')
+        with sqlite3.connect(self.db_path) as conn:
+            conn.execute('CREATE TABLE files (id INTEGER PRIMARY KEY, filename TEXT UNIQUE, original_hash TEXT, obj_hash TEXT)')
+            for init in (init_cache_table, init_texture_variants_table, init_texture_asset_tables, init_metadata_table,
+                         init_payload_table, init_scene_table):
+                init(conn)
+        self.store = BlobStore(os.path.join(self.tmp_dir.name, 'blobs'))
+        self.artifacts = ModelArtifacts(self.db_path, self.store, grace_seconds=60)
+
+    def tearDown(self):
+        close_pool(self.db_path)
+        self.tmp_dir.cleanup()
+
+    def add_model(self, filename, content):
+        # A model split into two meshes, with a merged subset, payloads, a level of detail and a thumbnail
+        obj_hash = self.store.put_bytes(content)
+        node_keys = [mesh_key(obj_hash, [1]), mesh_key(obj_hash, [2])]
+        subset_key = mesh_key(obj_hash, [1, 2])
+        payload, lod, thumbnail = (self.store.put_bytes(content + suffix) for suffix in (b'ply', b'lod', b'png'))
+        with sqlite3.connect(self.db_path) as conn:
+            conn.execute('INSERT INTO files (filename, original_hash, obj_hash) VALUES (?, ?, ?)', (filename, obj_hash, obj_hash))
+            conn.executemany('INSERT INTO scene_nodes (obj_hash, node_id, mesh_hash) VALUES (?, ?, ?)',
+                             [(obj_hash, 1, node_keys[0]), (obj_hash, 2, node_keys[1])])
+            conn.execute('INSERT INTO scene_subsets (obj_hash, mesh_hash) VALUES (?, ?)', (obj_hash, subset_key))
+            conn.executemany('INSERT INTO mesh_payloads (obj_hash, level, payload_hash, lod_obj_hash) VALUES (?, ?, ?, ?)',
+                             [(obj_hash, 0, payload, None), (obj_hash, 1, payload, lod), (subset_key, 0, payload, None)])
+            conn.execute('INSERT INTO mesh_metadata (obj_hash, thumbnail_hash) VALUES (?, ?)', (obj_hash, thumbnail))
+        for key in [obj_hash, subset_key] + node_keys:
+            self.artifacts.meshes.put(key, TRIANGLE)
+        return obj_hash, [obj_hash, subset_key] + node_keys, [payload, lod, thumbnail]
+
+    def test_artifacts_are_released_with_the_last_source(self):
+        obj_hash, keys, blobs = self.add_model('chair.obj', b'v 0 0 0\n')
+        with sqlite3.connect(self.db_path) as conn:
+            conn.execute("INSERT INTO files (filename, obj_hash) VALUES ('chair_copy.obj', ?)", (obj_hash,))
+        self.assertFalse(self.artifacts.release(obj_hash))
+        with sqlite3.connect(self.db_path) as conn:
+            conn.execute('DELETE FROM files')
+        self.assertTrue(self.artifacts.release(obj_hash))
+        self.assertTrue(all(self.artifacts.meshes.get(key) is None for key in keys))
+        self.assertFalse(any(self.store.exists(blob) for blob in blobs))
+        with sqlite3.connect(self.db_path) as conn:
+            for table in ('mesh_payloads', 'mesh_metadata', 'scene_nodes', 'scene_subsets'):
+                self.assertEqual(conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0], 0, table)
+
+    def test_collect_keeps_models_in_use(self):
+        kept, kept_keys, kept_blobs = self.add_model('chair.obj', b'v 0 0 0\n')
+        dropped, _, dropped_blobs = self.add_model('table.obj', b'v 1 1 1\n')
+        stray = mesh_key('gone', [1])
+        self.artifacts.meshes.put(stray, TRIANGLE)
+        with sqlite3.connect(self.db_path) as conn:
+            conn.execute("DELETE FROM files WHERE filename = 'table.obj'")
+        self.assertEqual(self.artifacts.collect(), [dropped])
+        self.assertIsNotNone(self.artifacts.meshes.get(stray))
+        self.assertEqual(self.artifacts.collect(now=time.time() + 120), [])
+        self.assertIsNone(self.artifacts.meshes.get(stray))
+        self.assertTrue(all(self.artifacts.meshes.get(key) is not None for key in kept_keys))
+        self.assertTrue(all(self.store.exists(blob) for blob in kept_blobs))
+        self.assertFalse(any(self.store.exists(blob) for blob in dropped_blobs))
+
+
+if __name__ == '__main__':
+    unittest.main()
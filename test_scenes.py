@@ -0,0 +1,127 @@
+import unittest
+import json
+import os
+import struct
+import tempfile
+import numpy as np
+from blob_store import BlobStore
+from database import close_pool, connect
+from scenes import SceneGraph, gltf_scene_nodes, init_scene_table, merge_arrays, read_scene_nodes
+
+TRIANGLE = np.array([[0, 0, 0], [1, 0, 0], [0, 1, 0]], dtype=np.float32)
+QUAD = np.array([[0, 0, 0], [2, 0, 0], [2, 2, 0], [0, 2, 0]], dtype=np.float32)
+
+
+def write_glb(path, nodes, scene_roots):
+    # Two meshes, a triangle and a quad, sharing one binary buffer
+    triangle_indices = np.array([0, 1, 2], dtype=np.uint16)
+    quad_indices = np.array([0, 1, 2, 0, 2, 3], dtype=np.uint32)
+    chunks = [TRIANGLE.tobytes(), triangle_indices.tobytes() + b'\0\0', QUAD.tobytes(), quad_indices.tobytes()]
+    offsets = np.cumsum([0] + [len(chunk) for chunk in chunks])
+    binary = b''.join(chunks)
+    document = {
+        'asset': {'version': '2.0'},
+        'scene': 0,
+        'scenes': [{'nodes': scene_roots}],
+        'nodes': nodes,
+        'meshes': [
+            {'name': 'triangle', 'primitives': [{'attributes': {'POSITION': 0}, 'indices': 1}]},
+            {'name': 'quad', 'primitives': [{'attributes': {'POSITION': 2}, 'indices': 3}]},
+        ],
+        'buffers': [{'byteLength': len(binary)}],
+        'bufferViews': [{'buffer': 0, 'byteOffset': int(offset), 'byteLength': len(chunk)} for offset, chunk in zip(offsets, chunks)],
+        'accessors': [
+            {'bufferView': 0, 'componentType': 5126, 'count': 3, 'type': 'VEC3'},
+            {'bufferView': 1, 'componentType': 5123, 'count': 3, 'type': 'SCALAR'},
+            {'bufferView': 2, 'componentType': 5126, 'count': 4, 'type': 'VEC3'},
+            {'bufferView': 3, 'componentType': 5125, 'count': 6, 'type': 'SCALAR'},
+        ],
+    }
+    text = json.dumps(document).encode()
+    text += b' ' * (-len(text) % 4)
+    with open(path, 'wb') as f:
+        f.write(struct.pack('<4sII', b'glTF', 2, 12 + 8 + len(text) + 8 + len(binary)))
+        f.write(struct.pack('<I4s', len(text), b'JSON') + text)
+        f.write(struct.pack('<I4s', len(binary), b'BIN\0') + binary)
+
+
+class TestScenes(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.store = BlobStore(os.path.join(self.tmp_dir.name, 'blobs'))
+        self.db_path = os.path.join(self.tmp_dir.name, 'files.db')
+        with connect(self.db_path) as conn:
+            init_scene_table(conn)
+        self.scenes = SceneGraph(self.db_path, self.store)
+
+    def tearDown(self):
+        close_pool(self.db_path)
+        self.tmp_dir.cleanup()
+
+    def write_file(self, name, content):
+        path = os.path.join(self.tmp_dir.name, name)
+        with open(path, 'wb') as f:
+            f.write(content)
+        return path
+
+    def bouquet(self):
+        # A group node moved along x, holding a rotated triangle and a scaled quad
+        path = os.path.join(self.tmp_dir.name, 'bouquet.glb')
+        write_glb(path, [
+            {'name': 'bouquet', 'translation': [10, 0, 0], 'children': [1, 2]},
+            {'name': 'flower', 'mesh': 0, 'rotation': [0, 0, 0.7071068, 0.7071068]},
+            {'mesh': 1, 'scale': [0.5, 0.5, 0.5]},
+        ], [0])
+        return path
+
+    def test_gltf_nodes_keep_hierarchy_and_world_positions(self):
+        with open(self.bouquet(), 'rb') as f:
+            nodes = gltf_scene_nodes(f.read())
+        self.assertEqual([(node['node_id'], node['parent_id'], node['name']) for node in nodes],
+                         [(0, None, 'bouquet'), (1, 0, 'flower'), (2, 0, 'quad')])
+        self.assertIsNone(nodes[0]['arrays'])
+        # Rotated a quarter turn about z, then moved by the parent
+        np.testing.assert_allclose(nodes[1]['arrays']['points'], [[10, 0, 0], [10, 1, 0], [9, 0, 0]], atol=1e-5)
+        np.testing.assert_allclose(nodes[2]['arrays']['points'].max(axis=0), [11, 1, 0], atol=1e-6)
+        self.assertEqual(nodes[2]['arrays']['faces'].shape, (2, 3))
+
+    def test_obj_groups_become_nodes(self):
+        path = self.write_file('parts.obj', b'v 0 0 0\nv 1 0 0\nv 0 1 0\nv 1 1 0\n'
+                                            b'o stem\nf 1 2 3\ng head\nf 2 4 3\nf 1 2 4 3\n')
+        nodes = read_scene_nodes(path, '.obj')
+        self.assertEqual([node['name'] for node in nodes], ['stem', 'head'])
+        self.assertEqual(len(nodes[0]['arrays']['faces']), 1)
+        self.assertEqual(len(nodes[0]['arrays']['points']), 3)
+        self.assertEqual(len(nodes[1]['arrays']['faces']), 3)
+
+    def test_meshes_are_cached_and_subsets_merged(self):
+        obj_hash = self.store.put_file(self.bouquet())
+        nodes = self.scenes.build(obj_hash, '.glb')
+        self.assertEqual([node['n_faces'] for node in nodes], [None, 1, 2])
+        flower = self.scenes.subset(obj_hash, '.glb', [1])
+        self.assertEqual(flower, nodes[1]['mesh_hash'])
+        self.assertEqual(len(self.scenes.meshes.get(flower)['faces']), 1)
+        both = self.scenes.meshes.get(self.scenes.subset(obj_hash, '.glb', [2, 1]))
+        self.assertEqual(len(both['faces']), 3)
+        self.assertEqual(len(both['points']), 7)
+        with self.assertRaises(KeyError):
+            self.scenes.subset(obj_hash, '.glb', [0])
+
+    def test_single_mesh_uses_the_model_entry(self):
+        obj_hash = self.store.put_file(self.write_file('one.obj', b'v 0 0 0\nv 1 0 0\nv 0 1 0\nf 1 2 3\n'))
+        nodes = self.scenes.build(obj_hash, '.obj')
+        self.assertEqual(len(nodes), 1)
+        self.assertEqual(nodes[0]['mesh_hash'], obj_hash)
+        self.assertIsNotNone(self.scenes.meshes.get(obj_hash))
+
+    def test_merge_drops_attributes_missing_from_a_part(self):
+        part = {'points': TRIANGLE, 'faces': np.array([[0, 1, 2]]), 'tcoords': None, 'normals': np.zeros((3, 3))}
+        merged = merge_arrays([part, dict(part, tcoords=np.zeros((3, 2)))])
+        np.testing.assert_array_equal(merged['faces'], [[0, 1, 2], [3, 4, 5]])
+        self.assertIsNone(merged['tcoords'])
+        self.assertEqual(merged['normals'].shape, (6, 3))
+
+
+if __name__ == '__main__':
+    unittest.main()
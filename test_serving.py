@@ -0,0 +1,57 @@
+import unittest
+import io
+import threading
+import time
+from flask import Flask, send_file
+from serving import TransferLimiter, busy_response
+
+
+class TestTransferLimiter(unittest.TestCase):
+
+    def test_requests_over_the_limit_are_refused(self):
+        limiter = TransferLimiter(limit=2, timeout=0.05)
+        self.assertTrue(limiter.acquire())
+        self.assertTrue(limiter.acquire())
+        self.assertFalse(limiter.acquire())
+        limiter.release()
+        self.assertTrue(limiter.acquire())
+        self.assertEqual(limiter.active(), 2)
+
+    def test_drain_waits_for_transfers_and_refuses_new_ones(self):
+        limiter = TransferLimiter(limit=2, timeout=0.05)
+        limiter.acquire()
+        threading.Timer(0.1, limiter.release).start()
+        started = time.monotonic()
+        self.assertTrue(limiter.drain(timeout=5))
+        self.assertLess(time.monotonic() - started, 5)
+        self.assertFalse(limiter.acquire())
+
+    def test_drain_gives_up_after_the_timeout(self):
+        limiter = TransferLimiter(limit=1, timeout=0.05)
+        limiter.acquire()
+        self.assertFalse(limiter.drain(timeout=0.05))
+
+    def test_slot_is_released_when_a_file_response_closes(self):
+        server = Flask(__name__)
+        limiter = TransferLimiter(limit=1, timeout=0.05)
+        with server.test_request_context('/'):
+            for response in (send_file(io.BytesIO(b'model'), mimetype='application/zip'), server.make_response('done')):
+                self.assertTrue(limiter.acquire())
+                limiter.release_on_close(response)
+                self.assertFalse(limiter.acquire())
+                response.close()
+                self.assertEqual(limiter.active(), 0)
+                # Closing twice gives the slot back once
+                response.close()
+                self.assertTrue(limiter.acquire())
+                limiter.release()
+
+    def test_busy_response_asks_clients_to_retry(self):
+        with Flask(__name__).test_request_context('/'):
+            response = busy_response("Busy", retry_after=3)
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.headers['Retry-After'], '3')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,142 @@
+import unittest
+import os
+import sqlite3
+import tempfile
+import time
+from PIL import Image
+from blob_store import BlobStore
+from database import close_pool
+from conversion_cache import init_cache_table
+from textures import (TextureAssets, TextureVariants, build_texture_variants, init_texture_asset_tables, init_texture_variants_table,
+                      migrate_texture_links, validate_texture)
+
+
+class TestTextureVariants(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmp_dir.name, 'files.db')
+        with sqlite3.connect(self.db_path) as conn:
+            init_texture_variants_table(conn)
+        self.store = BlobStore(os.path.join(self.tmp_dir.name, 'blobs'))
+        self.variants = TextureVariants(self.db_path, self.store)
+
+    def tearDown(self):
+        close_pool(self.db_path)
+        self.tmp_dir.cleanup()
+
+    def put_image(self, size, mode='RGB', ext='.png'):
+        path = os.path.join(self.tmp_dir.name, f'texture{ext}')
+        Image.new(mode, size, 'red').save(path)
+        return self.store.put_file(path)
+
+    def test_mip_chain_ends_at_thumbnail(self):
+        texture_hash = self.put_image((1000, 600))
+        self.assertEqual(build_texture_variants(self.db_path, self.store, texture_hash, '.png'), 4)
+        sizes = [(level['width'], level['height']) for level in self.variants.levels(texture_hash)]
+        self.assertEqual(sizes, [(1000, 600), (500, 300), (250, 150), (125, 75)])
+        thumbnail = self.variants.thumbnail(texture_hash)
+        self.assertEqual(thumbnail['format'], '.jpg')
+        with Image.open(self.store.path(thumbnail['variant_hash'])) as image:
+            self.assertEqual(image.size, (125, 75))
+
+    def test_pick_returns_smallest_adequate_level(self):
+        texture_hash = self.put_image((1000, 600))
+        self.assertIsNone(self.variants.pick(texture_hash, 256))
+        self.variants.build(texture_hash, '.png')
+        self.assertEqual(self.variants.pick(texture_hash, 256)['level'], 1)
+        self.assertEqual(self.variants.pick(texture_hash, 500)['level'], 1)
+        self.assertEqual(self.variants.pick(texture_hash, 4096)['level'], 0)
+        self.assertEqual(self.variants.pick(texture_hash, 64)['level'], 3)
+
+    def test_transparent_levels_stay_png(self):
+        texture_hash = self.put_image((300, 300), mode='RGBA')
+        self.variants.build(texture_hash, '.png')
+        self.assertEqual(self.variants.thumbnail(texture_hash)['format'], '.png')
+
+    def test_invalid_images_are_rejected(self):
+        path = os.path.join(self.tmp_dir.name, 'fake.png')
+        with open(path, 'wb') as f:
+            f.write(b'not an image')
+        with self.assertRaises(ValueError):
+            validate_texture(path)
+
+
+class TestTextureAssets(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmp_dir.name, 'files.db')
+        with sqlite3.connect(self.db_path) as conn:
+            conn.execute('CREATE TABLE files (id INTEGER PRIMARY KEY, filename TEXT UNIQUE, original_hash TEXT, obj_hash TEXT)')
+            init_cache_table(conn)
+            init_texture_variants_table(conn)
+            init_texture_asset_tables(conn)
+        self.store = BlobStore(os.path.join(self.tmp_dir.name, 'blobs'))
+        self.assets = TextureAssets(self.db_path, self.store, grace_seconds=60)
+
+    def tearDown(self):
+        close_pool(self.db_path)
+        self.tmp_dir.cleanup()
+
+    def put_image(self, color):
+        path = os.path.join(self.tmp_dir.name, 'texture.png')
+        Image.new('RGB', (300, 200), color).save(path)
+        return self.store.put_file(path)
+
+    def test_shared_texture_is_counted_once_per_link(self):
+        wood = self.put_image('brown')
+        for model in ('chair.obj', 'table.obj', 'shelf.obj'):
+            self.assertTrue(self.assets.link(model, 'wood.png', wood))
+        refused = self.put_image('white')
+        self.assertFalse(self.assets.link('chair.obj', 'wood.png', refused))
+        self.assertEqual(self.assets.get(wood)['ref_count'], 3)
+        usage = self.assets.usage()
+        self.assertEqual((usage['assets'], usage['links'], usage['unreferenced']), (2, 3, 1))
+        self.assertEqual(usage['bytes'], self.store.size(wood) + self.store.size(refused))
+        self.assertEqual(self.assets.collect_garbage(now=time.time() + 120), [refused])
+
+    def test_unreferenced_textures_are_collected_after_grace_period(self):
+        wood = self.put_image('brown')
+        build_texture_variants(self.db_path, self.store, wood, '.png')
+        thumbnail = TextureVariants(self.db_path, self.store).thumbnail(wood)['variant_hash']
+        self.assets.link('chair.obj', 'wood.png', wood)
+        self.assets.link('table.obj', 'wood.png', wood)
+        self.assertTrue(self.assets.unlink('chair.obj', 'wood.png'))
+        self.assertEqual(self.assets.collect_garbage(now=time.time() + 120), [])
+        self.assertEqual(self.assets.unlink_model('table.obj'), 1)
+        self.assertEqual(self.assets.get(wood)['ref_count'], 0)
+        self.assertEqual(self.assets.collect_garbage(), [])
+        self.assertEqual(self.assets.collect_garbage(now=time.time() + 120), [wood])
+        self.assertIsNone(self.assets.get(wood))
+        self.assertFalse(self.store.exists(wood))
+        self.assertFalse(self.store.exists(thumbnail))
+
+    def test_relinking_releases_old_content_but_keeps_blobs_used_by_models(self):
+        old, new = self.put_image('brown'), self.put_image('white')
+        with sqlite3.connect(self.db_path) as conn:
+            conn.execute('INSERT INTO files (filename, original_hash) VALUES (?, ?)', ('image.png', old))
+        self.assets.link('chair.obj', 'wood.png', old)
+        self.assertTrue(self.assets.link('chair.obj', 'wood.png', new, replace=True))
+        self.assertEqual([link['texture_hash'] for link in self.assets.links('chair.obj')], [new])
+        self.assertEqual(self.assets.collect_garbage(now=time.time() + 120), [old])
+        self.assertTrue(self.store.exists(old))
+
+    def test_legacy_textures_table_is_migrated(self):
+        wood, stone = self.put_image('brown'), self.put_image('grey')
+        with sqlite3.connect(self.db_path) as conn:
+            conn.execute('CREATE TABLE textures (id INTEGER PRIMARY KEY, obj_filename TEXT, texture_filename TEXT, texture_hash TEXT)')
+            conn.executemany('INSERT INTO textures (obj_filename, texture_filename, texture_hash) VALUES (?, ?, ?)', [
+                ('chair.obj', 'wood.png', wood), ('table.obj', 'wood.png', wood),
+                ('table.obj', 'wood.png', stone), ('wall.obj', 'stone.PNG', stone)])
+            self.assertEqual(migrate_texture_links(conn, self.store), 4)
+            self.assertIsNone(conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'textures'").fetchone())
+            self.assertEqual(migrate_texture_links(conn, self.store), 0)
+        self.assertEqual(self.assets.get(wood)['ref_count'], 2)
+        self.assertEqual(self.assets.get(stone)['ref_count'], 1)
+        self.assertEqual(self.assets.get(stone)['ext'], '.png')
+        self.assertEqual(self.assets.lookup('table.obj', 'wood.png')['texture_hash'], wood)
+
+
+if __name__ == '__main__':
+    unittest.main()
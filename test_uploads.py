@@ -0,0 +1,75 @@
+import unittest
+import hashlib
+import io
+import os
+import sqlite3
+import tempfile
+from blob_store import BlobStore
+from uploads import ChunkedUploads, UploadError, init_uploads_table
+from database import close_pool
+
+
+class TestChunkedUploads(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmp_dir.name, 'files.db')
+        with sqlite3.connect(self.db_path) as conn:
+            init_uploads_table(conn)
+        self.store = BlobStore(os.path.join(self.tmp_dir.name, 'blobs'))
+        self.uploads = ChunkedUploads(self.db_path, self.store, max_size=64)
+        self.data = b'v 0 0 0\nv 1 0 0\nv 0 1 0\nf 1 2 3\n'
+
+    def tearDown(self):
+        close_pool(self.db_path)
+        self.tmp_dir.cleanup()
+
+    def test_chunks_are_hashed_into_the_store(self):
+        upload = self.uploads.create('model.obj', 'source', total_size=len(self.data))
+        self.uploads.append(upload['id'], 0, io.BytesIO(self.data[:10]), chunk_size=4)
+        self.uploads.append(upload['id'], 10, io.BytesIO(self.data[10:]), chunk_size=4)
+        upload, digest = self.uploads.complete(upload['id'])
+        self.assertEqual(digest, hashlib.sha256(self.data).hexdigest())
+        self.assertEqual(self.store.read(digest), self.data)
+        self.assertEqual(os.listdir(self.uploads.staging_dir), [])
+
+    def test_resume_from_another_process(self):
+        upload = self.uploads.create('model.obj', 'source')
+        self.uploads.append(upload['id'], 0, io.BytesIO(self.data[:10]))
+        resumed = ChunkedUploads(self.db_path, self.store, max_size=64)
+        with self.assertRaises(UploadError) as error:
+            resumed.append(upload['id'], 20, io.BytesIO(self.data[20:]))
+        self.assertEqual(error.exception.status_code, 409)
+        resumed.append(upload['id'], resumed.get(upload['id'])['received'], io.BytesIO(self.data[10:]))
+        self.assertEqual(resumed.complete(upload['id'])[1], hashlib.sha256(self.data).hexdigest())
+
+    def test_size_limits(self):
+        with self.assertRaises(UploadError):
+            self.uploads.create('model.obj', 'source', total_size=65)
+        upload = self.uploads.create('model.obj', 'source')
+        with self.assertRaises(UploadError) as error:
+            self.uploads.append(upload['id'], 0, io.BytesIO(self.data * 3))
+        self.assertEqual(error.exception.status_code, 413)
+
+
+    def test_abandoned_uploads_expire(self):
+        abandoned = self.uploads.create('old.obj', 'source')
+        self.uploads.append(abandoned['id'], 0, io.BytesIO(self.data[:10]))
+        active = self.uploads.create('new.obj', 'source')
+        self.uploads.append(active['id'], 0, io.BytesIO(self.data[:10]))
+        stray = os.path.join(self.uploads.staging_dir, 'crashed.part')
+        open(stray, 'wb').close()
+        with sqlite3.connect(self.db_path) as conn:
+            conn.execute('UPDATE uploads SET updated_at = updated_at - ? WHERE id = ?',
+                         (self.uploads.expiry_seconds + 1, abandoned['id']))
+        os.utime(stray, (0, 0))
+        self.assertEqual(self.uploads.expire(), 1)
+        with self.assertRaises(UploadError) as error:
+            self.uploads.get(abandoned['id'])
+        self.assertEqual(error.exception.status_code, 404)
+        self.assertEqual(os.listdir(self.uploads.staging_dir), [active['id'] + '.part'])
+        self.uploads.append(active['id'], 10, io.BytesIO(self.data[10:]))
+        self.assertEqual(self.uploads.complete(active['id'])[1], hashlib.sha256(self.data).hexdigest())
+
+if __name__ == '__main__':
+    unittest.main()
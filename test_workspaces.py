@@ -0,0 +1,74 @@
+import unittest
+import os
+import tempfile
+import time
+from workspaces import WorkspaceManager, measure
+
+
+class TestWorkspaces(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.root = os.path.join(self.tmp_dir.name, 'temp_uploads')
+        self.downloads = os.path.join(self.tmp_dir.name, 'downloads')
+        os.makedirs(self.downloads)
+        self.manager = WorkspaceManager(self.root, quota_bytes=250, idle_seconds=60, report={'downloads': self.downloads})
+
+    def tearDown(self):
+        self.manager.stop()
+        self.tmp_dir.cleanup()
+
+    def write(self, path, size):
+        with open(path, 'wb') as f:
+            f.write(b'x' * size)
+        return path
+
+    def test_workspaces_are_unique_and_removed_on_release(self):
+        with self.manager.workspace() as first, self.manager.workspace() as second:
+            self.assertNotEqual(first.path, second.path)
+            self.write(first.file('model.obj'), 10)
+            self.write(second.file('model.obj'), 20)
+            self.assertEqual(self.manager.usage()['in_use'], 2)
+        self.assertEqual(os.listdir(self.root), [])
+        self.assertEqual(self.manager.usage()['in_use'], 0)
+
+    def test_least_recently_used_are_evicted_down_to_quota(self):
+        kept = []
+        for i in range(3):
+            workspace = self.manager.create()
+            self.write(workspace.file('failed.glb'), 100)
+            workspace.release(keep=True)
+            workspace.last_access = time.time() - 100 + i
+            kept.append(workspace.path)
+        active = self.manager.create()
+        self.write(active.file('converting.glb'), 100)
+        self.assertEqual(self.manager.sweep(), 2)
+        self.assertEqual(sorted(os.listdir(self.root)), sorted(os.path.basename(path) for path in (kept[2], active.path)))
+        usage = self.manager.usage()
+        self.assertEqual((usage['evicted'], usage['kept'], usage['in_use']), (2, 1, 1))
+        self.assertEqual(usage['directories']['workspaces'], 200)
+
+    def test_untracked_leftovers_are_evicted_once_idle(self):
+        stale = self.write(os.path.join(self.root, 'obj3d.obj'), 200)
+        os.utime(stale, (time.time() - 3600, time.time() - 3600))
+        fresh = self.write(os.path.join(self.root, 'temp_texture.jpg'), 300)
+        self.assertEqual(self.manager.sweep(), 1)
+        self.assertFalse(os.path.exists(stale))
+        self.assertTrue(os.path.exists(fresh))
+        self.assertEqual(self.manager.sweep(now=time.time() + 120), 1)
+        self.assertEqual(os.listdir(self.root), [])
+
+    def test_usage_reports_other_directories(self):
+        self.write(os.path.join(self.downloads, 'a.zip'), 30)
+        os.makedirs(os.path.join(self.downloads, 'nested'))
+        self.write(os.path.join(self.downloads, 'nested', 'b.zip'), 12)
+        self.assertEqual(measure(self.downloads)[0], 42)
+        self.manager.start()
+        self.manager.stop()
+        usage = self.manager.usage()
+        self.assertEqual(usage['directories'], {'workspaces': 0, 'downloads': 42})
+        self.assertGreater(usage['free_bytes'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
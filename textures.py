@@ -0,0 +1,287 @@
+import io
+import logging
+import os
+import time
+
+from PIL import Image
+
+from conversion_cache import blob_is_referenced
+from database import connect
+
+# The mip chain stops at the first level no larger than this, which doubles as the thumbnail
+THUMBNAIL_SIZE = 128
+# Desktop previews never need more than this many pixels on the long side
+TEXTURE_PREVIEW_SIZE = int(os.environ.get('TEXTURE_PREVIEW_SIZE', 2048))
+# Quality for the JPEG-encoded levels of opaque textures
+TEXTURE_JPEG_QUALITY = int(os.environ.get('TEXTURE_JPEG_QUALITY', 85))
+# Textures no model links to any more are deleted after this many seconds, so a texture removed and
+# uploaded again shortly after is not processed twice
+TEXTURE_GC_GRACE_SECONDS = float(os.environ.get('TEXTURE_GC_GRACE_SECONDS', 3600))
+
+
+def init_texture_variants_table(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS texture_variants (
+            texture_hash TEXT,
+            level INTEGER,
+            variant_hash TEXT,
+            format TEXT,
+            width INTEGER,
+            height INTEGER,
+            PRIMARY KEY (texture_hash, level)
+        )''')
+    # Levels identical across textures share a blob, which stays while any of them uses it
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_texture_variants_variant ON texture_variants (variant_hash)')
+
+
+def validate_texture(path):
+    # Raises ValueError for anything Pillow cannot decode, including decompression bombs
+    try:
+        with Image.open(path) as image:
+            image.verify()
+            return image.format, image.size
+    except (OSError, SyntaxError, Image.DecompressionBombError) as e:
+        logging.debug(f"Rejected texture {path}: {e}")
+        raise ValueError("Not a valid image file")
+
+
+def _has_alpha(image):
+    return image.mode in ('RGBA', 'LA', 'PA') or 'transparency' in image.info
+
+
+def _encode(image):
+    # Levels with transparency stay lossless, opaque ones are JPEG
+    output = io.BytesIO()
+    if _has_alpha(image):
+        image.convert('RGBA').save(output, 'PNG')
+        return output.getvalue(), '.png'
+    image.convert('RGB').save(output, 'JPEG', quality=TEXTURE_JPEG_QUALITY)
+    return output.getvalue(), '.jpg'
+
+
+def mip_chain(image, min_size=THUMBNAIL_SIZE):
+    # Each level halves the one before it until the long side is at most min_size
+    while max(image.size) > min_size:
+        image = image.reduce(2)
+        yield image
+
+
+class TextureVariants:
+    """Downscaled levels of every texture, generated once per texture content hash.
+
+    Level 0 is the uploaded image itself and each further level halves the
+    one before it, down to a thumbnail of at most ``THUMBNAIL_SIZE`` pixels.
+    Levels are kept in the blob store, so the same image uploaded for
+    several models is only processed once.
+    """
+
+    def __init__(self, database, store):
+        self.database = database
+        self.store = store
+
+    def levels(self, texture_hash):
+        with connect(self.database) as conn:
+            return conn.execute('SELECT * FROM texture_variants WHERE texture_hash = ? ORDER BY level', (texture_hash,)).fetchall()
+
+    def pick(self, texture_hash, size):
+        # The smallest level whose long side still covers size pixels, None until the levels are built
+        levels = self.levels(texture_hash)
+        adequate = [level for level in levels if max(level['width'], level['height']) >= size]
+        if adequate:
+            return adequate[-1]
+        return levels[0] if levels else None
+
+    def thumbnail(self, texture_hash):
+        levels = self.levels(texture_hash)
+        return levels[-1] if levels else None
+
+    def build(self, texture_hash, ext=''):
+        if self.levels(texture_hash):
+            return len(self.levels(texture_hash))
+        started = time.time()
+        with Image.open(self.store.path(texture_hash, ext)) as image:
+            image.load()
+            rows = [(texture_hash, 0, texture_hash, ext.lower(), image.width, image.height)]
+            if image.mode not in ('RGB', 'RGBA', 'L'):
+                image = image.convert('RGBA' if _has_alpha(image) else 'RGB')
+            for level, reduced in enumerate(mip_chain(image), start=1):
+                data, variant_ext = _encode(reduced)
+                rows.append((texture_hash, level, self.store.put_bytes(data), variant_ext, reduced.width, reduced.height))
+        with connect(self.database) as conn:
+            conn.executemany(
+                'INSERT OR REPLACE INTO texture_variants (texture_hash, level, variant_hash, format, width, height) VALUES (?, ?, ?, ?, ?, ?)',
+                rows)
+        logging.debug(f"Built {len(rows)} texture levels for {texture_hash} in {time.time() - started:.2f}s")
+        return len(rows)
+
+
+def build_texture_variants(database, store, texture_hash, ext=''):
+    # Runs inside a worker process
+    return TextureVariants(database, store).build(texture_hash, ext)
+
+
+def init_texture_asset_tables(conn):
+    # Every texture is stored once per content hash; models refer to it by name through model_textures
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS texture_assets (
+            texture_hash TEXT PRIMARY KEY,
+            ext TEXT,
+            size INTEGER,
+            ref_count INTEGER NOT NULL DEFAULT 0,
+            created_at REAL,
+            unreferenced_at REAL
+        )''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS model_textures (
+            id INTEGER PRIMARY KEY,
+            obj_filename TEXT,
+            texture_filename TEXT,
+            texture_hash TEXT,
+            UNIQUE (obj_filename, texture_filename),
+            FOREIGN KEY (obj_filename) REFERENCES files (filename),
+            FOREIGN KEY (texture_hash) REFERENCES texture_assets (texture_hash)
+        )''')
+    # Reference checks and garbage collection look links up by content
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_model_textures_hash ON model_textures (texture_hash)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_texture_assets_unreferenced ON texture_assets (ref_count, unreferenced_at)')
+
+
+def _blob_size(store, digest):
+    return store.size(digest) if store.exists(digest) else None
+
+
+def recount_texture_references(conn):
+    # Reference counts are rebuilt from the links, which are the source of truth
+    conn.execute('''
+        UPDATE texture_assets SET ref_count = (SELECT COUNT(*) FROM model_textures WHERE texture_hash = texture_assets.texture_hash)''')
+    conn.execute('UPDATE texture_assets SET unreferenced_at = NULL WHERE ref_count > 0')
+    conn.execute('UPDATE texture_assets SET unreferenced_at = ? WHERE ref_count = 0 AND unreferenced_at IS NULL', (time.time(),))
+
+
+def migrate_texture_links(conn, store):
+    # Databases from before shared assets kept one textures row per model and texture name
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'textures'").fetchone() is None:
+        return 0
+    rows = conn.execute('''
+        SELECT obj_filename, texture_filename, texture_hash FROM textures
+        WHERE texture_hash IS NOT NULL ORDER BY id''').fetchall()
+    now = time.time()
+    for obj_filename, texture_filename, texture_hash in rows:
+        conn.execute('INSERT OR IGNORE INTO texture_assets (texture_hash, ext, size, created_at) VALUES (?, ?, ?, ?)',
+                     (texture_hash, os.path.splitext(texture_filename)[1].lower(), _blob_size(store, texture_hash), now))
+        # Duplicate names for one model keep the first row, as the old lookups did
+        conn.execute('INSERT OR IGNORE INTO model_textures (obj_filename, texture_filename, texture_hash) VALUES (?, ?, ?)',
+                     (obj_filename, texture_filename, texture_hash))
+    recount_texture_references(conn)
+    conn.execute('DROP TABLE textures')
+    logging.info(f"Moved {len(rows)} texture links to shared texture assets")
+    return len(rows)
+
+
+class TextureAssets:
+    """Textures as shared assets identified by content hash and linked to models by name.
+
+    An image used by many models is stored once; every (model, texture name)
+    link in ``model_textures`` counts as one reference to it. Assets whose
+    last link is removed are deleted by :meth:`collect_garbage`, together
+    with their downscaled levels, once they have stayed unreferenced for
+    ``grace_seconds``.
+    """
+
+    def __init__(self, database, store, grace_seconds=TEXTURE_GC_GRACE_SECONDS):
+        self.database = database
+        self.store = store
+        self.grace_seconds = grace_seconds
+
+    def get(self, texture_hash):
+        with connect(self.database) as conn:
+            return conn.execute('SELECT * FROM texture_assets WHERE texture_hash = ?', (texture_hash,)).fetchone()
+
+    def lookup(self, obj_filename, texture_filename):
+        with connect(self.database) as conn:
+            return conn.execute('''
+                SELECT model_textures.texture_hash, texture_assets.ext FROM model_textures
+                JOIN texture_assets ON texture_assets.texture_hash = model_textures.texture_hash
+                WHERE obj_filename = ? AND texture_filename = ?''', (obj_filename, texture_filename)).fetchone()
+
+    def links(self, obj_filename):
+        with connect(self.database) as conn:
+            return conn.execute('''
+                SELECT texture_filename, texture_hash FROM model_textures
+                WHERE obj_filename = ? ORDER BY texture_filename''', (obj_filename,)).fetchall()
+
+    def link(self, obj_filename, texture_filename, texture_hash, replace=False):
+        # False when the model already has a texture of that name, unless replace points the name at the new content
+        with connect(self.database) as conn:
+            # New content starts out unreferenced, so an upload whose link is refused is collected as well
+            now = time.time()
+            conn.execute('INSERT OR IGNORE INTO texture_assets (texture_hash, ext, size, created_at, unreferenced_at) VALUES (?, ?, ?, ?, ?)',
+                         (texture_hash, os.path.splitext(texture_filename)[1].lower(), _blob_size(self.store, texture_hash), now, now))
+            existing = conn.execute('SELECT id, texture_hash FROM model_textures WHERE obj_filename = ? AND texture_filename = ?',
+                                    (obj_filename, texture_filename)).fetchone()
+            if existing is None:
+                conn.execute('INSERT INTO model_textures (obj_filename, texture_filename, texture_hash) VALUES (?, ?, ?)',
+                             (obj_filename, texture_filename, texture_hash))
+            elif replace and existing['texture_hash'] != texture_hash:
+                conn.execute('UPDATE model_textures SET texture_hash = ? WHERE id = ?', (texture_hash, existing['id']))
+                self._release(conn, existing['texture_hash'])
+            else:
+                return False
+            conn.execute('UPDATE texture_assets SET ref_count = ref_count + 1, unreferenced_at = NULL WHERE texture_hash = ?',
+                         (texture_hash,))
+        return True
+
+    def unlink(self, obj_filename, texture_filename):
+        with connect(self.database) as conn:
+            existing = conn.execute('SELECT id, texture_hash FROM model_textures WHERE obj_filename = ? AND texture_filename = ?',
+                                    (obj_filename, texture_filename)).fetchone()
+            if existing is None:
+                return False
+            conn.execute('DELETE FROM model_textures WHERE id = ?', (existing['id'],))
+            self._release(conn, existing['texture_hash'])
+        return True
+
+    def unlink_model(self, obj_filename):
+        with connect(self.database) as conn:
+            links = conn.execute('SELECT id, texture_hash FROM model_textures WHERE obj_filename = ?', (obj_filename,)).fetchall()
+            conn.execute('DELETE FROM model_textures WHERE obj_filename = ?', (obj_filename,))
+            for link in links:
+                self._release(conn, link['texture_hash'])
+        return len(links)
+
+    def _release(self, conn, texture_hash):
+        conn.execute('UPDATE texture_assets SET ref_count = MAX(ref_count - 1, 0) WHERE texture_hash = ?', (texture_hash,))
+        conn.execute('UPDATE texture_assets SET unreferenced_at = ? WHERE texture_hash = ? AND ref_count = 0',
+                     (time.time(), texture_hash))
+
+    def usage(self):
+        with connect(self.database) as conn:
+            return conn.execute('''
+                SELECT COUNT(*) AS assets, COALESCE(SUM(size), 0) AS bytes, COALESCE(SUM(ref_count), 0) AS links,
+                       COALESCE(SUM(CASE WHEN ref_count = 0 THEN 1 ELSE 0 END), 0) AS unreferenced
+                FROM texture_assets''').fetchone()
+
+    def collect_garbage(self, now=None):
+        # Deletes assets unreferenced for longer than the grace period, returns their hashes
+        cutoff = (now if now is not None else time.time()) - self.grace_seconds
+        collected, unused_blobs = [], set()
+        with connect(self.database) as conn:
+            candidates = conn.execute('SELECT texture_hash FROM texture_assets WHERE ref_count = 0 AND unreferenced_at <= ?',
+                                      (cutoff,)).fetchall()
+            for (texture_hash,) in candidates:
+                # A link made since the candidates were read keeps the asset
+                if conn.execute('SELECT 1 FROM model_textures WHERE texture_hash = ? LIMIT 1', (texture_hash,)).fetchone():
+                    continue
+                variants = conn.execute('SELECT variant_hash FROM texture_variants WHERE texture_hash = ?', (texture_hash,)).fetchall()
+                conn.execute('DELETE FROM texture_variants WHERE texture_hash = ?', (texture_hash,))
+                conn.execute('DELETE FROM texture_assets WHERE texture_hash = ?', (texture_hash,))
+                unused_blobs.update([texture_hash] + [variant['variant_hash'] for variant in variants])
+                collected.append(texture_hash)
+            # The same bytes may also be a model, another texture's level or a cached conversion
+            unused_blobs = [blob for blob in unused_blobs if not blob_is_referenced(conn, blob)
+                            and conn.execute('SELECT 1 FROM conversion_cache WHERE blob_hash = ?', (blob,)).fetchone() is None]
+        for blob in unused_blobs:
+            self.store.delete(blob)
+        if collected:
+            logging.info(f"Collected {len(collected)} unreferenced textures, deleted {len(unused_blobs)} blobs")
+        return collected
@@ -0,0 +1,172 @@
+import hashlib
+import logging
+import os
+import threading
+import time
+import uuid
+
+from database import connect
+from metrics import counter
+
+# Largest file accepted through the chunked upload endpoint
+MAX_UPLOAD_SIZE = int(os.environ.get('MAX_UPLOAD_SIZE', 2 * 1024 * 1024 * 1024))  # 2 GB
+
+# Uploads that received no chunk for this long are abandoned, their rows and staging files are deleted
+UPLOAD_EXPIRY_SECONDS = float(os.environ.get('UPLOAD_EXPIRY_SECONDS', 24 * 3600))
+
+UPLOAD_KINDS = ('source', 'texture')
+
+UPLOAD_RECEIVED_BYTES = counter('upload_received_bytes_total', 'Bytes received through the chunked upload endpoint')
+UPLOADS_EXPIRED = counter('uploads_expired_total', 'Incomplete chunked uploads deleted after UPLOAD_EXPIRY_SECONDS without a chunk')
+
+
+class UploadError(Exception):
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def init_uploads_table(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS uploads (
+            id TEXT PRIMARY KEY,
+            filename TEXT,
+            kind TEXT,
+            obj_filename TEXT,
+            total_size INTEGER,
+            received INTEGER,
+            created_at REAL,
+            updated_at REAL
+        )''')
+
+
+class ChunkedUploads:
+    """Resumable uploads streamed to disk in chunks and then moved into the blob store.
+
+    Each upload is appended to a staging file one request body at a time,
+    so memory use stays constant whatever the file size. The SHA-256 is
+    computed while the chunks are written, and recomputed from the staging
+    file only when an upload was resumed in another process.
+    """
+
+    def __init__(self, database, store, staging_dir=None, max_size=MAX_UPLOAD_SIZE, expiry_seconds=UPLOAD_EXPIRY_SECONDS):
+        self.database = database
+        self.store = store
+        self.staging_dir = staging_dir or os.path.join(store.root, 'staging')
+        self.max_size = max_size
+        self.expiry_seconds = expiry_seconds
+        self._hashers = {}
+        self._lock = threading.Lock()
+        if not os.path.exists(self.staging_dir):
+            os.makedirs(self.staging_dir)
+
+    def _connect(self):
+        return connect(self.database)
+
+    def _staging_path(self, upload_id):
+        return os.path.join(self.staging_dir, f"{upload_id}.part")
+
+    def create(self, filename, kind, obj_filename=None, total_size=None):
+        if kind not in UPLOAD_KINDS:
+            raise UploadError(f"Unknown upload kind: {kind}")
+        if kind == 'texture' and not obj_filename:
+            raise UploadError("Texture uploads need the source file they belong to")
+        if total_size is not None and total_size > self.max_size:
+            raise UploadError(f"File size exceeds the limit: {filename}", 413)
+        upload_id = uuid.uuid4().hex
+        open(self._staging_path(upload_id), 'wb').close()
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                'INSERT INTO uploads (id, filename, kind, obj_filename, total_size, received, created_at, updated_at) VALUES (?, ?, ?, ?, ?, 0, ?, ?)',
+                (upload_id, filename, kind, obj_filename, total_size, now, now))
+        with self._lock:
+            self._hashers[upload_id] = (0, hashlib.sha256())
+        logging.debug(f"Started upload {upload_id} for {filename}")
+        return self.get(upload_id)
+
+    def get(self, upload_id):
+        with self._connect() as conn:
+            upload = conn.execute('SELECT * FROM uploads WHERE id = ?', (upload_id,)).fetchone()
+        if upload is None:
+            raise UploadError(f"Unknown upload: {upload_id}", 404)
+        return upload
+
+    def append(self, upload_id, offset, stream, chunk_size=1024 * 1024):
+        upload = self.get(upload_id)
+        if offset != upload['received']:
+            # The client resumes from the offset reported by get()
+            raise UploadError(f"Expected offset {upload['received']}, got {offset}", 409)
+        with self._lock:
+            hashed, hasher = self._hashers.pop(upload_id, (None, None))
+        if hashed != offset:
+            hasher = None
+        received = offset
+        with open(self._staging_path(upload_id), 'r+b') as f:
+            f.seek(offset)
+            f.truncate()
+            for chunk in iter(lambda: stream.read(chunk_size), b''):
+                received += len(chunk)
+                if received > self.max_size:
+                    raise UploadError(f"File size exceeds the limit: {upload['filename']}", 413)
+                f.write(chunk)
+                if hasher is not None:
+                    hasher.update(chunk)
+        with self._connect() as conn:
+            conn.execute('UPDATE uploads SET received = ?, updated_at = ? WHERE id = ?', (received, time.time(), upload_id))
+        UPLOAD_RECEIVED_BYTES.inc(received - offset)
+        if hasher is not None:
+            with self._lock:
+                self._hashers[upload_id] = (received, hasher)
+        return received
+
+    def complete(self, upload_id):
+        upload = self.get(upload_id)
+        if upload['total_size'] is not None and upload['received'] != upload['total_size']:
+            raise UploadError(f"Upload incomplete: received {upload['received']} of {upload['total_size']} bytes", 409)
+        staging_path = self._staging_path(upload_id)
+        with self._lock:
+            hashed, hasher = self._hashers.pop(upload_id, (None, None))
+        if hashed == upload['received']:
+            digest = self.store.adopt(staging_path, hasher.hexdigest())
+        else:
+            digest = self.store.put_file(staging_path)
+            os.remove(staging_path)
+        with self._connect() as conn:
+            conn.execute('DELETE FROM uploads WHERE id = ?', (upload_id,))
+        logging.debug(f"Completed upload {upload_id} for {upload['filename']}: {digest}")
+        return upload, digest
+
+    def abort(self, upload_id):
+        self.get(upload_id)
+        with self._lock:
+            self._hashers.pop(upload_id, None)
+        staging_path = self._staging_path(upload_id)
+        if os.path.exists(staging_path):
+            os.remove(staging_path)
+        with self._connect() as conn:
+            conn.execute('DELETE FROM uploads WHERE id = ?', (upload_id,))
+
+    def expire(self, now=None):
+        # Deletes uploads the client abandoned before the last chunk, returns how many
+        cutoff = (now if now is not None else time.time()) - self.expiry_seconds
+        with self._connect() as conn:
+            expired = [row['id'] for row in conn.execute('SELECT id FROM uploads WHERE updated_at < ?', (cutoff,))]
+            conn.executemany('DELETE FROM uploads WHERE id = ?', [(upload_id,) for upload_id in expired])
+            known = {row['id'] for row in conn.execute('SELECT id FROM uploads')}
+        with self._lock:
+            for upload_id in expired:
+                self._hashers.pop(upload_id, None)
+        for name in os.listdir(self.staging_dir):
+            upload_id = os.path.splitext(name)[0]
+            path = os.path.join(self.staging_dir, name)
+            # Staging files without an upload row, left by a crash, go once they are as old
+            if upload_id in expired or (upload_id not in known and os.path.getmtime(path) < cutoff):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+        if expired:
+            UPLOADS_EXPIRED.inc(len(expired))
+            logging.info(f"Expired {len(expired)} abandoned uploads")
+        return len(expired)
@@ -0,0 +1,216 @@
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+from metrics import counter, gauge
+
+# Everything under the workspace root is deleted least recently used first once it takes more than this,
+# workspaces in use excepted
+WORKSPACE_QUOTA_BYTES = int(os.environ.get('WORKSPACE_QUOTA_BYTES', 2 * 1024 * 1024 * 1024))  # 2 GB
+# How often the background thread measures the directories and evicts
+WORKSPACE_SWEEP_SECONDS = float(os.environ.get('WORKSPACE_SWEEP_SECONDS', 60))
+# Entries this process did not create, such as other server processes' workspaces or files left by earlier
+# versions, are only evicted once nothing in them changed for this long. Owners touch their workspaces every sweep.
+WORKSPACE_IDLE_SECONDS = float(os.environ.get('WORKSPACE_IDLE_SECONDS', 600))
+
+DISK_USAGE_BYTES = gauge('disk_usage_bytes', 'Bytes used by each data directory, measured by the workspace sweeper', ['directory'])
+DISK_FREE_BYTES = gauge('disk_free_bytes', 'Free bytes on the volume holding the workspaces')
+WORKSPACE_EVICTIONS = counter('workspace_evictions_total', 'Workspaces deleted to keep the workspace root under its quota')
+
+
+def measure(path):
+    # Bytes used by a file or directory tree and the newest modification time in it
+    try:
+        stat = os.stat(path, follow_symlinks=False)
+    except FileNotFoundError:
+        return 0, 0
+    if not os.path.isdir(path) or os.path.islink(path):
+        return stat.st_size, stat.st_mtime
+    size, modified = 0, stat.st_mtime
+    for directory, _, files in os.walk(path):
+        for name in files:
+            try:
+                stat = os.stat(os.path.join(directory, name), follow_symlinks=False)
+            except FileNotFoundError:
+                continue
+            size += stat.st_size
+            modified = max(modified, stat.st_mtime)
+    return size, modified
+
+
+def remove(path):
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path, ignore_errors=True)
+    else:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+class Workspace:
+    """A scratch directory of its own for one request or job."""
+
+    def __init__(self, manager, path):
+        self.manager = manager
+        self.path = path
+        self.size = 0
+        self.last_access = time.time()
+        self.in_use = True
+
+    def file(self, name):
+        self.last_access = time.time()
+        return os.path.join(self.path, name)
+
+    def release(self, keep=False):
+        self.manager.release(self, keep)
+
+
+class WorkspaceManager:
+    """Hands every request a unique scratch directory and keeps the root under a disk quota.
+
+    Workspaces are deleted when released, unless kept, as failed conversions
+    are for inspection. A background thread measures the root every
+    ``sweep_seconds`` and deletes released workspaces, least recently used
+    first, while the root is over ``quota_bytes``. Anything else under the
+    root, left by an earlier version or a crashed process, is evicted the
+    same way once idle. Other directories passed as ``report`` are measured
+    along with it, so the disk usage of the whole node is reported in one
+    place, and the ``housekeeping`` callables, such as expiring abandoned
+    uploads, run on every sweep.
+    """
+
+    def __init__(self, root, quota_bytes=WORKSPACE_QUOTA_BYTES, sweep_seconds=WORKSPACE_SWEEP_SECONDS,
+                 idle_seconds=WORKSPACE_IDLE_SECONDS, report=None, housekeeping=()):
+        self.root = root
+        self.quota_bytes = quota_bytes
+        self.sweep_seconds = sweep_seconds
+        self.idle_seconds = idle_seconds
+        self.report = dict(report or {})
+        self.housekeeping = list(housekeeping)
+        self.evicted = 0
+        self._workspaces = {}
+        self._usage = {}
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+        if not os.path.exists(root):
+            os.makedirs(root)
+
+    def create(self, prefix='work-'):
+        with self._lock:
+            workspace = Workspace(self, tempfile.mkdtemp(dir=self.root, prefix=prefix))
+            self._workspaces[workspace.path] = workspace
+        return workspace
+
+    def release(self, workspace, keep=False):
+        with self._lock:
+            workspace.in_use = False
+            workspace.last_access = time.time()
+            if not keep:
+                self._workspaces.pop(workspace.path, None)
+        if not keep:
+            remove(workspace.path)
+
+    @contextmanager
+    def workspace(self, prefix='work-'):
+        workspace = self.create(prefix)
+        try:
+            yield workspace
+        finally:
+            self.release(workspace)
+
+    def sweep(self, now=None):
+        # Returns the number of entries evicted
+        now = now if now is not None else time.time()
+        entries = []
+        for entry in os.scandir(self.root):
+            size, modified = measure(entry.path)
+            with self._lock:
+                workspace = self._workspaces.get(entry.path)
+                if workspace is not None:
+                    workspace.size = size
+                    in_use, last_access = workspace.in_use, max(workspace.last_access, modified)
+                else:
+                    in_use, last_access = modified > now - self.idle_seconds, modified
+            if in_use and workspace is not None:
+                # Server processes sharing the root see this workspace as recently used
+                os.utime(entry.path)
+            entries.append((last_access, size, entry.path, in_use))
+
+        with self._lock:
+            # Kept workspaces deleted by hand are forgotten
+            found = {path for _, _, path, _ in entries}
+            for path in [path for path, workspace in self._workspaces.items() if not workspace.in_use and path not in found]:
+                del self._workspaces[path]
+
+        total = sum(size for _, size, _, _ in entries)
+        evicted = 0
+        for last_access, size, path, in_use in sorted(entries):
+            if total <= self.quota_bytes:
+                break
+            with self._lock:
+                workspace = self._workspaces.get(path)
+                if in_use or (workspace is not None and workspace.in_use):
+                    continue
+                self._workspaces.pop(path, None)
+            remove(path)
+            total -= size
+            evicted += 1
+            logging.debug(f"Evicted workspace {path}, last used {now - last_access:.0f}s ago")
+        if evicted:
+            WORKSPACE_EVICTIONS.inc(evicted)
+            logging.info(f"Evicted {evicted} workspaces to stay under {self.quota_bytes} bytes")
+
+        for task in self.housekeeping:
+            try:
+                task()
+            except Exception:
+                logging.exception(f"Housekeeping task {getattr(task, '__name__', task)} failed")
+
+        usage = {'workspaces': total}
+        for name, directory in self.report.items():
+            usage[name] = measure(directory)[0]
+        for name, size in usage.items():
+            DISK_USAGE_BYTES.set(size, directory=name)
+        free = shutil.disk_usage(self.root).free
+        DISK_FREE_BYTES.set(free)
+        with self._lock:
+            self.evicted += evicted
+            self._usage = {'directories': usage, 'free_bytes': free, 'entries': len(entries) - evicted, 'measured_at': now}
+        return evicted
+
+    def usage(self):
+        # Bytes per directory as of the last sweep, and the workspaces of this process
+        with self._lock:
+            workspaces = list(self._workspaces.values())
+            usage = dict(self._usage)
+            evicted = self.evicted
+        return dict(usage, root=self.root, quota_bytes=self.quota_bytes, evicted=evicted,
+                    in_use=sum(1 for workspace in workspaces if workspace.in_use),
+                    kept=sum(1 for workspace in workspaces if not workspace.in_use))
+
+    def start(self):
+        if self._thread is None:
+            self._stopped.clear()
+            self._thread = threading.Thread(target=self._run, name='workspace-sweeper', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                self.sweep()
+            except Exception:
+                logging.exception("Workspace sweep failed")
+            if self._stopped.wait(self.sweep_seconds):
+                return
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None